@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class CaffeineConfig(AppConfig):
+    name = "caffeine"
+
+    def ready(self):
+        from . import signals  # noqa
@@ -7,6 +7,7 @@ from datetime import datetime
 
 from django import forms
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_registration.forms import RegistrationFormUniqueEmail
@@ -128,24 +129,20 @@ class SelectTimeZoneForm(forms.ModelForm):
             raise forms.ValidationError(INVALID_TIMEZONE_ERROR)
 
 
-class SubmitCaffeineForm(forms.ModelForm):
+class SubmitCaffeineForm(forms.Form):
     """
-    This is the form for new caffeine submissions.
+    This is the form for new caffeine submissions. The minimum distance to
+    the previous drink of the same type is checked by the database when the
+    entry is saved.
 
     """
 
     date = forms.DateField(required=False)
     time = forms.TimeField(required=False)
 
-    class Meta:
-        model = Caffeine
-        fields = []
-
     def __init__(self, user, ctype, *args, **kwargs):
         super(SubmitCaffeineForm, self).__init__(*args, **kwargs)
-        self.instance.ctype = ctype
-        self.instance.user = user
-        self.instance.timezone = user.timezone
+        self.instance = Caffeine(ctype=ctype, user=user, timezone=user.timezone)
 
     def clean(self):
         if self.cleaned_data["date"] is None or self.cleaned_data["time"] is None:
@@ -163,3 +160,21 @@ class SubmitCaffeineForm(forms.ModelForm):
                 self.cleaned_data["date"], self.cleaned_data["time"]
             )
         return super(SubmitCaffeineForm, self).clean()
+
+    def save(self):
+        """
+        Save the caffeine entry. If the entry is too close to a previous
+        drink the error is added to the form.
+
+        :return: the saved caffeine entry or None
+        """
+        if self.errors:
+            raise ValueError(
+                "The caffeine entry could not be created because the data "
+                "didn't validate."
+            )
+        try:
+            return Caffeine.objects.create_unless_recent(self.instance)
+        except ValidationError as error:
+            self.add_error(None, error)
+            return None
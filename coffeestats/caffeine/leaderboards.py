@@ -0,0 +1,109 @@
+"""
+Cached leaderboards for the explore page.
+
+Every section of the explore page, consisting of one or more context entries,
+is stored in the Django cache together with the time it has been computed.
+Changes to caffeine entries and users record the time of the last change in
+the cache. A section is computed again if it is not in the cache anymore or if
+it is older than the last change and its refresh interval has passed. While
+one process computes a stale section again the other processes keep serving
+the stale value.
+
+The hard timeouts and refresh intervals of the sections are configured in
+``settings.EXPLORE_CACHE_TIMEOUTS``.
+
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import DRINK_TYPES, Caffeine, User
+
+CACHE_KEY_PREFIX = "explore:"
+CHANGED_KEY = CACHE_KEY_PREFIX + "changed"
+LOCK_TIMEOUT = 30
+
+
+def _per_type(names, leaderboard):
+    """
+    Map the per drink type results of a leaderboard to context names.
+
+    """
+    return {name: leaderboard[getattr(DRINK_TYPES, ctype)] for ctype, name in names}
+
+
+SECTIONS = {
+    "activities": lambda: {
+        "activities": list(Caffeine.objects.latest_caffeine_activity(10))
+    },
+    "toptotal": lambda: _per_type(
+        (("coffee", "topcoffee"), ("mate", "topmate")),
+        Caffeine.objects.top_consumers_total_per_type(10),
+    ),
+    "topaverage": lambda: _per_type(
+        (("coffee", "topcoffeeavg"), ("mate", "topmateavg")),
+        Caffeine.objects.top_consumers_average_per_type(10),
+    ),
+    "toprecent": lambda: _per_type(
+        (("coffee", "topcoffeerecent"), ("mate", "topmaterecent")),
+        Caffeine.objects.top_consumers_recent_per_type(10, interval="30 days"),
+    ),
+    "recentlyjoined": lambda: {"recentlyjoined": list(User.objects.recently_joined(5))},
+    "longestjoined": lambda: {
+        "longestjoined": list(User.objects.longest_joined(count=5, days=365))
+    },
+}
+
+
+def _section_key(name):
+    return CACHE_KEY_PREFIX + name
+
+
+def mark_changed():
+    """
+    Record that caffeine entries or users have changed to let the cached
+    sections expire after their refresh interval.
+
+    """
+    cache.set(CHANGED_KEY, time.time(), None)
+
+
+def _compute_section(name):
+    computed = time.time()
+    value = SECTIONS[name]()
+    timeout = settings.EXPLORE_CACHE_TIMEOUTS[name][0]
+    cache.set(_section_key(name), (computed, value), timeout)
+    return value
+
+
+def get_leaderboards():
+    """
+    Return the explore page sections from the cache, computing missing and
+    expired sections.
+
+    :return: dictionary mapping context names to their values
+    """
+    keys = [_section_key(name) for name in SECTIONS]
+    cached = cache.get_many(keys + [CHANGED_KEY])
+    changed = cached.get(CHANGED_KEY, 0)
+    now = time.time()
+    result = {}
+    for name, key in zip(SECTIONS, keys):
+        if key not in cached:
+            result.update(_compute_section(name))
+            continue
+        computed, value = cached[key]
+        refresh_interval = settings.EXPLORE_CACHE_TIMEOUTS[name][1]
+        if (
+            computed < changed
+            and now - computed >= refresh_interval
+            and cache.add(key + ":lock", True, LOCK_TIMEOUT)
+        ):
+            try:
+                value = _compute_section(name)
+            finally:
+                cache.delete(key + ":lock")
+        result.update(value)
+    return result
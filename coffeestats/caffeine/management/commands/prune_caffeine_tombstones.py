@@ -0,0 +1,20 @@
+"""
+Management command to delete expired records of deleted caffeine entries.
+
+"""
+
+from django.core.management.base import BaseCommand
+
+from caffeine.models import CaffeineTombstone
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the records of deleted caffeine entries that are older than "
+        "API_SYNC_TOMBSTONE_DAYS days."
+    )
+
+    def handle(self, *args, **options):
+        pruned = CaffeineTombstone.objects.prune()
+        if options["verbosity"] > 1:
+            self.stdout.write("Deleted %d tombstones" % pruned)
@@ -0,0 +1,45 @@
+"""
+Management command to (re)build the caffeine statistics tables from the
+caffeine entries.
+
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from caffeine.models import CaffeineHistogram, CaffeineRollup, CaffeineSummary, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the per-user caffeine statistics from the caffeine entries. "
+        "Submissions are blocked while the rebuild is running."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "usernames",
+            nargs="*",
+            metavar="username",
+            help="restrict the rebuild to the given users",
+        )
+
+    def handle(self, *args, **options):
+        users = [None]
+        if options["usernames"]:
+            users = list(User.objects.filter(username__in=options["usernames"]))
+            missing = set(options["usernames"]) - set(u.username for u in users)
+            if missing:
+                raise CommandError("Unknown users: %s" % ", ".join(sorted(missing)))
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute("LOCK TABLE caffeine_caffeine IN SHARE MODE")
+            for user in users:
+                CaffeineRollup.objects.rebuild(user)
+                CaffeineHistogram.objects.rebuild(user)
+                CaffeineSummary.objects.rebuild(user)
+                if options["verbosity"] > 1:
+                    self.stdout.write(
+                        "Rebuilt statistics for %s" % (user or "all users")
+                    )
+        self.stdout.write(self.style.SUCCESS("Caffeine statistics rebuilt."))
@@ -0,0 +1,43 @@
+"""
+Management command to refresh the overall statistics snapshot.
+
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from caffeine.models import OverallStatistics
+
+
+class Command(BaseCommand):
+    help = (
+        "Count caffeine entries added since the last run into the overall "
+        "statistics snapshot."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="keep running and refresh every INTERVAL seconds",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="discard the snapshot and count all caffeine entries",
+        )
+
+    def handle(self, *args, **options):
+        rebuild = options["rebuild"]
+        while True:
+            snapshot = OverallStatistics.objects.refresh(rebuild=rebuild)
+            if options["verbosity"] > 1:
+                self.stdout.write(
+                    "Counted caffeine entries until %s" % snapshot.entrytime_until
+                )
+            if not options["interval"]:
+                break
+            rebuild = False
+            time.sleep(options["interval"])
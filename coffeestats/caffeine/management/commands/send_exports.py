@@ -0,0 +1,31 @@
+"""
+Management command to send the queued caffeine exports.
+
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from caffeine.models import PendingExport
+
+
+class Command(BaseCommand):
+    help = "Send the queued caffeine exports by email."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="keep running and send queued exports every INTERVAL seconds",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent = PendingExport.objects.process()
+            if options["verbosity"] > 1:
+                self.stdout.write("Sent %d exports" % sent)
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -15,14 +15,23 @@ class EnforceTimezoneMiddleware:
         self.get_response = get_response
 
     def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
         """
         Redirects to the time zone selection vie and passes the originally
         requested URL to that view if the current user does not have a time
-        zone set.
+        zone set. Views marked with :py:func:`core.utils.session_exempt` are
+        skipped to not load the session and the user for them.
 
         :param HttpRequest request: the current request
+        :param view_func: the view that handles the request
+        :param view_args: positional view arguments
+        :param view_kwargs: keyword view arguments
         :return: redirect or None
         """
+        if getattr(view_func, "session_exempt", False):
+            return None
         timezone_path = reverse("select_timezone")
         if (
             request.user.is_authenticated
@@ -33,4 +42,4 @@ class EnforceTimezoneMiddleware:
             return HttpResponseRedirect(
                 timezone_path + "?next=" + quote_plus(request.get_full_path())
             )
-        return self.get_response(request)
+        return None
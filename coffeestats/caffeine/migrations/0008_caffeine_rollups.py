@@ -0,0 +1,90 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("caffeine", "0007_auto_20240515_1932"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CaffeineRollup",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "ctype",
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, "Coffee"), (1, "Mate")]
+                    ),
+                ),
+                (
+                    "period",
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, "Hour"), (1, "Day"), (2, "Month")]
+                    ),
+                ),
+                ("bucket", models.DateTimeField()),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "period", "bucket", "ctype")},
+            },
+        ),
+        migrations.CreateModel(
+            name="CaffeineHistogram",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "ctype",
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, "Coffee"), (1, "Mate")]
+                    ),
+                ),
+                ("hour", models.PositiveSmallIntegerField()),
+                ("weekday", models.PositiveSmallIntegerField()),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "ctype", "hour", "weekday")},
+            },
+        ),
+    ]
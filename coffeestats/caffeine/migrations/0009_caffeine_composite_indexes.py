@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:51
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # the indexes are built concurrently to not block writes on large tables
+    atomic = False
+
+    dependencies = [
+        ("caffeine", "0008_caffeine_rollups"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="caffeine",
+            index=models.Index(
+                fields=["user", "ctype", "date"], name="caffeine_user_ctype_date_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="caffeine",
+            index=models.Index(
+                fields=["user", "entrytime"], name="caffeine_user_entrytime_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="caffeine",
+            index=models.Index(
+                fields=["date"], include=("ctype",), name="caffeine_date_ctype_idx"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="caffeine",
+            name="ctype",
+            field=models.PositiveSmallIntegerField(
+                choices=[(0, "Coffee"), (1, "Mate")]
+            ),
+        ),
+        migrations.AlterField(
+            model_name="caffeine",
+            name="date",
+            field=models.DateTimeField(verbose_name="consumed"),
+        ),
+        migrations.AlterField(
+            model_name="caffeine",
+            name="timezone",
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AlterField(
+            model_name="caffeine",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="caffeines",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("caffeine", "0009_caffeine_composite_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OverallStatistics",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "entrytime_until",
+                    models.DateTimeField(
+                        null=True, verbose_name="counted entries until"
+                    ),
+                ),
+                (
+                    "refreshed",
+                    models.DateTimeField(null=True, verbose_name="refreshed"),
+                ),
+                ("counters", models.JSONField(default=dict)),
+            ],
+            options={
+                "verbose_name_plural": "overall statistics",
+            },
+        ),
+    ]
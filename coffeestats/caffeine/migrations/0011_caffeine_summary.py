@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("caffeine", "0010_overall_statistics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CaffeineSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "ctype",
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, "Coffee"), (1, "Mate")]
+                    ),
+                ),
+                ("count", models.IntegerField(default=0)),
+                ("first", models.DateTimeField(null=True)),
+                ("last", models.DateTimeField(null=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "caffeine summaries",
+                "unique_together": {("user", "ctype")},
+            },
+        ),
+    ]
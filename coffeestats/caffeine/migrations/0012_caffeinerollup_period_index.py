@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:05
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the index is built concurrently to not block writes on large tables
+    atomic = False
+
+    dependencies = [
+        ("caffeine", "0011_caffeine_summary"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="caffeinerollup",
+            index=models.Index(
+                fields=["period", "bucket"],
+                include=("user", "ctype", "count"),
+                name="caffeinerollup_period_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:10
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the index is built concurrently to not block writes on large tables
+    atomic = False
+
+    dependencies = [
+        ("caffeine", "0012_caffeinerollup_period_index"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="caffeine",
+            index=models.Index(
+                fields=["user", "date", "id"], name="caffeine_user_date_idx"
+            ),
+        ),
+    ]
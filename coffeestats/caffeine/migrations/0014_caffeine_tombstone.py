@@ -0,0 +1,56 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("caffeine", "0013_caffeine_user_date_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CaffeineTombstone",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("caffeine_id", models.IntegerField()),
+                (
+                    "deleted",
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="deleted",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "deleted"], name="caffeinetombstone_user_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("caffeine", "0015_pending_export"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OverallStatisticsDelta",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "ctype",
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, "Coffee"), (1, "Mate")]
+                    ),
+                ),
+                ("hour", models.DateTimeField()),
+                ("entrytime", models.DateTimeField(db_index=True)),
+                ("count", models.IntegerField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:59
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("caffeine", "0016_overall_statistics_delta"),
+    ]
+
+    operations = [
+        # the column is added without a default to not rewrite the table,
+        # existing entries are filled by 0019_caffeine_modified_backfill
+        migrations.AddField(
+            model_name="caffeine",
+            name="modified",
+            field=models.DateTimeField(
+                editable=False, null=True, verbose_name="modified"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="caffeine",
+            name="modified",
+            field=model_utils.fields.AutoLastModifiedField(
+                default=django.utils.timezone.now,
+                editable=False,
+                null=True,
+                verbose_name="modified",
+            ),
+        ),
+    ]
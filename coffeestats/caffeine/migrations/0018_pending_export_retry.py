@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("caffeine", "0017_caffeine_modified"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pendingexport",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(default=0, verbose_name="attempts"),
+        ),
+        migrations.AddField(
+            model_name="pendingexport",
+            name="retry_after",
+            field=models.DateTimeField(
+                db_index=True,
+                default=django.utils.timezone.now,
+                verbose_name="retry after",
+            ),
+        ),
+    ]
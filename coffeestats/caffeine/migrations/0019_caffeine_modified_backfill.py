@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import F, Max
+
+BATCH_SIZE = 10000
+
+
+def backfill_modified(apps, schema_editor):
+    """
+    Set the modification time of existing caffeine entries to the time they
+    have been entered. Every batch of ids is updated in its own transaction.
+
+    """
+    Caffeine = apps.get_model("caffeine", "Caffeine")
+    start = 0
+    while True:
+        last_id = Caffeine.objects.aggregate(last_id=Max("id"))["last_id"]
+        if last_id is None or start >= last_id:
+            break
+        for batch_start in range(start, last_id, BATCH_SIZE):
+            Caffeine.objects.filter(
+                id__gt=batch_start,
+                id__lte=min(batch_start + BATCH_SIZE, last_id),
+                modified__isnull=True,
+            ).update(modified=F("entrytime"))
+        # entries added while updating are covered by the next pass
+        start = last_id
+
+
+class Migration(migrations.Migration):
+    # existing entries are updated in batches to not block writes on large
+    # tables
+    atomic = False
+
+    dependencies = [
+        ("caffeine", "0018_pending_export_retry"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_modified, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the index is built concurrently to not block writes on large tables
+    atomic = False
+
+    dependencies = [
+        ("caffeine", "0019_caffeine_modified_backfill"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="caffeine",
+            index=models.Index(
+                fields=["user", "modified", "id"], name="caffeine_user_modified_idx"
+            ),
+        ),
+    ]
@@ -1,21 +1,31 @@
 from __future__ import unicode_literals
 
 import csv
+import gzip
+import logging
+from bisect import bisect_left, insort
 from calendar import monthrange
-from datetime import timedelta
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
 from hashlib import md5
-from io import StringIO
+from io import StringIO, TextIOWrapper
+from tempfile import TemporaryFile
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.exceptions import ValidationError
 from django.core.mail import EmailMessage
-from django.db import connection, models
+from django.db import connection, models, transaction
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from model_utils import Choices
-from model_utils.fields import AutoCreatedField
+from model_utils.fields import AutoCreatedField, AutoLastModifiedField
+
+logger = logging.getLogger(__name__)
 
 DRINK_TYPES = Choices((0, "coffee", _("Coffee")), (1, "mate", _("Mate")))
 
@@ -23,6 +33,22 @@ ACTION_TYPES = Choices((0, "change_email", _("Change email")))
 
 WEEKDAY_LABELS = (_("Mon"), _("Tue"), _("Wed"), _("Thu"), _("Fri"), _("Sat"), _("Sun"))
 
+# sent with the list of created caffeine entries as ``caffeines`` after
+# caffeine entries have been created in bulk, which does not send post_save
+caffeines_created = Signal()
+
+# number of random positions in the user id range per requested random user
+RANDOM_USERS_OVERSAMPLING = 3
+# first key of the advisory locks that serialize drink submissions per user
+DRINK_LOCK_NAMESPACE = 1
+
+# user fields fetched along with leaderboard entries
+LEADERBOARD_USER_FIELDS = ("id", "username", "first_name", "last_name")
+
+ROLLUP_PERIODS = Choices(
+    (0, "hour", _("Hour")), (1, "day", _("Day")), (2, "month", _("Month"))
+)
+
 
 class CaffeineUserManager(BaseUserManager):
     def _create_user(self, username, email, password, **kwargs):
@@ -73,20 +99,87 @@ class CaffeineUserManager(BaseUserManager):
         )
 
     def random_users(self, count=4):
-        users = self.raw(
-            """
-            SELECT u.*,
-            (SELECT COUNT(id) FROM caffeine_caffeine
-             WHERE u.id=user_id AND ctype={0:d}) AS coffees,
-            (SELECT COUNT(id) FROM caffeine_caffeine
-             WHERE u.id=user_id AND ctype={1:d}) AS mate
-            FROM caffeine_user u ORDER BY RANDOM() LIMIT {2:d}
+        """
+        Return random users with their total number of coffees and mate as
+        ``coffees`` and ``mate`` attributes.
+
+        Users are picked at random positions of the user id range to avoid
+        sorting the whole user table. Only if this yields less users than
+        requested, which happens for small user tables, all users are sorted
+        randomly.
+
+        :param int count: number of users
+        :return: list of User instances
+        """
+        counts = """
+            COALESCE((SELECT count FROM caffeine_caffeinesummary
+             WHERE u.id=user_id AND ctype={0:d}), 0) AS coffees,
+            COALESCE((SELECT count FROM caffeine_caffeinesummary
+             WHERE u.id=user_id AND ctype={1:d}), 0) AS mate
             """.format(
-                DRINK_TYPES.coffee, DRINK_TYPES.mate, count
+            DRINK_TYPES.coffee, DRINK_TYPES.mate
+        )
+        users = list(
+            self.raw(
+                """
+                WITH picks AS MATERIALIZED (
+                  SELECT (b.low + floor(random() * (b.high - b.low + 1)))::integer
+                         AS pick
+                  FROM   (SELECT MIN(id) AS low, MAX(id) AS high
+                          FROM caffeine_user) AS b,
+                         generate_series(1, %s)
+                )
+                SELECT u.*, {0}
+                FROM   caffeine_user u
+                WHERE  u.id IN (
+                  SELECT n.id
+                  FROM   picks p,
+                  LATERAL (SELECT id FROM caffeine_user
+                           WHERE id >= p.pick ORDER BY id LIMIT 1) AS n
+                )
+                ORDER BY RANDOM() LIMIT %s
+                """.format(
+                    counts
+                ),
+                [count * RANDOM_USERS_OVERSAMPLING, count],
             )
         )
+        if len(users) < count:
+            users = list(
+                self.raw(
+                    """
+                    SELECT u.*, {0}
+                    FROM caffeine_user u ORDER BY RANDOM() LIMIT %s
+                    """.format(
+                        counts
+                    ),
+                    [count],
+                )
+            )
         return users
 
+    def with_caffeine_counts(self):
+        """
+        Return users annotated with their total number of drinks per drink
+        type from the per-user summaries. The annotations are named after
+        the drink types with a ``_count`` suffix, e.g. ``coffee_count``.
+
+        :return: annotated queryset
+        """
+        return self.annotate(
+            **{
+                "{0}_count".format(attr): Coalesce(
+                    models.Subquery(
+                        CaffeineSummary.objects.filter(
+                            user=models.OuterRef("pk"), ctype=ctype
+                        ).values("count")[:1]
+                    ),
+                    0,
+                )
+                for ctype, attr, _ in DRINK_TYPES._triples
+            }
+        )
+
     def recently_joined(self, count=5):
         return self.order_by("-date_joined")[:count]
 
@@ -104,10 +197,10 @@ class CaffeineUserManager(BaseUserManager):
                 SELECT u.*
                 FROM   caffeine_user u
                 WHERE EXISTS (
-                  SELECT c.id
-                  FROM   caffeine_caffeine c
-                  WHERE  c.user_id = u.id
-                  AND    c.date >= CURRENT_DATE - INTERVAL '{0:d} days'
+                  SELECT s.id
+                  FROM   caffeine_caffeinesummary s
+                  WHERE  s.user_id = u.id
+                  AND    s.last >= CURRENT_DATE - INTERVAL '{0:d} days'
                 )
                 ORDER BY u.date_joined
                 LIMIT {1:d}
@@ -141,18 +234,29 @@ class User(AbstractUser):
         return self.get_full_name() or self.username
 
     def export_csv(self):
+        """
+        Send the caffeine entries of the user as gzip compressed CSV files by
+        email. The entries are streamed into temporary files, only the
+        compressed files are read into memory because Django builds the
+        whole message in memory before sending it.
+
+        """
         subject = _("Your caffeine records")
         body = _("Attached is your caffeine track record.")
         email = EmailMessage(subject, body, to=[self.email])
         now = timezone.now().strftime(settings.CAFFEINE_DATETIME_FORMAT)
         for drink in ("coffee", "mate"):
-            email.attachments.append(
-                (
-                    "%s-%s.csv" % (drink, now),
-                    Caffeine.objects.get_csv_data(getattr(DRINK_TYPES, drink), self),
-                    "text/csv",
+            with TemporaryFile() as tmpfile:
+                with gzip.GzipFile(fileobj=tmpfile, mode="wb") as gzfile:
+                    textfile = TextIOWrapper(gzfile, encoding="utf8", newline="")
+                    csv.writer(textfile).writerows(
+                        Caffeine.objects.csv_rows(getattr(DRINK_TYPES, drink), self)
+                    )
+                    textfile.detach()
+                tmpfile.seek(0)
+                email.attachments.append(
+                    ("%s-%s.csv.gz" % (drink, now), tmpfile.read(), "application/gzip")
                 )
-            )
         email.send()
 
     def has_usable_password(self):
@@ -176,6 +280,12 @@ class User(AbstractUser):
             self.token = md5((self.username + password).encode("utf8")).hexdigest()
 
 
+def _drink_types(ctypes=None):
+    if ctypes is None:
+        return [ctype for ctype, _ in DRINK_TYPES]
+    return list(ctypes)
+
+
 def _total_result_dict():
     return {DRINK_TYPES.mate: 0, DRINK_TYPES.coffee: 0}
 
@@ -224,6 +334,170 @@ def _weekdaily_result_dict():
     return result
 
 
+def _day_window(reference):
+    """
+    Return the half-open ``[start, end)`` range of the day containing the
+    reference time.
+
+    """
+    start = reference.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1)
+
+
+def _month_window(reference):
+    """
+    Return the half-open ``[start, end)`` range of the month containing the
+    reference time.
+
+    """
+    start, _ = _day_window(reference.replace(day=1))
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+def _year_window(reference):
+    """
+    Return the half-open ``[start, end)`` range of the year containing the
+    reference time.
+
+    """
+    start, _ = _month_window(reference.replace(month=1))
+    return start, start.replace(year=start.year + 1)
+
+
+def _after_position(queryset, field_name, position):
+    """
+    Order entries by a time field and their id and filter the ones following
+    a position in this order.
+
+    :param QuerySet queryset: entries
+    :param str field_name: name of the time field
+    :param tuple position: (time, id) tuple or None to start with the first
+        entry
+    :return: QuerySet
+    """
+    queryset = queryset.order_by(field_name, "id")
+    if position is None:
+        return queryset
+    time, pk = position
+    return queryset.filter(
+        Q(**{field_name + "__gt": time}) | Q(**{field_name: time, "id__gt": pk})
+    )
+
+
+def _rollup_counts(caffeines):
+    """
+    Count caffeine entries into the calendar buckets of their users.
+
+    :param caffeines: iterable of Caffeine instances
+    :return: Counter keyed by (user_id, ctype, period, bucket)
+    """
+    counts = Counter()
+    for caffeine in caffeines:
+        hour = caffeine.date.replace(minute=0, second=0, microsecond=0)
+        day = hour.replace(hour=0)
+        for period, bucket in (
+            (ROLLUP_PERIODS.hour, hour),
+            (ROLLUP_PERIODS.day, day),
+            (ROLLUP_PERIODS.month, day.replace(day=1)),
+        ):
+            counts[(caffeine.user_id, caffeine.ctype, period, bucket)] += 1
+    return counts
+
+
+def _histogram_counts(caffeines):
+    """
+    Count caffeine entries into the hour of day and ISO weekday cells of
+    their users.
+
+    :param caffeines: iterable of Caffeine instances
+    :return: Counter keyed by (user_id, ctype, hour, weekday)
+    """
+    counts = Counter()
+    for caffeine in caffeines:
+        counts[
+            (
+                caffeine.user_id,
+                caffeine.ctype,
+                caffeine.date.hour,
+                caffeine.date.isoweekday(),
+            )
+        ] += 1
+    return counts
+
+
+def _summary_counts(caffeines):
+    """
+    Count caffeine entries and find their earliest and latest dates per user
+    and drink type.
+
+    :param caffeines: iterable of Caffeine instances
+    :return: dictionary mapping (user_id, ctype) to [count, first, last]
+    """
+    summaries = {}
+    for caffeine in caffeines:
+        summary = summaries.setdefault(
+            (caffeine.user_id, caffeine.ctype), [0, caffeine.date, caffeine.date]
+        )
+        summary[0] += 1
+        summary[1] = min(summary[1], caffeine.date)
+        summary[2] = max(summary[2], caffeine.date)
+    return summaries
+
+
+def _add_to_counters(table, columns, counts):
+    """
+    Add counts to the count column of the rows identified by columns,
+    creating missing rows.
+
+    :param str table: name of the counter table
+    :param tuple columns: names of the columns forming the unique key
+    :param Counter counts: counts keyed by tuples of column values
+    """
+    if not counts:
+        return
+    row = "({0})".format(", ".join(["%s"] * (len(columns) + 1)))
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        INSERT INTO {table} ({columns}, count)
+        VALUES {rows}
+        ON CONFLICT ({columns})
+        DO UPDATE SET count = {table}.count + EXCLUDED.count
+        """.format(
+            table=table, columns=", ".join(columns), rows=", ".join([row] * len(counts))
+        ),
+        [value for key, count in counts.items() for value in key + (count,)],
+    )
+
+
+def _subtract_from_counters(table, columns, counts):
+    """
+    Subtract counts from the count column of the rows identified by columns.
+    Rows that do not exist (anymore) are left alone.
+
+    :param str table: name of the counter table
+    :param tuple columns: names of the columns forming the unique key
+    :param Counter counts: counts keyed by tuples of column values
+    """
+    if not counts:
+        return
+    row = "({0})".format(", ".join(["%s"] * (len(columns) + 1)))
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        UPDATE {table} t SET count = t.count - v.count
+        FROM (VALUES {rows}) AS v ({columns}, count)
+        WHERE {match}
+        """.format(
+            table=table,
+            columns=", ".join(columns),
+            rows=", ".join([row] * len(counts)),
+            match=" AND ".join("t.{0} = v.{0}".format(column) for column in columns),
+        ),
+        [value for key, count in counts.items() for value in key + (count,)],
+    )
+
+
 class CaffeineManager(models.Manager):
     """
     Manager class for Caffeine.
@@ -238,17 +512,9 @@ class CaffeineManager(models.Manager):
         :return: result dictionary
         """
         result = _total_result_dict()
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            SELECT COUNT(ctype), ctype
-            FROM caffeine_caffeine
-            WHERE user_id = %s
-            GROUP BY ctype
-            """,
-            [user.id],
-        )
-        for ctcount, ctype in cursor.fetchall():
+        for ctype, ctcount in CaffeineSummary.objects.filter(user=user).values_list(
+            "ctype", "count"
+        ):
             result[ctype] = ctcount
         return result
 
@@ -282,154 +548,149 @@ class CaffeineManager(models.Manager):
         """
         return self.filter(user=user).order_by("-entrytime")[:count]
 
-    def hourly_caffeine_for_user(self, user):
+    def changed_after(self, user, position):
+        """
+        Return the caffeine entries of a user that have been created or
+        changed after a position in the order of their modification time
+        and id.
+
+        :param User user: user instance
+        :param tuple position: (modification time, id) tuple or None for all
+            entries
+        :return: QuerySet of caffeine entries ordered by modification time
+            and id
+        """
+        return _after_position(self.filter(user=user), "modified", position)
+
+    def hourly_caffeine_for_user(self, user, reference=None):
         """
         Return series of hourly coffees and mate on current day for user
         profile.
 
         :param User user: user instance
+        :param datetime reference: point in time within the day to show,
+            defaults to now
         :return: result dictionary
         """
         result = _hour_result_dict()
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            SELECT ctype, COUNT(id) AS value,
-                   date_part('hour', date) AS hour
-            FROM   caffeine_caffeine
-            WHERE  date_trunc('day', CURRENT_TIMESTAMP) =
-                   date_trunc('day', date)
-                   AND user_id = %s
-            GROUP BY hour, ctype
-            """,
-            [user.id],
-        )
-        for ctype, value, hour in cursor.fetchall():
+        start, end = _day_window(reference or timezone.now())
+        for ctype, bucket, value in CaffeineRollup.objects.window(
+            user, ROLLUP_PERIODS.hour, start, end
+        ):
             result["maxvalue"] = max(value, result["maxvalue"])
-            result[DRINK_TYPES._triples[ctype][1]][int(hour)] = value
+            result[DRINK_TYPES._triples[ctype][1]][bucket.hour] = value
         return result
 
-    def hourly_caffeine(self):
+    def hourly_caffeine(self, reference=None):
         """
         Return series of hourly coffees and mate on current day for all users.
 
+        :param datetime reference: point in time within the day to show,
+            defaults to now
         :return: result dictionary
         """
         result = _hour_result_dict()
         cursor = connection.cursor()
         cursor.execute(
             """
-            SELECT ctype, COUNT(id) AS value,
+            SELECT ctype, COUNT(*) AS value,
                    date_part('hour', date) AS hour
             FROM   caffeine_caffeine
-            WHERE  date_trunc('day', CURRENT_TIMESTAMP) =
-                   date_trunc('day', date)
+            WHERE  date >= %s AND date < %s
             GROUP BY hour, ctype
             """,
-            [],
+            list(_day_window(reference or timezone.now())),
         )
         for ctype, value, hour in cursor.fetchall():
             result["maxvalue"] = max(value, result["maxvalue"])
             result[DRINK_TYPES._triples[ctype][1]][int(hour)] = value
         return result
 
-    def daily_caffeine_for_user(self, user):
+    def daily_caffeine_for_user(self, user, reference=None):
         """
         Return series of daily coffees and mate in current month for user
         profile.
 
         :param User user: user instance
+        :param datetime reference: point in time within the month to show,
+            defaults to now
         :return: result dictionary
         """
-        result = _month_result_dict(timezone.now())
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            SELECT ctype, COUNT(id) AS value,
-                   date_part('day', date) AS day
-            FROM   caffeine_caffeine
-            WHERE  date_trunc('month', CURRENT_TIMESTAMP) =
-                   date_trunc('month', date)
-                   AND user_id = %s
-            GROUP BY day, ctype
-            """,
-            [user.id],
-        )
-        for ctype, value, day in cursor.fetchall():
+        reference = reference or timezone.now()
+        result = _month_result_dict(reference)
+        start, end = _month_window(reference)
+        for ctype, bucket, value in CaffeineRollup.objects.window(
+            user, ROLLUP_PERIODS.day, start, end
+        ):
             result["maxvalue"] = max(value, result["maxvalue"])
-            result[DRINK_TYPES._triples[ctype][1]][int(day) - 1] = value
+            result[DRINK_TYPES._triples[ctype][1]][bucket.day - 1] = value
         return result
 
-    def daily_caffeine(self):
+    def daily_caffeine(self, reference=None):
         """
         Return series of daily coffees and mate in current month for all users.
 
+        :param datetime reference: point in time within the month to show,
+            defaults to now
         :return: result dictionary
         """
-        result = _month_result_dict(timezone.now())
+        reference = reference or timezone.now()
+        result = _month_result_dict(reference)
         cursor = connection.cursor()
         cursor.execute(
             """
-            SELECT ctype, COUNT(id) AS value,
+            SELECT ctype, COUNT(*) AS value,
                    date_part('day', date) AS day
             FROM   caffeine_caffeine
-            WHERE  date_trunc('month', CURRENT_TIMESTAMP) =
-                   date_trunc('month', date)
+            WHERE  date >= %s AND date < %s
             GROUP BY day, ctype
             """,
-            [],
+            list(_month_window(reference)),
         )
         for ctype, value, day in cursor.fetchall():
             result["maxvalue"] = max(value, result["maxvalue"])
             result[DRINK_TYPES._triples[ctype][1]][int(day) - 1] = value
         return result
 
-    def monthly_caffeine_for_user(self, user):
+    def monthly_caffeine_for_user(self, user, reference=None):
         """
         Return a series of monthly coffees and mate in the current month for
         user profile.
 
         :param User user: user instance
+        :param datetime reference: point in time within the year to show,
+            defaults to now
         :return: result dictionary
         """
         result = _year_result_dict()
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            SELECT ctype, COUNT(id) AS value,
-                   date_part('month', date) AS month
-            FROM   caffeine_caffeine
-            WHERE  date_trunc('year', CURRENT_TIMESTAMP) =
-                   date_trunc('year', date)
-                   AND user_id = %s
-            GROUP BY month, ctype
-            """,
-            [user.id],
-        )
-        for ctype, value, month in cursor.fetchall():
+        start, end = _year_window(reference or timezone.now())
+        for ctype, bucket, value in CaffeineRollup.objects.window(
+            user, ROLLUP_PERIODS.month, start, end
+        ):
             result["maxvalue"] = max(value, result["maxvalue"])
-            result[DRINK_TYPES._triples[ctype][1]][int(month) - 1] = value
+            result[DRINK_TYPES._triples[ctype][1]][bucket.month - 1] = value
         return result
 
-    def monthly_caffeine_overall(self):
+    def monthly_caffeine_overall(self, reference=None):
         """
         Return a series of monthly coffees and mate in the current month for
         all users.
 
+        :param datetime reference: point in time within the year to show,
+            defaults to now
         :return: result dictionary
         """
         result = _year_result_dict()
         cursor = connection.cursor()
         cursor.execute(
             """
-            SELECT ctype, COUNT(id) AS value,
+            SELECT ctype, COUNT(*) AS value,
                    date_part('month', date) AS month
             FROM   caffeine_caffeine
-            WHERE  date_trunc('year', CURRENT_TIMESTAMP) =
-                   date_trunc('year', date)
+            WHERE  date >= %s AND date < %s
             GROUP BY month, ctype
             """,
-            [],
+            list(_year_window(reference or timezone.now())),
         )
         for ctype, value, month in cursor.fetchall():
             result["maxvalue"] = max(value, result["maxvalue"])
@@ -445,20 +706,9 @@ class CaffeineManager(models.Manager):
         :return: result dictionary
         """
         result = _hour_result_dict()
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            SELECT ctype, COUNT(id) AS value,
-                   date_part('hour', date) AS hour
-            FROM   caffeine_caffeine
-            WHERE  user_id = %s
-            GROUP BY hour, ctype
-            """,
-            [user.id],
-        )
-        for ctype, value, hour in cursor.fetchall():
+        for ctype, hour, value in CaffeineHistogram.objects.totals(user, "hour"):
             result["maxvalue"] = max(value, result["maxvalue"])
-            result[DRINK_TYPES._triples[ctype][1]][int(hour)] = value
+            result[DRINK_TYPES._triples[ctype][1]][hour] = value
         return result
 
     def hourly_caffeine_overall(self):
@@ -493,18 +743,7 @@ class CaffeineManager(models.Manager):
         :return: result dictionary
         """
         result = _weekdaily_result_dict()
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            SELECT ctype, COUNT(id) AS value,
-                   date_part('isodow', date)::int AS wday
-            FROM   caffeine_caffeine
-            WHERE  user_id = %s
-            GROUP BY wday, ctype
-            """,
-            [user.id],
-        )
-        for ctype, value, wday in cursor.fetchall():
+        for ctype, wday, value in CaffeineHistogram.objects.totals(user, "weekday"):
             result["maxvalue"] = max(value, result["maxvalue"])
             result[DRINK_TYPES._triples[ctype][1]][wday - 1] = value
         return result
@@ -532,6 +771,86 @@ class CaffeineManager(models.Manager):
             result[DRINK_TYPES._triples[ctype][1]][wday - 1] = value
         return result
 
+    def profile_stats(self, user, reference=None):
+        """
+        Return the total and all series shown on a user's profile page using
+        a single database round trip.
+
+        :param User user: user instance
+        :param datetime reference: point in time selecting the day, month and
+            year to show, defaults to now
+        :return: dictionary with the keys ``total``, ``todaydata``,
+            ``monthdata``, ``yeardata``, ``byhourdata`` and ``byweekdaydata``
+        """
+        now = reference or timezone.now()
+        result = {
+            "total": _total_result_dict(),
+            "todaydata": _hour_result_dict(),
+            "monthdata": _month_result_dict(now),
+            "yeardata": _year_result_dict(),
+            "byhourdata": _hour_result_dict(),
+            "byweekdaydata": _weekdaily_result_dict(),
+        }
+        params = {
+            "user": user.id,
+            "hour": ROLLUP_PERIODS.hour,
+            "day": ROLLUP_PERIODS.day,
+            "month": ROLLUP_PERIODS.month,
+        }
+        params["daystart"], params["dayend"] = _day_window(now)
+        params["monthstart"], params["monthend"] = _month_window(now)
+        params["yearstart"], params["yearend"] = _year_window(now)
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            SELECT CASE r.period
+                     WHEN %(hour)s THEN 'todaydata'
+                     WHEN %(day)s THEN 'monthdata'
+                     ELSE 'yeardata'
+                   END AS series,
+                   r.ctype,
+                   CASE r.period
+                     WHEN %(hour)s THEN date_part('hour', r.bucket)
+                     WHEN %(day)s THEN date_part('day', r.bucket) - 1
+                     ELSE date_part('month', r.bucket) - 1
+                   END::int AS position,
+                   r.count AS value
+            FROM   caffeine_caffeinerollup r
+            WHERE  r.user_id = %(user)s
+                   AND ((r.period = %(hour)s
+                         AND r.bucket >= %(daystart)s
+                         AND r.bucket < %(dayend)s)
+                     OR (r.period = %(day)s
+                         AND r.bucket >= %(monthstart)s
+                         AND r.bucket < %(monthend)s)
+                     OR (r.period = %(month)s
+                         AND r.bucket >= %(yearstart)s
+                         AND r.bucket < %(yearend)s))
+            UNION ALL
+            SELECT CASE GROUPING(h.hour, h.weekday)
+                     WHEN 1 THEN 'byhourdata'
+                     WHEN 2 THEN 'byweekdaydata'
+                     ELSE 'total'
+                   END AS series,
+                   h.ctype,
+                   COALESCE(h.hour, h.weekday - 1, 0) AS position,
+                   SUM(h.count) AS value
+            FROM   caffeine_caffeinehistogram h
+            WHERE  h.user_id = %(user)s
+            GROUP BY GROUPING SETS (
+                (h.ctype), (h.ctype, h.hour), (h.ctype, h.weekday))
+            """,
+            params,
+        )
+        for series, ctype, position, value in cursor.fetchall():
+            if series == "total":
+                result["total"][ctype] = value
+                continue
+            data = result[series]
+            data["maxvalue"] = max(value, data["maxvalue"])
+            data[DRINK_TYPES._triples[ctype][1]][position] = value
+        return result
+
     def recent_caffeine_queryset(self, user, date, ctype):
         return self.filter(
             user=user,
@@ -547,71 +866,324 @@ class CaffeineManager(models.Manager):
         except Caffeine.DoesNotExist:
             return False
 
-    def latest_caffeine_activity(self, count=10):
-        return self.order_by("-date").select_related("user")[:count].all()
+    def create_unless_recent(self, caffeine):
+        """
+        Save a new caffeine entry unless there is an entry of the same user
+        and drink type less than ``settings.MINIMUM_DRINK_DISTANCE`` minutes
+        apart. The check and the insert are performed by the database under
+        a per-user advisory lock, so concurrent submissions cannot both pass
+        the check.
+
+        :param Caffeine caffeine: unsaved caffeine instance
+        :return: the saved caffeine instance
+        :raises ValidationError: if the entry is too close to an existing one
+        """
+        distance = timedelta(minutes=settings.MINIMUM_DRINK_DISTANCE)
+        caffeine.entrytime = caffeine.modified = timezone.now()
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            # both statements are sent at once, psycopg2 returns the result
+            # of the last one and the insert takes its snapshot after the
+            # lock has been acquired
+            cursor.execute(
+                """
+                SELECT pg_advisory_xact_lock(%s, %s);
+                INSERT INTO caffeine_caffeine
+                       (ctype, user_id, date, entrytime, modified, timezone)
+                SELECT %s, %s, %s, %s, %s, %s
+                WHERE  NOT EXISTS (
+                         SELECT 1
+                         FROM   caffeine_caffeine
+                         WHERE  user_id = %s AND ctype = %s
+                                AND date >= %s AND date < %s)
+                RETURNING id
+                """,
+                [
+                    DRINK_LOCK_NAMESPACE,
+                    caffeine.user_id,
+                    caffeine.ctype,
+                    caffeine.user_id,
+                    caffeine.date,
+                    caffeine.entrytime,
+                    caffeine.modified,
+                    caffeine.timezone,
+                    caffeine.user_id,
+                    caffeine.ctype,
+                    caffeine.date - distance,
+                    caffeine.date + distance,
+                ],
+            )
+            row = cursor.fetchone()
+            if row is not None:
+                caffeine.id = row[0]
+                caffeine._state.adding = False
+                caffeine._state.db = self.db
+                caffeines_created.send(sender=self.model, caffeines=[caffeine])
+                return caffeine
+        recent_caffeine = (
+            self.find_recent_caffeine(caffeine.user, caffeine.date, caffeine.ctype)
+            or caffeine
+        )
+        raise recent_caffeine.drink_frequency_error()
 
-    def top_consumers_total(self, ctype, count=10):
-        q = (
-            self.filter(ctype=ctype)
-            .select_related("user")
-            .values_list("user")
-            .annotate(caffeine_count=models.Count("id"))
-            .order_by("-caffeine_count")[:count]
-        )
-        users = User.objects.in_bulk([user for user, caffeine_count in q])
-        result = []
-        for user_id, caffeine_count in q:
-            result.append({"user": users[user_id], "caffeine_count": caffeine_count})
+    def create_for_user(self, user, entries):
+        """
+        Create caffeine entries of a user in bulk. An entry is rejected if it
+        is less than ``settings.MINIMUM_DRINK_DISTANCE`` minutes apart from
+        an existing entry or an accepted earlier entry of the batch with the
+        same drink type. The same advisory lock as in
+        :py:meth:`create_unless_recent` serializes concurrent submissions.
+
+        :param User user: user instance
+        :param list entries: dictionaries with ``ctype``, ``date`` and an
+            optional ``timezone``, the user's timezone is used if it is empty
+        :return: list with the created Caffeine instance or None for a
+            rejected entry for each entry
+        """
+        if not entries:
+            return []
+        distance = timedelta(minutes=settings.MINIMUM_DRINK_DISTANCE)
+        dates = [entry["date"] for entry in entries]
+        taken = defaultdict(list)
+        with transaction.atomic(using=self.db):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_advisory_xact_lock(%s, %s)",
+                    [DRINK_LOCK_NAMESPACE, user.id],
+                )
+            for ctype, date in (
+                self.filter(
+                    user=user,
+                    ctype__in=set(entry["ctype"] for entry in entries),
+                    date__gte=min(dates) - distance,
+                    date__lt=max(dates) + distance,
+                )
+                .order_by("date")
+                .values_list("ctype", "date")
+            ):
+                taken[ctype].append(date)
+            result = []
+            for entry in entries:
+                ctype_dates = taken[entry["ctype"]]
+                pos = bisect_left(ctype_dates, entry["date"] - distance)
+                if (
+                    pos < len(ctype_dates)
+                    and ctype_dates[pos] < entry["date"] + distance
+                ):
+                    result.append(None)
+                    continue
+                insort(ctype_dates, entry["date"])
+                result.append(
+                    self.model(
+                        user=user,
+                        ctype=entry["ctype"],
+                        date=entry["date"],
+                        timezone=entry.get("timezone") or user.timezone,
+                    )
+                )
+            created = [caffeine for caffeine in result if caffeine is not None]
+            self.bulk_create(created)
+            caffeines_created.send(sender=self.model, caffeines=created)
         return result
 
-    def top_consumers_average(self, ctype, count=10):
+    def latest_caffeine_activity(self, count=10):
+        return self.order_by("-date").select_related("user")[:count].all()
+
+    def _ranked_per_type(self, ranked, params, columns, count, ctypes):
+        """
+        Return the top users per drink type ranked by a query.
+
+        :param str ranked: SQL query returning ``user_id``, ``ctype``, a
+            ``rank`` within the drink type and the given columns
+        :param list params: parameters of the ranking query
+        :param tuple columns: names of the value columns
+        :param int count: number of users per drink type
+        :param list ctypes: ranked drink types
+        :return: dictionary mapping drink types to lists of dictionaries
+            with the ``user`` and the value columns
+        """
+        user_fields = [User._meta.get_field(name) for name in LEADERBOARD_USER_FIELDS]
         cursor = connection.cursor()
         cursor.execute(
             """
-            SELECT c.user_id,
-                COUNT(c.id) /
-                (date_part(
-                    'day',
-                    (CURRENT_DATE - MIN(c.date))) + 1) AS average
-            FROM   caffeine_caffeine c
-            WHERE  c.ctype = %s
-            GROUP BY c.user_id
-            ORDER BY average DESC
-            LIMIT %s
-            """,
-            [ctype, count],
+            SELECT r.ctype, {columns}, {user_columns}
+            FROM   ({ranked}) AS r
+            JOIN   caffeine_user u ON u.id = r.user_id
+            WHERE  r.rank <= %s
+            ORDER BY r.ctype, r.rank
+            """.format(
+                columns=", ".join("r." + column for column in columns),
+                user_columns=", ".join("u." + field.column for field in user_fields),
+                ranked=ranked,
+            ),
+            params + [count],
         )
-        q = cursor.fetchall()
-        users = User.objects.in_bulk([row[0] for row in q])
-        result = []
-        for user_id, average in q:
-            result.append({"user": users[user_id], "average": average})
+        result = {ctype: [] for ctype in ctypes}
+        for row in cursor.fetchall():
+            item = dict(zip(columns, row[1 : len(columns) + 1]))
+            item["user"] = User.from_db(
+                self.db,
+                [field.attname for field in user_fields],
+                row[len(columns) + 1 :],
+            )
+            result[row[0]].append(item)
         return result
 
-    def top_consumers_recent(
-        self, ctype, count=10, start_time=timezone.now(), interval="30 days"
+    def top_consumers_total_per_type(self, count=10, ctypes=None):
+        """
+        Return the users with the most caffeinated drinks per drink type.
+
+        :param int count: number of users per drink type
+        :param ctypes: drink types, all drink types if None
+        :return: dictionary mapping drink types to lists of dictionaries
+            with ``user`` and ``caffeine_count``
+        """
+        ctypes = _drink_types(ctypes)
+        return self._ranked_per_type(
+            """
+            SELECT user_id, ctype, count AS caffeine_count,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY ctype ORDER BY count DESC, user_id) AS rank
+            FROM   caffeine_caffeinesummary
+            WHERE  ctype = ANY(%s) AND count > 0
+            """,
+            [ctypes],
+            ("caffeine_count",),
+            count,
+            ctypes,
+        )
+
+    def top_consumers_average_per_type(self, count=10, ctypes=None):
+        """
+        Return the users with the highest daily average of caffeinated drinks
+        since their first drink per drink type.
+
+        :param int count: number of users per drink type
+        :param ctypes: drink types, all drink types if None
+        :return: dictionary mapping drink types to lists of dictionaries
+            with ``user`` and ``average``
+        """
+        ctypes = _drink_types(ctypes)
+        return self._ranked_per_type(
+            """
+            SELECT user_id, ctype, average,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY ctype ORDER BY average DESC, user_id) AS rank
+            FROM (
+                SELECT user_id, ctype,
+                       count /
+                       (date_part('day', (CURRENT_DATE - first)) + 1) AS average
+                FROM   caffeine_caffeinesummary
+                WHERE  ctype = ANY(%s) AND count > 0
+            ) AS a
+            """,
+            [ctypes],
+            ("average",),
+            count,
+            ctypes,
+        )
+
+    def top_consumers_recent_per_type(
+        self, count=10, start_time=None, interval="30 days", ctypes=None
     ):
-        cursor = connection.cursor()
-        cursor.execute(
+        """
+        Return the users with the most caffeinated drinks within an interval
+        before the start time per drink type.
+
+        The window is summed from the users' day buckets. Only the partial
+        first day is taken from hour buckets and the partial first hour from
+        the caffeine entries themselves.
+
+        :param int count: number of users per drink type
+        :param datetime start_time: end of the interval, now if None
+        :param str interval: PostgreSQL interval
+        :param ctypes: drink types, all drink types if None
+        :return: dictionary mapping drink types to lists of dictionaries
+            with ``user``, ``average`` and ``total``
+        """
+        ctypes = _drink_types(ctypes)
+        if start_time is None:
+            start_time = timezone.now()
+        return self._ranked_per_type(
             """
-            SELECT c.user_id,
-                COUNT(c.id) / date_part('day', INTERVAL %s) AS average,
-                COUNT(c.id) AS total
-            FROM caffeine_caffeine c
-            WHERE c.ctype = %s
-              AND c.date >= %s - INTERVAL %s
-            GROUP BY c.user_id
-            ORDER BY total DESC, c.user_id
-            LIMIT %s
+            WITH w AS (
+                SELECT start,
+                       date_trunc('hour', start) + INTERVAL '1 hour' AS hour,
+                       date_trunc('day', start) + INTERVAL '1 day' AS day
+                FROM   (SELECT %s::timestamp - INTERVAL %s AS start) AS s
+            )
+            SELECT user_id, ctype,
+                   SUM(count) / date_part('day', INTERVAL %s) AS average,
+                   SUM(count)::integer AS total,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY ctype ORDER BY SUM(count) DESC, user_id
+                   ) AS rank
+            FROM (
+                SELECT c.user_id, c.ctype, COUNT(*) AS count
+                FROM   caffeine_caffeine c, w
+                WHERE  c.ctype = ANY(%s) AND c.date >= w.start
+                       AND c.date < w.hour
+                GROUP BY c.user_id, c.ctype
+                UNION ALL
+                SELECT r.user_id, r.ctype, r.count
+                FROM   caffeine_caffeinerollup r, w
+                WHERE  r.ctype = ANY(%s) AND r.period = %s
+                       AND r.bucket >= w.hour AND r.bucket < w.day
+                UNION ALL
+                SELECT r.user_id, r.ctype, r.count
+                FROM   caffeine_caffeinerollup r, w
+                WHERE  r.ctype = ANY(%s) AND r.period = %s
+                       AND r.bucket >= w.day
+            ) AS buckets
+            GROUP BY user_id, ctype
+            HAVING SUM(count) > 0
             """,
-            [interval, ctype, start_time, interval, count],
+            [
+                start_time,
+                interval,
+                interval,
+                ctypes,
+                ctypes,
+                ROLLUP_PERIODS.hour,
+                ctypes,
+                ROLLUP_PERIODS.day,
+            ],
+            ("average", "total"),
+            count,
+            ctypes,
         )
-        q = cursor.fetchall()
-        users = User.objects.in_bulk([row[0] for row in q])
-        result = []
-        for user_id, average, total in q:
-            result.append({"user": users[user_id], "average": average, "total": total})
-        return result
+
+    def top_consumers_total(self, ctype, count=10):
+        return self.top_consumers_total_per_type(count, [ctype])[ctype]
+
+    def top_consumers_average(self, ctype, count=10):
+        return self.top_consumers_average_per_type(count, [ctype])[ctype]
+
+    def top_consumers_recent(
+        self, ctype, count=10, start_time=None, interval="30 days"
+    ):
+        return self.top_consumers_recent_per_type(count, start_time, interval, [ctype])[
+            ctype
+        ]
+
+    def csv_rows(self, drinktype, user):
+        """
+        Generate the CSV rows of the user records for a specific drink type.
+        The records are read with a server-side cursor in chunks of
+        ``settings.CAFFEINE_EXPORT_CHUNK_SIZE`` rows.
+
+        :param str drinktype: drink type
+        :param User user: user instance
+        :return: generator of CSV rows starting with a header row
+        """
+        yield ["Timestamp"]
+        dates = (
+            self.filter(user=user, ctype=drinktype)
+            .order_by("date")
+            .values_list("date", flat=True)
+            .iterator(chunk_size=settings.CAFFEINE_EXPORT_CHUNK_SIZE)
+        )
+        for date in dates:
+            yield [date.strftime(settings.CAFFEINE_DATETIME_FORMAT)]
 
     def get_csv_data(self, drinktype, user):
         """
@@ -622,10 +1194,7 @@ class CaffeineManager(models.Manager):
         :return: list of records in CSV format
         """
         csvbuf = StringIO()
-        writer = csv.writer(csvbuf)
-        writer.writerow(["Timestamp"])
-        for row in self.filter(user=user, ctype=drinktype).order_by("date"):
-            writer.writerow([row.date.strftime(settings.CAFFEINE_DATETIME_FORMAT)])
+        csv.writer(csvbuf).writerows(self.csv_rows(drinktype, user))
         retval = csvbuf.getvalue()
         csvbuf.close()
         return retval
@@ -637,37 +1206,79 @@ class Caffeine(models.Model):
 
     """
 
-    ctype = models.PositiveSmallIntegerField(choices=DRINK_TYPES, db_index=True)
-    user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="caffeines")
-    date = models.DateTimeField(_("consumed"), db_index=True)
+    ctype = models.PositiveSmallIntegerField(choices=DRINK_TYPES)
+    user = models.ForeignKey(
+        "User", on_delete=models.CASCADE, related_name="caffeines", db_index=False
+    )
+    date = models.DateTimeField(_("consumed"))
     entrytime = AutoCreatedField(_("entered"), db_index=True)
-    timezone = models.CharField(max_length=40, db_index=True, blank=True)
+    # only empty for entries stored by an old release until migration
+    # 0019_caffeine_modified_backfill has filled them
+    modified = AutoLastModifiedField(_("modified"), null=True)
+    timezone = models.CharField(max_length=40, blank=True)
 
     objects = CaffeineManager()
 
     class Meta:
         ordering = ["-date"]
+        indexes = [
+            # per-user lookups by drink type and date range
+            models.Index(
+                fields=["user", "ctype", "date"], name="caffeine_user_ctype_date_idx"
+            ),
+            # latest entries of a user
+            models.Index(
+                fields=["user", "entrytime"], name="caffeine_user_entrytime_idx"
+            ),
+            models.Index(fields=["user", "date", "id"], name="caffeine_user_date_idx"),
+            # changed entries of a user for the sync API
+            models.Index(
+                fields=["user", "modified", "id"], name="caffeine_user_modified_idx"
+            ),
+            # site-wide date ranges, covering the drink type
+            models.Index(
+                fields=["date"], include=["ctype"], name="caffeine_date_ctype_idx"
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Save the caffeine entry in a transaction that also covers the
+        statistics updates performed by the signal handlers in
+        :py:mod:`caffeine.signals`.
+
+        """
+        with transaction.atomic(using=kwargs.get("using")):
+            super(Caffeine, self).save(*args, **kwargs)
 
     def clean(self):
         recent_caffeine = Caffeine.objects.find_recent_caffeine(
             self.user, self.date, self.ctype
         )
         if recent_caffeine:
-            raise ValidationError(
-                _(
-                    "Your last %(drink)s was less than %(minutes)d minutes "
-                    "ago at %(date)s %(timezone)s"
-                ),
-                code="drink_frequency",
-                params={
-                    "drink": DRINK_TYPES[self.ctype],
-                    "minutes": settings.MINIMUM_DRINK_DISTANCE,
-                    "date": recent_caffeine.date,
-                    "timezone": recent_caffeine.timezone,
-                },
-            )
+            raise recent_caffeine.drink_frequency_error()
         super(Caffeine, self).clean()
 
+    def drink_frequency_error(self):
+        """
+        Get the validation error for a drink that is too close to this one.
+
+        :return: ValidationError
+        """
+        return ValidationError(
+            _(
+                "Your last %(drink)s was less than %(minutes)d minutes "
+                "ago at %(date)s %(timezone)s"
+            ),
+            code="drink_frequency",
+            params={
+                "drink": DRINK_TYPES[self.ctype],
+                "minutes": settings.MINIMUM_DRINK_DISTANCE,
+                "date": self.date,
+                "timezone": self.timezone,
+            },
+        )
+
     def __str__(self):
         return (
             "%s at %s %s"
@@ -682,6 +1293,737 @@ class Caffeine(models.Model):
         return DRINK_TYPES[self.ctype]
 
 
+class CaffeineRollupManager(models.Manager):
+    """
+    Manager class for CaffeineRollup.
+
+    """
+
+    key_columns = ("user_id", "ctype", "period", "bucket")
+
+    def add_caffeine(self, caffeines):
+        """
+        Count caffeine entries into their users' calendar buckets.
+
+        :param caffeines: iterable of Caffeine instances
+        """
+        _add_to_counters(
+            self.model._meta.db_table, self.key_columns, _rollup_counts(caffeines)
+        )
+
+    def remove_caffeine(self, caffeines):
+        """
+        Remove caffeine entries from their users' calendar buckets.
+
+        :param caffeines: iterable of Caffeine instances
+        """
+        _subtract_from_counters(
+            self.model._meta.db_table, self.key_columns, _rollup_counts(caffeines)
+        )
+
+    def window(self, user, period, start, end):
+        """
+        Return the buckets of the given period within ``[start, end)``.
+
+        :param User user: user instance
+        :param int period: one of ROLLUP_PERIODS
+        :param datetime start: inclusive start of the window
+        :param datetime end: exclusive end of the window
+        :return: list of (ctype, bucket, count) tuples
+        """
+        return self.filter(
+            user=user, period=period, bucket__gte=start, bucket__lt=end
+        ).values_list("ctype", "bucket", "count")
+
+    def rebuild(self, user=None):
+        """
+        Recompute the calendar buckets from the caffeine entries.
+
+        :param User user: user instance, all users if None
+        """
+        queryset = self.all() if user is None else self.filter(user=user)
+        queryset.delete()
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            INSERT INTO caffeine_caffeinerollup
+                   (user_id, ctype, period, bucket, count)
+            SELECT c.user_id, c.ctype, p.period,
+                   date_trunc(p.unit, c.date) AS bucket, COUNT(*)
+            FROM   caffeine_caffeine c
+            CROSS JOIN (VALUES {0}) AS p (period, unit)
+            WHERE  %s IS NULL OR c.user_id = %s
+            GROUP BY c.user_id, c.ctype, p.period, bucket
+            """.format(
+                ", ".join(
+                    "({0:d}, '{1}')".format(period, unit)
+                    for period, unit, _ in ROLLUP_PERIODS._triples
+                )
+            ),
+            [getattr(user, "id", None)] * 2,
+        )
+
+
+class CaffeineRollup(models.Model):
+    """
+    Number of caffeinated drinks of a user per hour, day or month.
+
+    """
+
+    user = models.ForeignKey(
+        "User", on_delete=models.CASCADE, related_name="+", db_index=False
+    )
+    ctype = models.PositiveSmallIntegerField(choices=DRINK_TYPES)
+    period = models.PositiveSmallIntegerField(choices=ROLLUP_PERIODS)
+    bucket = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    objects = CaffeineRollupManager()
+
+    class Meta:
+        unique_together = ("user", "period", "bucket", "ctype")
+        indexes = [
+            models.Index(
+                fields=["period", "bucket"],
+                include=["user", "ctype", "count"],
+                name="caffeinerollup_period_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return "%s %s of %s at %s: %d" % (
+            DRINK_TYPES[self.ctype],
+            ROLLUP_PERIODS[self.period],
+            self.user_id,
+            self.bucket.strftime(settings.CAFFEINE_DATETIME_FORMAT),
+            self.count,
+        )
+
+
+class CaffeineHistogramManager(models.Manager):
+    """
+    Manager class for CaffeineHistogram.
+
+    """
+
+    key_columns = ("user_id", "ctype", "hour", "weekday")
+
+    def add_caffeine(self, caffeines):
+        """
+        Count caffeine entries into their users' histogram cells.
+
+        :param caffeines: iterable of Caffeine instances
+        """
+        _add_to_counters(
+            self.model._meta.db_table, self.key_columns, _histogram_counts(caffeines)
+        )
+
+    def remove_caffeine(self, caffeines):
+        """
+        Remove caffeine entries from their users' histogram cells.
+
+        :param caffeines: iterable of Caffeine instances
+        """
+        _subtract_from_counters(
+            self.model._meta.db_table, self.key_columns, _histogram_counts(caffeines)
+        )
+
+    def totals(self, user, field):
+        """
+        Return the user's all-time counts grouped by ctype and field.
+
+        :param User user: user instance
+        :param str field: either ``hour`` or ``weekday``
+        :return: list of (ctype, field value, count) tuples
+        """
+        return (
+            self.filter(user=user)
+            .values_list("ctype", field)
+            .annotate(models.Sum("count"))
+            .order_by()
+        )
+
+    def rebuild(self, user=None):
+        """
+        Recompute the histogram cells from the caffeine entries.
+
+        :param User user: user instance, all users if None
+        """
+        queryset = self.all() if user is None else self.filter(user=user)
+        queryset.delete()
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            INSERT INTO caffeine_caffeinehistogram
+                   (user_id, ctype, hour, weekday, count)
+            SELECT user_id, ctype,
+                   date_part('hour', date)::int AS hour,
+                   date_part('isodow', date)::int AS weekday, COUNT(*)
+            FROM   caffeine_caffeine
+            WHERE  %s IS NULL OR user_id = %s
+            GROUP BY user_id, ctype, hour, weekday
+            """,
+            [getattr(user, "id", None)] * 2,
+        )
+
+
+class CaffeineHistogram(models.Model):
+    """
+    Number of caffeinated drinks of a user per hour of day and ISO weekday
+    over the whole timespan of the user's membership.
+
+    """
+
+    user = models.ForeignKey(
+        "User", on_delete=models.CASCADE, related_name="+", db_index=False
+    )
+    ctype = models.PositiveSmallIntegerField(choices=DRINK_TYPES)
+    hour = models.PositiveSmallIntegerField()
+    weekday = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    objects = CaffeineHistogramManager()
+
+    class Meta:
+        unique_together = ("user", "ctype", "hour", "weekday")
+
+    def __str__(self):
+        return "%s of %s at %02d:00 on %s: %d" % (
+            DRINK_TYPES[self.ctype],
+            self.user_id,
+            self.hour,
+            WEEKDAY_LABELS[self.weekday - 1],
+            self.count,
+        )
+
+
+class CaffeineSummaryManager(models.Manager):
+    """
+    Manager class for CaffeineSummary.
+
+    """
+
+    def add_caffeine(self, caffeines):
+        """
+        Count caffeine entries into their users' summaries.
+
+        :param caffeines: iterable of Caffeine instances
+        """
+        summaries = _summary_counts(caffeines)
+        if not summaries:
+            return
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            INSERT INTO caffeine_caffeinesummary
+                   (user_id, ctype, count, first, last)
+            VALUES {0}
+            ON CONFLICT (user_id, ctype)
+            DO UPDATE SET
+                count = caffeine_caffeinesummary.count + EXCLUDED.count,
+                first = LEAST(caffeine_caffeinesummary.first, EXCLUDED.first),
+                last = GREATEST(caffeine_caffeinesummary.last, EXCLUDED.last)
+            """.format(
+                ", ".join(["(%s, %s, %s, %s, %s)"] * len(summaries))
+            ),
+            [
+                value
+                for key, summary in summaries.items()
+                for value in key + tuple(summary)
+            ],
+        )
+
+    def remove_caffeine(self, caffeines):
+        """
+        Remove deleted caffeine entries from their users' summaries. The first
+        and last dates are looked up again if a removed entry was at one of
+        the ends.
+
+        :param caffeines: iterable of Caffeine instances
+        """
+        summaries = _summary_counts(caffeines)
+        if not summaries:
+            return
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            UPDATE caffeine_caffeinesummary s
+            SET count = s.count - v.count,
+                first = CASE WHEN s.first < v.first THEN s.first ELSE (
+                    SELECT MIN(c.date) FROM caffeine_caffeine c
+                    WHERE  c.user_id = s.user_id AND c.ctype = s.ctype) END,
+                last = CASE WHEN s.last > v.last THEN s.last ELSE (
+                    SELECT MAX(c.date) FROM caffeine_caffeine c
+                    WHERE  c.user_id = s.user_id AND c.ctype = s.ctype) END
+            FROM (VALUES {0}) AS v (user_id, ctype, count, first, last)
+            WHERE s.user_id = v.user_id AND s.ctype = v.ctype
+            """.format(
+                ", ".join(["(%s, %s, %s, %s, %s)"] * len(summaries))
+            ),
+            [
+                value
+                for key, summary in summaries.items()
+                for value in key + tuple(summary)
+            ],
+        )
+
+    def rebuild(self, user=None):
+        """
+        Recompute the summaries from the caffeine entries.
+
+        :param User user: user instance, all users if None
+        """
+        queryset = self.all() if user is None else self.filter(user=user)
+        queryset.delete()
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            INSERT INTO caffeine_caffeinesummary
+                   (user_id, ctype, count, first, last)
+            SELECT user_id, ctype, COUNT(*), MIN(date), MAX(date)
+            FROM   caffeine_caffeine
+            WHERE  %s IS NULL OR user_id = %s
+            GROUP BY user_id, ctype
+            """,
+            [getattr(user, "id", None)] * 2,
+        )
+
+
+class CaffeineSummary(models.Model):
+    """
+    Number of caffeinated drinks of a user and the dates of the first and the
+    last drink per drink type.
+
+    """
+
+    user = models.ForeignKey(
+        "User", on_delete=models.CASCADE, related_name="+", db_index=False
+    )
+    ctype = models.PositiveSmallIntegerField(choices=DRINK_TYPES)
+    count = models.IntegerField(default=0)
+    first = models.DateTimeField(null=True)
+    last = models.DateTimeField(null=True)
+
+    objects = CaffeineSummaryManager()
+
+    class Meta:
+        unique_together = ("user", "ctype")
+        verbose_name_plural = _("caffeine summaries")
+
+    def __str__(self):
+        return "%s of %s: %d" % (DRINK_TYPES[self.ctype], self.user_id, self.count)
+
+
+class CaffeineTombstoneManager(models.Manager):
+    """
+    Manager for the records of deleted caffeine entries.
+
+    """
+
+    def add_caffeine(self, caffeines):
+        """
+        Record the deletion of caffeine entries.
+
+        :param caffeines: deleted caffeine entries
+        """
+        self.bulk_create(
+            [
+                CaffeineTombstone(user_id=caffeine.user_id, caffeine_id=caffeine.id)
+                for caffeine in caffeines
+            ]
+        )
+
+    def deleted_after(self, user, position):
+        """
+        Get the tombstones of the caffeine entries of a user that have been
+        deleted after a position in the order of their deletion time and id.
+
+        :param User user: user instance
+        :param tuple position: (deletion time, id) tuple
+        :return: QuerySet of tombstones ordered by deletion time and id
+        """
+        return _after_position(self.filter(user=user), "deleted", position)
+
+    def prune(self):
+        """
+        Delete the tombstones that are older than
+        ``settings.API_SYNC_TOMBSTONE_DAYS`` days.
+
+        :return: number of deleted tombstones
+        """
+        expired = timezone.now() - timedelta(days=settings.API_SYNC_TOMBSTONE_DAYS)
+        return self.filter(deleted__lt=expired).delete()[0]
+
+
+class CaffeineTombstone(models.Model):
+    """
+    Record of a deleted caffeine entry to let API clients remove it from
+    their local copies.
+
+    """
+
+    user = models.ForeignKey(
+        "User", on_delete=models.CASCADE, related_name="+", db_index=False
+    )
+    caffeine_id = models.IntegerField()
+    deleted = AutoCreatedField(_("deleted"))
+
+    objects = CaffeineTombstoneManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "deleted"], name="caffeinetombstone_user_idx"),
+        ]
+
+    def __str__(self):
+        return "caffeine %d of %s deleted at %s" % (
+            self.caffeine_id,
+            self.user_id,
+            self.deleted,
+        )
+
+
+class PendingExportManager(models.Manager):
+    """
+    Manager for the queue of requested caffeine exports.
+
+    """
+
+    def request_export(self, user):
+        """
+        Queue an export of the caffeine entries of a user. An export that is
+        already queued for the user is kept.
+
+        :param User user: user instance
+        """
+        self.bulk_create([self.model(user=user)], ignore_conflicts=True)
+
+    def _claim(self):
+        """
+        Claim the oldest queued export that is due by counting the attempt
+        and postponing its next attempt. The next attempt is delayed by
+        ``settings.CAFFEINE_EXPORT_RETRY_DELAY`` seconds, doubled with every
+        failed attempt, and also covers runs that die while sending.
+
+        :return: claimed PendingExport instance or None
+        """
+        with transaction.atomic():
+            now = timezone.now()
+            export = (
+                self.select_for_update(skip_locked=True, of=("self",))
+                .select_related("user")
+                .filter(retry_after__lte=now)
+                .order_by("requested")
+                .first()
+            )
+            if export is not None:
+                export.attempts += 1
+                export.retry_after = now + timedelta(
+                    seconds=settings.CAFFEINE_EXPORT_RETRY_DELAY
+                    * 2 ** (export.attempts - 1)
+                )
+                export.save(update_fields=["attempts", "retry_after"])
+        return export
+
+    def process(self):
+        """
+        Send the queued exports that are due by email. Exports are claimed
+        one at a time to allow concurrent runs and the mail is sent outside
+        of any transaction. Failed exports are logged and retried later, an
+        export that failed ``settings.CAFFEINE_EXPORT_MAX_ATTEMPTS`` times is
+        dropped.
+
+        :return: number of sent exports
+        """
+        sent = 0
+        while True:
+            export = self._claim()
+            if export is None:
+                return sent
+            try:
+                export.user.export_csv()
+            except Exception:
+                if export.attempts >= settings.CAFFEINE_EXPORT_MAX_ATTEMPTS:
+                    logger.exception(
+                        "dropping export %d after %d failed attempts",
+                        export.pk,
+                        export.attempts,
+                    )
+                    export.delete()
+                else:
+                    logger.exception("sending export %d failed", export.pk)
+                continue
+            export.delete()
+            sent += 1
+
+
+class PendingExport(models.Model):
+    """
+    Export of the caffeine entries of a user that has been requested but
+    not been sent yet.
+
+    """
+
+    user = models.OneToOneField("User", on_delete=models.CASCADE, related_name="+")
+    requested = AutoCreatedField(_("requested"))
+    attempts = models.PositiveSmallIntegerField(_("attempts"), default=0)
+    retry_after = models.DateTimeField(
+        _("retry after"), default=timezone.now, db_index=True
+    )
+
+    objects = PendingExportManager()
+
+    def __str__(self):
+        return "export for %s requested at %s" % (self.user_id, self.requested)
+
+
+def _add_to_series(data, ctype, position, value):
+    data["maxvalue"] = max(value, data["maxvalue"])
+    data[DRINK_TYPES._triples[ctype][1]][position] += value
+
+
+class OverallStatisticsManager(models.Manager):
+    """
+    Manager class for OverallStatistics.
+
+    """
+
+    def _merge(self, snapshot, rows):
+        """
+        Merge hourly counts of caffeine entries into the snapshot counters.
+        Calendar buckets before the current day, month and year are dropped.
+
+        :param OverallStatistics snapshot: the locked snapshot
+        :param rows: iterable of (ctype, hour bucket, count) tuples
+        """
+        counters = snapshot.counters
+        for ctype, hour, count in rows:
+            day = hour.replace(hour=0)
+            for series, key in (
+                ("total", "all"),
+                ("hour", hour.isoformat()),
+                ("day", day.isoformat()),
+                ("month", day.replace(day=1).isoformat()),
+                ("hourofday", str(hour.hour)),
+                ("weekday", str(hour.isoweekday())),
+            ):
+                counts = counters.setdefault(series, {}).setdefault(
+                    key, [0] * len(DRINK_TYPES)
+                )
+                counts[ctype] += count
+        now = timezone.now()
+        for series, window in (
+            ("hour", _day_window),
+            ("day", _month_window),
+            ("month", _year_window),
+        ):
+            start = window(now)[0].isoformat()
+            buckets = counters.get(series, {})
+            for key in [key for key in buckets if key < start]:
+                del buckets[key]
+
+    def refresh(self, rebuild=False):
+        """
+        Count the caffeine entries that have been added since the last
+        refresh into the snapshot and apply the recorded deltas of updated
+        and deleted entries that have been counted before. Entries younger
+        than ``settings.OVERALL_STATISTICS_LAG`` seconds are left for the next
+        refresh.
+
+        Entries whose transaction commits later than the lag after their
+        entrytime are missed by the incremental refresh. A refresh with
+        ``rebuild`` counts them.
+
+        :param bool rebuild: discard the snapshot and count all entries
+        :return: the refreshed snapshot
+        """
+        with transaction.atomic():
+            self.get_or_create(pk=1)
+            snapshot = self.select_for_update().get(pk=1)
+            if rebuild:
+                snapshot.counters = {}
+                snapshot.entrytime_until = None
+            until = timezone.now() - timedelta(seconds=settings.OVERALL_STATISTICS_LAG)
+            # a single statement sees the entries and the deltas in the same
+            # state: deltas of entries counted by earlier refreshes are
+            # applied, deltas of entries counted by this refresh are dropped
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                WITH deltas AS (
+                    DELETE FROM caffeine_overallstatisticsdelta
+                    WHERE  entrytime <= %(until)s
+                    RETURNING ctype, hour, entrytime, count
+                )
+                SELECT ctype, date_trunc('hour', date)::timestamp AS hour,
+                       COUNT(*)
+                FROM   caffeine_caffeine
+                WHERE  (%(since)s::timestamptz IS NULL OR entrytime > %(since)s)
+                       AND entrytime <= %(until)s
+                GROUP BY ctype, hour
+                UNION ALL
+                SELECT ctype, hour, SUM(count)
+                FROM   deltas
+                WHERE  entrytime <= %(since)s
+                GROUP BY ctype, hour
+                """,
+                {"since": snapshot.entrytime_until, "until": until},
+            )
+            self._merge(snapshot, cursor.fetchall())
+            snapshot.entrytime_until = until
+            snapshot.refreshed = timezone.now()
+            snapshot.save()
+        return snapshot
+
+    def remove_caffeine(self, caffeines):
+        """
+        Record the removal of caffeine entries from the snapshot.
+
+        :param caffeines: iterable of Caffeine instances
+        """
+        self._record(caffeines, -1)
+
+    def add_caffeine(self, caffeines):
+        """
+        Record changed caffeine entries to be counted into the snapshot with
+        their new values. New entries are counted by :py:meth:`refresh`.
+
+        :param caffeines: iterable of Caffeine instances
+        """
+        self._record(caffeines, 1)
+
+    def _record(self, caffeines, sign):
+        OverallStatisticsDelta.objects.bulk_create(
+            [
+                OverallStatisticsDelta(
+                    ctype=c.ctype,
+                    hour=c.date.replace(minute=0, second=0, microsecond=0),
+                    entrytime=c.entrytime,
+                    count=sign,
+                )
+                for c in caffeines
+            ]
+        )
+
+    def remove_user(self, user):
+        """
+        Record the removal of all caffeine entries of a user from the
+        snapshot.
+
+        :param User user: user instance
+        """
+        cursor = connection.cursor()
+        cursor.execute(
+            """
+            INSERT INTO caffeine_overallstatisticsdelta
+                   (ctype, hour, entrytime, count)
+            SELECT ctype, date_trunc('hour', date)::timestamp AS hour,
+                   entrytime, -COUNT(*)
+            FROM   caffeine_caffeine
+            WHERE  user_id = %s
+            GROUP BY ctype, hour, entrytime
+            """,
+            [user.id],
+        )
+
+    def overall_stats(self):
+        """
+        Return the site-wide total and series shown on the overall page from
+        the snapshot.
+
+        :return: dictionary with the keys ``total``, ``todaydata``,
+            ``monthdata``, ``yeardata``, ``byhourdata`` and ``byweekdaydata``
+        """
+        return self._stats_from_snapshot(self.filter(pk=1).first())
+
+    async def aoverall_stats(self):
+        """
+        Asynchronous version of :py:meth:`overall_stats`.
+
+        :return: dictionary with the keys ``total``, ``todaydata``,
+            ``monthdata``, ``yeardata``, ``byhourdata`` and ``byweekdaydata``
+        """
+        return self._stats_from_snapshot(await self.filter(pk=1).afirst())
+
+    def _stats_from_snapshot(self, snapshot):
+        """
+        Build the site-wide total and series from a snapshot.
+
+        :param OverallStatistics snapshot: snapshot instance or None if the
+            statistics have not been refreshed yet
+        :return: result dictionary
+        """
+        now = timezone.now()
+        result = {
+            "total": _total_result_dict(),
+            "todaydata": _hour_result_dict(),
+            "monthdata": _month_result_dict(now),
+            "yeardata": _year_result_dict(),
+            "byhourdata": _hour_result_dict(),
+            "byweekdaydata": _weekdaily_result_dict(),
+        }
+        counters = snapshot.counters if snapshot is not None else {}
+        for ctype, value in enumerate(counters.get("total", {}).get("all", [])):
+            result["total"][ctype] = value
+        for series, target, window, position in (
+            ("hour", "todaydata", _day_window, lambda bucket: bucket.hour),
+            ("day", "monthdata", _month_window, lambda bucket: bucket.day - 1),
+            ("month", "yeardata", _year_window, lambda bucket: bucket.month - 1),
+        ):
+            start, end = window(now)
+            for key, counts in counters.get(series, {}).items():
+                bucket = datetime.fromisoformat(key)
+                if start <= bucket < end:
+                    for ctype, value in enumerate(counts):
+                        _add_to_series(result[target], ctype, position(bucket), value)
+        for series, target, offset in (
+            ("hourofday", "byhourdata", 0),
+            ("weekday", "byweekdaydata", 1),
+        ):
+            for key, counts in counters.get(series, {}).items():
+                for ctype, value in enumerate(counts):
+                    _add_to_series(result[target], ctype, int(key) - offset, value)
+        return result
+
+
+class OverallStatistics(models.Model):
+    """
+    Snapshot of the site-wide statistics shown on the overall page. There is
+    only one instance that is refreshed by the ``refresh_overall_stats``
+    management command.
+
+    """
+
+    entrytime_until = models.DateTimeField(_("counted entries until"), null=True)
+    refreshed = models.DateTimeField(_("refreshed"), null=True)
+    counters = models.JSONField(default=dict)
+
+    objects = OverallStatisticsManager()
+
+    class Meta:
+        verbose_name_plural = _("overall statistics")
+
+    def __str__(self):
+        return "overall statistics until %s" % self.entrytime_until
+
+
+class OverallStatisticsDelta(models.Model):
+    """
+    Change of the overall statistics by an updated or deleted caffeine entry.
+    Deltas are recorded without locking the snapshot and are applied or
+    dropped by the next refresh.
+
+    """
+
+    ctype = models.PositiveSmallIntegerField(choices=DRINK_TYPES)
+    hour = models.DateTimeField()
+    entrytime = models.DateTimeField(db_index=True)
+    count = models.IntegerField()
+
+    def __str__(self):
+        return "%+d %s at %s" % (self.count, DRINK_TYPES[self.ctype], self.hour)
+
+
 class ActionManager(models.Manager):
     """
     Manager class for actions.
@@ -0,0 +1,117 @@
+"""
+Signal handlers that keep the caffeine statistics tables in sync with the
+caffeine entries.
+
+"""
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import leaderboards
+from .models import (
+    Caffeine,
+    CaffeineHistogram,
+    CaffeineRollup,
+    CaffeineSummary,
+    CaffeineTombstone,
+    OverallStatistics,
+    User,
+    caffeines_created,
+)
+
+
+def _deleted_with_user(origin):
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(origin_model, User)
+
+
+@receiver(pre_save, sender=Caffeine)
+def remember_previous_caffeine(sender, instance, raw=False, **kwargs):
+    """
+    Remember the stored state of a caffeine entry that is going to be changed
+    to allow removing it from the statistics after saving.
+
+    """
+    instance._previous = None
+    if instance.pk is not None and not raw:
+        instance._previous = Caffeine.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=Caffeine)
+def count_saved_caffeine(sender, instance, created, raw=False, **kwargs):
+    """
+    Count a new or changed caffeine entry into the statistics.
+
+    """
+    if raw:
+        return
+    previous = getattr(instance, "_previous", None)
+    if previous is not None:
+        CaffeineRollup.objects.remove_caffeine([previous])
+        CaffeineHistogram.objects.remove_caffeine([previous])
+        CaffeineSummary.objects.remove_caffeine([previous])
+        OverallStatistics.objects.remove_caffeine([previous])
+        OverallStatistics.objects.add_caffeine([instance])
+    CaffeineRollup.objects.add_caffeine([instance])
+    CaffeineHistogram.objects.add_caffeine([instance])
+    CaffeineSummary.objects.add_caffeine([instance])
+
+
+@receiver(caffeines_created, sender=Caffeine)
+def count_created_caffeines(sender, caffeines, **kwargs):
+    """
+    Count caffeine entries that have been created in bulk into the
+    statistics.
+
+    """
+    CaffeineRollup.objects.add_caffeine(caffeines)
+    CaffeineHistogram.objects.add_caffeine(caffeines)
+    CaffeineSummary.objects.add_caffeine(caffeines)
+    if caffeines:
+        transaction.on_commit(leaderboards.mark_changed)
+
+
+@receiver(post_delete, sender=Caffeine)
+def discount_deleted_caffeine(sender, instance, origin=None, **kwargs):
+    """
+    Remove a deleted caffeine entry from the statistics. If the entry is
+    removed as part of a user deletion the user's statistics are deleted by
+    cascade and the overall statistics are handled by
+    :py:func:`discount_deleted_user`. Otherwise a tombstone records the
+    deletion for synchronizing API clients.
+
+    """
+    if _deleted_with_user(origin):
+        return
+    CaffeineRollup.objects.remove_caffeine([instance])
+    CaffeineHistogram.objects.remove_caffeine([instance])
+    CaffeineSummary.objects.remove_caffeine([instance])
+    OverallStatistics.objects.remove_caffeine([instance])
+    CaffeineTombstone.objects.add_caffeine([instance])
+
+
+@receiver(pre_delete, sender=User)
+def discount_deleted_user(sender, instance, **kwargs):
+    """
+    Remove the caffeine entries of a deleted user from the overall statistics
+    in one go instead of entry by entry.
+
+    """
+    OverallStatistics.objects.remove_user(instance)
+
+
+@receiver(post_save, sender=Caffeine)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=Caffeine)
+@receiver(post_delete, sender=User)
+def expire_leaderboards(sender, raw=False, origin=None, **kwargs):
+    """
+    Let the cached explore page leaderboards expire when caffeine entries or
+    users change.
+
+    """
+    if raw or sender is Caffeine and _deleted_with_user(origin):
+        return
+    transaction.on_commit(leaderboards.mark_changed)
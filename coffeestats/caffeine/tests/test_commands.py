@@ -0,0 +1,94 @@
+from datetime import datetime
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from caffeine.models import (
+    Caffeine,
+    CaffeineHistogram,
+    CaffeineRollup,
+    CaffeineTombstone,
+    DRINK_TYPES,
+    OverallStatistics,
+    PendingExport,
+)
+
+User = get_user_model()
+
+
+class RebuildCaffeineStatsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("testuser", "test@example.org")
+        Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.coffee, date=datetime(2024, 5, 15, 17)
+        )
+
+    def test_rebuilds_all_users(self):
+        CaffeineRollup.objects.all().delete()
+        CaffeineHistogram.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_caffeine_stats", stdout=out)
+        self.assertEqual(CaffeineRollup.objects.count(), 3)
+        self.assertEqual(CaffeineHistogram.objects.count(), 1)
+        self.assertIn("Caffeine statistics rebuilt.", out.getvalue())
+
+    def test_rebuilds_given_users(self):
+        CaffeineRollup.objects.all().update(count=0)
+        call_command("rebuild_caffeine_stats", "testuser", stdout=StringIO())
+        self.assertEqual(
+            list(CaffeineRollup.objects.values_list("count", flat=True)), [1, 1, 1]
+        )
+
+    def test_unknown_user(self):
+        with self.assertRaisesMessage(CommandError, "Unknown users: nobody"):
+            call_command("rebuild_caffeine_stats", "nobody", stdout=StringIO())
+
+
+@override_settings(OVERALL_STATISTICS_LAG=0)
+class RefreshOverallStatsTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user("testuser", "test@example.org")
+        Caffeine.objects.create(
+            user=user, ctype=DRINK_TYPES.coffee, date=datetime(2024, 5, 15, 17)
+        )
+
+    def test_refresh(self):
+        out = StringIO()
+        call_command("refresh_overall_stats", verbosity=2, stdout=out)
+        stats = OverallStatistics.objects.overall_stats()
+        self.assertEqual(stats["total"][DRINK_TYPES.coffee], 1)
+        self.assertIn("Counted caffeine entries until", out.getvalue())
+
+    def test_rebuild(self):
+        call_command("refresh_overall_stats", stdout=StringIO())
+        OverallStatistics.objects.update(counters={})
+        call_command("refresh_overall_stats", rebuild=True, stdout=StringIO())
+        stats = OverallStatistics.objects.overall_stats()
+        self.assertEqual(stats["total"][DRINK_TYPES.coffee], 1)
+
+
+class SendExportsTest(TestCase):
+    def test_sends_exports(self):
+        user = User.objects.create_user("testuser", "test@example.org")
+        PendingExport.objects.request_export(user)
+        out = StringIO()
+        call_command("send_exports", verbosity=2, stdout=out)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(PendingExport.objects.exists())
+        self.assertIn("Sent 1 exports", out.getvalue())
+
+
+@override_settings(API_SYNC_TOMBSTONE_DAYS=0)
+class PruneCaffeineTombstonesTest(TestCase):
+    def test_prunes_tombstones(self):
+        user = User.objects.create_user("testuser", "test@example.org")
+        Caffeine.objects.create(
+            user=user, ctype=DRINK_TYPES.coffee, date=datetime(2024, 5, 15, 17)
+        ).delete()
+        out = StringIO()
+        call_command("prune_caffeine_tombstones", verbosity=2, stdout=out)
+        self.assertFalse(CaffeineTombstone.objects.exists())
+        self.assertIn("Deleted 1 tombstones", out.getvalue())
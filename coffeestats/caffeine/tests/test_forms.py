@@ -205,6 +205,7 @@ class SubmitCaffeineFormTest(TestCase):
         form = SubmitCaffeineForm(
             self.user, DRINK_TYPES.coffee, data={"date": now.date(), "time": now.time()}
         )
+        self.assertIsNone(form.save())
         self.assertFalse(form.is_valid())
         form_errors = form.non_field_errors()
         self.assertEqual(len(form_errors), 1)
@@ -241,6 +242,7 @@ class SubmitCaffeineFormTest(TestCase):
             DRINK_TYPES.coffee,
             data={"date": close_before.date(), "time": close_before.time()},
         )
+        self.assertIsNone(form.save())
         self.assertFalse(form.is_valid())
         form_errors = form.non_field_errors()
         self.assertEqual(len(form_errors), 1)
@@ -0,0 +1,90 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from caffeine import leaderboards
+from caffeine.models import Caffeine, DRINK_TYPES
+
+User = get_user_model()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class LeaderboardsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("testuser", "test@example.org", "s3cr3t")
+
+    def tearDown(self):
+        cache.clear()
+
+    def _add_coffee(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Caffeine.objects.create(
+                user=self.user, ctype=DRINK_TYPES.coffee, date=timezone.now()
+            )
+
+    def _age_sections(self, seconds):
+        for name in leaderboards.SECTIONS:
+            key = "explore:%s" % name
+            computed, value = cache.get(key)
+            cache.set(key, (computed - seconds, value))
+        changed = cache.get(leaderboards.CHANGED_KEY)
+        if changed is not None:
+            cache.set(leaderboards.CHANGED_KEY, changed - seconds)
+
+    def test_sections(self):
+        self._add_coffee()
+        result = leaderboards.get_leaderboards()
+        self.assertEqual(
+            set(result),
+            {
+                "activities",
+                "topcoffee",
+                "topcoffeeavg",
+                "topmate",
+                "topmateavg",
+                "topcoffeerecent",
+                "topmaterecent",
+                "recentlyjoined",
+                "longestjoined",
+            },
+        )
+        self.assertEqual(result["topcoffee"][0]["user"], self.user)
+        self.assertEqual(result["topcoffee"][0]["caffeine_count"], 1)
+
+    def test_sections_are_cached(self):
+        leaderboards.get_leaderboards()
+        with self.assertNumQueries(0):
+            result = leaderboards.get_leaderboards()
+        self.assertEqual(result["activities"], [])
+
+    def test_change_expires_after_refresh_interval(self):
+        leaderboards.get_leaderboards()
+        self._add_coffee()
+        self.assertEqual(leaderboards.get_leaderboards()["topcoffee"], [])
+        self._age_sections(3600)
+        result = leaderboards.get_leaderboards()
+        self.assertEqual(result["topcoffee"][0]["caffeine_count"], 1)
+
+    def test_stale_section_served_while_locked(self):
+        leaderboards.get_leaderboards()
+        self._add_coffee()
+        cache.add("explore:toptotal:lock", True)
+        self._age_sections(3600)
+        result = leaderboards.get_leaderboards()
+        self.assertEqual(result["topcoffee"], [])
+        self.assertEqual(len(result["activities"]), 1)
+
+    def test_unchanged_sections_do_not_expire(self):
+        leaderboards.get_leaderboards()
+        self._age_sections(86400)
+        with self.assertNumQueries(0):
+            leaderboards.get_leaderboards()
+
+    def test_user_deletion_marks_changed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertIsNotNone(cache.get(leaderboards.CHANGED_KEY))
@@ -7,6 +7,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 
 from caffeine.middleware import EnforceTimezoneMiddleware
+from core.utils import session_exempt
 
 
 User = get_user_model()
@@ -23,16 +24,24 @@ class TestEnforceTimezoneMiddleware(TestCase):
     def get_response(self, request):
         return self.response_mock
 
+    # noinspection PyUnusedLocal
+    def view(self, request):
+        return self.response_mock
+
+    def _process(self, request, view=None):
+        return self.middleware.process_view(
+            request, view or self.view, (), {}) or self.middleware(request)
+
     def test_anonymous_user(self):
         request = HttpRequest()
         request.user = AnonymousUser()
-        response = self.middleware(request)
+        response = self._process(request)
         self.assertIs(response, self.response_mock)
 
     def test_user_with_no_timezone_set(self):
         request = HttpRequest()
         request.user = self.user
-        response = self.middleware(request)
+        response = self._process(request)
         self.assertIsInstance(response, HttpResponseRedirect)
         self.assertTrue(
             response['Location'].startswith(reverse('select_timezone')))
@@ -43,12 +52,31 @@ class TestEnforceTimezoneMiddleware(TestCase):
         request = HttpRequest()
         request.user = self.user
         request.path = reverse('select_timezone')
-        response = self.middleware(request)
+        response = self._process(request)
         self.assertIs(response, self.response_mock)
 
     def test_no_redirect_if_user_has_timezone(self):
         self.user.timezone = 'GMT'
         request = HttpRequest()
         request.user = self.user
-        response = self.middleware(request)
+        response = self._process(request)
+        self.assertIs(response, self.response_mock)
+
+    def test_no_redirect_for_session_exempt_view(self):
+        @session_exempt
+        def view(request):
+            return self.response_mock
+
+        request = HttpRequest()
+        request.user = self.user
+        response = self._process(request, view)
         self.assertIs(response, self.response_mock)
+
+    def test_redirect_for_plain_view(self):
+        def view(request):
+            return self.response_mock
+
+        request = HttpRequest()
+        request.user = self.user
+        response = self._process(request, view)
+        self.assertIsInstance(response, HttpResponseRedirect)
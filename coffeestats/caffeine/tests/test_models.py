@@ -1,16 +1,21 @@
 # -*- coding: utf8 -*-
 from __future__ import unicode_literals
 
+import gzip
 import random
+import threading
 from calendar import monthrange
 from datetime import datetime, timedelta
 from hashlib import md5
+from unittest.mock import patch
 
+from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core import mail
 from django.core.exceptions import ValidationError
-from django.test import TestCase, TransactionTestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from passlib.hash import bcrypt
@@ -20,9 +25,17 @@ from caffeine.models import (
     Action,
     ActionManager,
     Caffeine,
+    CaffeineHistogram,
     CaffeineManager,
+    CaffeineRollup,
+    CaffeineSummary,
+    CaffeineTombstone,
     CaffeineUserManager,
     DRINK_TYPES,
+    OverallStatistics,
+    OverallStatisticsDelta,
+    PendingExport,
+    ROLLUP_PERIODS,
     WEEKDAY_LABELS,
 )
 
@@ -81,6 +94,33 @@ class CaffeineUserManagerTest(TestCase):
         randomusers = [u for u in User.objects.random_users()]
         self.assertEqual(len(randomusers), 4)
 
+    def test_random_users_samples_id_range(self):
+        self._populate_some_testusers()
+        with self.assertNumQueries(1):
+            randomusers = User.objects.random_users(2)
+        self.assertEqual(len(randomusers), 2)
+        self.assertNotEqual(randomusers[0], randomusers[1])
+
+    def test_random_users_counts(self):
+        self._populate_some_testusers()
+        user = User.objects.get(username="test1")
+        Caffeine.objects.create(user=user, ctype=DRINK_TYPES.mate, date=timezone.now())
+        randomusers = {u.username: u for u in User.objects.random_users(20)}
+        self.assertEqual(len(randomusers), 10)
+        self.assertEqual(randomusers["test1"].coffees, 0)
+        self.assertEqual(randomusers["test1"].mate, 1)
+        self.assertEqual(randomusers["test2"].mate, 0)
+
+    def test_with_caffeine_counts(self):
+        self._populate_some_testusers()
+        user = User.objects.get(username="test1")
+        for ctype in (DRINK_TYPES.coffee, DRINK_TYPES.mate, DRINK_TYPES.mate):
+            Caffeine.objects.create(user=user, ctype=ctype, date=timezone.now())
+        users = {u.username: u for u in User.objects.with_caffeine_counts()}
+        self.assertEqual(users["test1"].coffee_count, 1)
+        self.assertEqual(users["test1"].mate_count, 2)
+        self.assertEqual(users["test2"].coffee_count, 0)
+
     def test_recently_joined(self):
         self._populate_some_testusers()
         users = [u.username for u in User.objects.recently_joined()]
@@ -138,16 +178,26 @@ class UserTest(TestCase):
 
     def test_export_csv(self):
         user = User.objects.create_user("testuser", "testuser@bla.com")
+        Caffeine.objects.create(
+            user=user, ctype=DRINK_TYPES.coffee, date=datetime(2024, 5, 15, 17)
+        )
         user.export_csv()
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, "Your caffeine records")
         self.assertEqual(mail.outbox[0].body, "Attached is your caffeine track record.")
         self.assertEqual(mail.outbox[0].recipients()[0], "testuser@bla.com")
         self.assertEqual(len(mail.outbox[0].attachments), 2)
-        self.assertRegex(mail.outbox[0].attachments[0][0], r"^coffee-.+\.csv$")
-        self.assertRegex(mail.outbox[0].attachments[1][0], r"^mate-.+\.csv$")
-        self.assertEqual(mail.outbox[0].attachments[0][2], "text/csv")
-        self.assertEqual(mail.outbox[0].attachments[1][2], "text/csv")
+        self.assertRegex(mail.outbox[0].attachments[0][0], r"^coffee-.+\.csv\.gz$")
+        self.assertRegex(mail.outbox[0].attachments[1][0], r"^mate-.+\.csv\.gz$")
+        self.assertEqual(mail.outbox[0].attachments[0][2], "application/gzip")
+        self.assertEqual(mail.outbox[0].attachments[1][2], "application/gzip")
+        self.assertEqual(
+            gzip.decompress(mail.outbox[0].attachments[0][1]),
+            b"Timestamp\r\n2024-05-15 17:00:00\r\n",
+        )
+        self.assertEqual(
+            gzip.decompress(mail.outbox[0].attachments[1][1]), b"Timestamp\r\n"
+        )
 
     def test_has_usable_password_oldhash(self):
         user = User.objects.create_user("testuser", "testuser@bla.com")
@@ -281,6 +331,30 @@ class CaffeineManagerTest(TestCase):
         self.assertEqual(total[DRINK_TYPES.coffee], 30)
         self.assertEqual(total[DRINK_TYPES.mate], 30)
 
+    def test_changed_after(self):
+        testuser = User.objects.create_user("testuser", "test@example.org", token="foo")
+        first, second = [
+            Caffeine.objects.create(
+                user=testuser,
+                ctype=DRINK_TYPES.coffee,
+                date=datetime(2024, 5, 15, hour),
+            )
+            for hour in (17, 18)
+        ]
+        Caffeine.objects.filter(user=testuser).update(modified=first.modified)
+        self.assertEqual(
+            list(Caffeine.objects.changed_after(testuser, None)), [first, second]
+        )
+        self.assertEqual(
+            list(Caffeine.objects.changed_after(testuser, (first.modified, first.id))),
+            [second],
+        )
+        second.save()
+        self.assertEqual(
+            list(Caffeine.objects.changed_after(testuser, (second.modified, 0))),
+            [second],
+        )
+
     def test_latest_caffeine_for_user(self):
         testuser = User.objects.create_user("testuser", "test@example.org", token="foo")
         self._generate_caffeine_one_day(testuser)
@@ -406,6 +480,72 @@ class CaffeineManagerTest(TestCase):
         )
         self.assertEqual(weekdaily_caffeine["mate"], drinks[DRINK_TYPES.mate]["wday"])
 
+    def test_calendar_windows_for_reference(self):
+        user = User.objects.create_user("testuser", "test@example.org", token="foo")
+        for date in (
+            datetime(2020, 1, 31, 23, 59, 59),
+            datetime(2020, 2, 1, 0, 0),
+            datetime(2020, 2, 29, 8, 15),
+            datetime(2020, 2, 29, 23, 59, 59),
+            datetime(2020, 3, 1, 0, 0),
+            datetime(2021, 1, 1, 0, 0),
+        ):
+            Caffeine.objects.create(user=user, ctype=DRINK_TYPES.coffee, date=date)
+        reference = datetime(2020, 2, 29, 12, 0)
+        for hourly in (
+            Caffeine.objects.hourly_caffeine(reference),
+            Caffeine.objects.hourly_caffeine_for_user(user, reference),
+        ):
+            self.assertEqual(hourly["coffee"], 8 * [0] + [1] + 14 * [0] + [1])
+        for daily in (
+            Caffeine.objects.daily_caffeine(reference),
+            Caffeine.objects.daily_caffeine_for_user(user, reference),
+        ):
+            self.assertEqual(len(daily["labels"]), 29)
+            self.assertEqual(daily["coffee"], [1] + 27 * [0] + [2])
+        for monthly in (
+            Caffeine.objects.monthly_caffeine_overall(reference),
+            Caffeine.objects.monthly_caffeine_for_user(user, reference),
+        ):
+            self.assertEqual(monthly["coffee"], [1, 3, 1] + 9 * [0])
+        stats = Caffeine.objects.profile_stats(user, reference)
+        self.assertEqual(stats["todaydata"]["coffee"], 8 * [0] + [1] + 14 * [0] + [1])
+        self.assertEqual(stats["monthdata"]["coffee"], [1] + 27 * [0] + [2])
+        self.assertEqual(stats["yeardata"]["coffee"], [1, 3, 1] + 9 * [0])
+
+    def test_profile_stats(self):
+        user = User.objects.create_user("testuser", "test@example.org", token="foo")
+        self._generate_caffeine_one_day(user)
+        self._create_random_caffeine(
+            users=[user], number=50, timespan=timedelta(days=365)
+        )
+        with self.assertNumQueries(1):
+            stats = Caffeine.objects.profile_stats(user)
+        self.assertEqual(stats["total"], Caffeine.objects.total_caffeine_for_user(user))
+        self.assertEqual(
+            stats["todaydata"], Caffeine.objects.hourly_caffeine_for_user(user)
+        )
+        self.assertEqual(
+            stats["monthdata"], Caffeine.objects.daily_caffeine_for_user(user)
+        )
+        self.assertEqual(
+            stats["yeardata"], Caffeine.objects.monthly_caffeine_for_user(user)
+        )
+        self.assertEqual(
+            stats["byhourdata"], Caffeine.objects.hourly_caffeine_for_user_overall(user)
+        )
+        self.assertEqual(
+            stats["byweekdaydata"],
+            Caffeine.objects.weekdaily_caffeine_for_user_overall(user),
+        )
+
+    def test_profile_stats_no_caffeine(self):
+        user = User.objects.create_user("testuser", "test@example.org", token="foo")
+        stats = Caffeine.objects.profile_stats(user)
+        self.assertEqual(stats["total"], {DRINK_TYPES.coffee: 0, DRINK_TYPES.mate: 0})
+        self.assertEqual(stats["todaydata"]["coffee"], 24 * [0])
+        self.assertEqual(stats["byweekdaydata"]["mate"], 7 * [0])
+
     def test_find_recent_caffeine_no_caffeine(self):
         user = User.objects.create_user("testuser", "test@example.org", token="foo")
         Caffeine.objects.create(
@@ -433,6 +573,26 @@ class CaffeineManagerTest(TestCase):
             latest,
         )
 
+    def test_create_for_user(self):
+        user = User.objects.create_user("test", "test@example.org")
+        Caffeine.objects.create(user=user, ctype=DRINK_TYPES.mate, date=self.now)
+        with self.assertNumQueries(0):
+            self.assertEqual(Caffeine.objects.create_for_user(user, []), [])
+        entries = [
+            {"ctype": DRINK_TYPES.coffee, "date": self.now},
+            {"ctype": DRINK_TYPES.mate, "date": self.now + timedelta(minutes=4)},
+            {"ctype": DRINK_TYPES.coffee, "date": self.now - timedelta(minutes=4)},
+            {"ctype": DRINK_TYPES.mate, "date": self.now + timedelta(minutes=6)},
+        ]
+        result = Caffeine.objects.create_for_user(user, entries)
+        self.assertEqual(
+            [caffeine is not None for caffeine in result], [True, False, False, True]
+        )
+        self.assertIsNotNone(result[0].pk)
+        self.assertEqual(Caffeine.objects.filter(user=user).count(), 3)
+        total = Caffeine.objects.total_caffeine_for_user(user)
+        self.assertEqual(total, {DRINK_TYPES.coffee: 1, DRINK_TYPES.mate: 2})
+
     def test_latest_caffeine_activity(self):
         users = self._create_users(5)
         drinks = [
@@ -606,6 +766,72 @@ class CaffeineManagerTest(TestCase):
         )
         self.assertEqual(top_totals, [18, 14, 11, 9, 8, 6, 5, 4, 3, 2])
 
+    def test_top_consumers_per_type(self):
+        users = self._create_users_with_deterministic_data()
+        with self.assertNumQueries(1):
+            toptotal = Caffeine.objects.top_consumers_total_per_type(3)
+        self.assertEqual(
+            [item["user"] for item in toptotal[DRINK_TYPES.coffee]],
+            [users[9], users[10], users[8]],
+        )
+        self.assertEqual(
+            [item["caffeine_count"] for item in toptotal[DRINK_TYPES.mate]],
+            [18, 14, 14],
+        )
+        self.assertEqual(toptotal[DRINK_TYPES.mate][0]["user"].username, "test4")
+        with self.assertNumQueries(1):
+            topavg = Caffeine.objects.top_consumers_average_per_type(3)
+        self.assertEqual(sorted(topavg), [DRINK_TYPES.coffee, DRINK_TYPES.mate])
+        self.assertEqual(len(topavg[DRINK_TYPES.mate]), 3)
+        with self.assertNumQueries(1):
+            toprecent = Caffeine.objects.top_consumers_recent_per_type(
+                3, start_time=self.now, interval="10 days"
+            )
+        self.assertEqual(
+            [item["total"] for item in toprecent[DRINK_TYPES.coffee]], [18, 17, 12]
+        )
+        self.assertEqual(
+            [item["total"] for item in toprecent[DRINK_TYPES.mate]], [18, 14, 11]
+        )
+
+    def test_top_consumers_recent_window_parts(self):
+        user = User.objects.create_user("test", "test@example.org")
+        start_time = datetime(2024, 5, 31, 14, 20)
+        for delta in (
+            timedelta(minutes=-1),
+            timedelta(minutes=30),
+            timedelta(hours=5),
+            timedelta(days=2),
+            timedelta(days=10, hours=3),
+        ):
+            Caffeine.objects.create(
+                user=user,
+                ctype=DRINK_TYPES.coffee,
+                date=start_time - timedelta(days=10) + delta,
+            )
+        toprecent = Caffeine.objects.top_consumers_recent(
+            DRINK_TYPES.coffee, start_time=start_time, interval="10 days"
+        )
+        self.assertEqual(toprecent[0]["total"], 4)
+        self.assertEqual(toprecent[0]["average"], 0.4)
+
+    def test_top_consumers_recent_default_start_time(self):
+        user = User.objects.create_user("test", "test@example.org")
+        for delta in (timedelta(hours=-1), timedelta(hours=1)):
+            Caffeine.objects.create(
+                user=user,
+                ctype=DRINK_TYPES.mate,
+                date=timezone.now() - timedelta(days=30) + delta,
+            )
+        toprecent = Caffeine.objects.top_consumers_recent(DRINK_TYPES.mate)
+        self.assertEqual(toprecent[0]["total"], 1)
+
+    def test_top_consumers_per_type_no_caffeine(self):
+        self.assertEqual(
+            Caffeine.objects.top_consumers_total_per_type(),
+            {DRINK_TYPES.coffee: [], DRINK_TYPES.mate: []},
+        )
+
     def test_get_csv_data(self):
         user = User.objects.create_user(username="test", email="test@example.org")
         td = timedelta(days=1)
@@ -700,6 +926,427 @@ class CaffeineTest(TransactionTestCase):
         ):
             second_caff.clean()
 
+    def test_create_unless_recent(self):
+        user = User.objects.create_user("testuser", "test@example.org")
+        date = datetime(2024, 5, 15, 17)
+        caffeine = Caffeine.objects.create_unless_recent(
+            Caffeine(user=user, ctype=DRINK_TYPES.coffee, date=date, timezone="GMT")
+        )
+        self.assertEqual(Caffeine.objects.get().pk, caffeine.pk)
+        self.assertEqual(Caffeine.objects.total_caffeine_for_user(user)[0], 1)
+        with self.assertRaisesRegex(
+            ValidationError, r"Your last \w+ was less than \d+ minutes ago at"
+        ):
+            Caffeine.objects.create_unless_recent(
+                Caffeine(
+                    user=user,
+                    ctype=DRINK_TYPES.coffee,
+                    date=date - timedelta(minutes=1),
+                )
+            )
+        Caffeine.objects.create_unless_recent(
+            Caffeine(user=user, ctype=DRINK_TYPES.mate, date=date)
+        )
+        self.assertEqual(Caffeine.objects.count(), 2)
+
+    def test_create_unless_recent_concurrently(self):
+        user = User.objects.create_user("testuser", "test@example.org")
+        date = datetime(2024, 5, 15, 17)
+        barrier = threading.Barrier(4)
+        results = []
+
+        def submit(minutes):
+            try:
+                barrier.wait()
+                results.append(
+                    Caffeine.objects.create_unless_recent(
+                        Caffeine(
+                            user=user,
+                            ctype=DRINK_TYPES.coffee,
+                            date=date + timedelta(minutes=minutes),
+                        )
+                    )
+                )
+            except ValidationError:
+                results.append(None)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=submit, args=(minutes,)) for minutes in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 4)
+        self.assertEqual(Caffeine.objects.count(), 1)
+
+
+class CaffeineRollupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("testuser", "test@example.org")
+        self.date = datetime(2024, 5, 15, 17, 42, 23)
+
+    def _rollup(self, ctype=DRINK_TYPES.coffee):
+        return dict(
+            CaffeineRollup.objects.filter(user=self.user, ctype=ctype).values_list(
+                "period", "count"
+            )
+        )
+
+    def test_create_counts_caffeine_into_buckets(self):
+        Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.coffee, date=self.date
+        )
+        Caffeine.objects.create(
+            user=self.user,
+            ctype=DRINK_TYPES.coffee,
+            date=self.date + timedelta(hours=2),
+        )
+        self.assertEqual(
+            sorted(
+                CaffeineRollup.objects.filter(user=self.user).values_list(
+                    "period", "bucket", "count"
+                )
+            ),
+            [
+                (ROLLUP_PERIODS.hour, datetime(2024, 5, 15, 17), 1),
+                (ROLLUP_PERIODS.hour, datetime(2024, 5, 15, 19), 1),
+                (ROLLUP_PERIODS.day, datetime(2024, 5, 15), 2),
+                (ROLLUP_PERIODS.month, datetime(2024, 5, 1), 2),
+            ],
+        )
+        self.assertEqual(
+            list(
+                CaffeineHistogram.objects.filter(user=self.user)
+                .values_list("ctype", "hour", "weekday", "count")
+                .order_by("hour")
+            ),
+            [(DRINK_TYPES.coffee, 17, 3, 1), (DRINK_TYPES.coffee, 19, 3, 1)],
+        )
+
+    def test_delete_removes_caffeine_from_buckets(self):
+        caffeine = Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.mate, date=self.date
+        )
+        caffeine.delete()
+        self.assertEqual(set(self._rollup(DRINK_TYPES.mate).values()), {0})
+        self.assertEqual(
+            Caffeine.objects.total_caffeine_for_user(self.user)[DRINK_TYPES.mate], 0
+        )
+
+    def test_update_moves_caffeine_between_buckets(self):
+        caffeine = Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.coffee, date=self.date
+        )
+        caffeine.ctype = DRINK_TYPES.mate
+        caffeine.save()
+        self.assertEqual(set(self._rollup(DRINK_TYPES.coffee).values()), {0})
+        self.assertEqual(set(self._rollup(DRINK_TYPES.mate).values()), {1})
+
+    def test_delete_user_removes_rollups(self):
+        Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.coffee, date=self.date
+        )
+        self.user.delete()
+        self.assertFalse(CaffeineRollup.objects.exists())
+        self.assertFalse(CaffeineHistogram.objects.exists())
+
+    def test_rebuild(self):
+        for hours in range(3):
+            Caffeine.objects.create(
+                user=self.user,
+                ctype=DRINK_TYPES.coffee,
+                date=self.date + timedelta(hours=hours),
+            )
+        expected_rollup = sorted(
+            CaffeineRollup.objects.values_list(
+                "user", "ctype", "period", "bucket", "count"
+            )
+        )
+        expected_histogram = sorted(
+            CaffeineHistogram.objects.values_list(
+                "user", "ctype", "hour", "weekday", "count"
+            )
+        )
+        CaffeineRollup.objects.all().update(count=42)
+        CaffeineHistogram.objects.all().delete()
+        CaffeineRollup.objects.rebuild(self.user)
+        CaffeineHistogram.objects.rebuild()
+        self.assertEqual(
+            sorted(
+                CaffeineRollup.objects.values_list(
+                    "user", "ctype", "period", "bucket", "count"
+                )
+            ),
+            expected_rollup,
+        )
+        self.assertEqual(
+            sorted(
+                CaffeineHistogram.objects.values_list(
+                    "user", "ctype", "hour", "weekday", "count"
+                )
+            ),
+            expected_histogram,
+        )
+
+
+class CaffeineSummaryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("testuser", "test@example.org")
+        self.date = datetime(2024, 5, 15, 17, 42, 23)
+        self.caffeines = [
+            Caffeine.objects.create(
+                user=self.user,
+                ctype=DRINK_TYPES.coffee,
+                date=self.date + timedelta(hours=hours),
+            )
+            for hours in range(3)
+        ]
+
+    def _summary(self, ctype=DRINK_TYPES.coffee):
+        return CaffeineSummary.objects.values_list("count", "first", "last").get(
+            user=self.user, ctype=ctype
+        )
+
+    def test_create_updates_summary(self):
+        self.assertEqual(
+            self._summary(), (3, self.date, self.date + timedelta(hours=2))
+        )
+        Caffeine.objects.create(
+            user=self.user,
+            ctype=DRINK_TYPES.coffee,
+            date=self.date - timedelta(days=1),
+        )
+        self.assertEqual(
+            self._summary(),
+            (4, self.date - timedelta(days=1), self.date + timedelta(hours=2)),
+        )
+
+    def test_delete_first_and_last(self):
+        self.caffeines[0].delete()
+        self.caffeines[2].delete()
+        self.assertEqual(
+            self._summary(),
+            (1, self.date + timedelta(hours=1), self.date + timedelta(hours=1)),
+        )
+        self.caffeines[1].delete()
+        self.assertEqual(self._summary(), (0, None, None))
+
+    def test_update_moves_caffeine_between_summaries(self):
+        caffeine = self.caffeines[2]
+        caffeine.ctype = DRINK_TYPES.mate
+        caffeine.save()
+        self.assertEqual(
+            self._summary(),
+            (2, self.date, self.date + timedelta(hours=1)),
+        )
+        self.assertEqual(
+            self._summary(DRINK_TYPES.mate),
+            (1, caffeine.date, caffeine.date),
+        )
+
+    def test_rebuild(self):
+        fields = ("user", "ctype", "count", "first", "last")
+        expected = list(CaffeineSummary.objects.values_list(*fields))
+        CaffeineSummary.objects.all().update(count=42, first=None)
+        CaffeineSummary.objects.rebuild(self.user)
+        self.assertEqual(list(CaffeineSummary.objects.values_list(*fields)), expected)
+
+
+class CaffeineTombstoneTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("testuser", "test@example.org")
+        self.caffeine = Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.coffee, date=datetime(2024, 5, 15, 17)
+        )
+
+    def test_delete_records_tombstone(self):
+        caffeine_id = self.caffeine.id
+        self.caffeine.delete()
+        tombstone = CaffeineTombstone.objects.get()
+        self.assertEqual(tombstone.caffeine_id, caffeine_id)
+        self.assertEqual(
+            list(
+                CaffeineTombstone.objects.deleted_after(
+                    self.user, (tombstone.deleted, tombstone.id - 1)
+                )
+            ),
+            [tombstone],
+        )
+        self.assertFalse(
+            CaffeineTombstone.objects.deleted_after(
+                self.user, (tombstone.deleted, tombstone.id)
+            ).exists()
+        )
+
+    @override_settings(API_SYNC_TOMBSTONE_DAYS=30)
+    def test_prune(self):
+        self.caffeine.delete()
+        self.assertEqual(CaffeineTombstone.objects.prune(), 0)
+        CaffeineTombstone.objects.update(deleted=timezone.now() - timedelta(days=31))
+        self.assertEqual(CaffeineTombstone.objects.prune(), 1)
+        self.assertFalse(CaffeineTombstone.objects.exists())
+
+    def test_user_deletion_records_no_tombstones(self):
+        self.user.delete()
+        self.assertFalse(CaffeineTombstone.objects.exists())
+
+
+class PendingExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("testuser", "test@example.org")
+
+    def test_request_export_once(self):
+        PendingExport.objects.request_export(self.user)
+        PendingExport.objects.request_export(self.user)
+        self.assertEqual(PendingExport.objects.filter(user=self.user).count(), 1)
+
+    def test_process(self):
+        PendingExport.objects.request_export(self.user)
+        self.assertEqual(PendingExport.objects.process(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].recipients(), ["test@example.org"])
+        self.assertFalse(PendingExport.objects.exists())
+        self.assertEqual(PendingExport.objects.process(), 0)
+
+    def test_process_keeps_failed_exports(self):
+        PendingExport.objects.request_export(self.user)
+        with patch.object(User, "export_csv", side_effect=OSError), self.assertLogs(
+            "caffeine.models", "ERROR"
+        ):
+            self.assertEqual(PendingExport.objects.process(), 0)
+        export = PendingExport.objects.get(user=self.user)
+        self.assertEqual(export.attempts, 1)
+        self.assertGreater(export.retry_after, timezone.now())
+        # the failed export is not due yet
+        self.assertEqual(PendingExport.objects.process(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(CAFFEINE_EXPORT_MAX_ATTEMPTS=2)
+    def test_process_drops_export_after_max_attempts(self):
+        PendingExport.objects.request_export(self.user)
+        with patch.object(User, "export_csv", side_effect=OSError), self.assertLogs(
+            "caffeine.models", "ERROR"
+        ):
+            for attempt in range(2):
+                PendingExport.objects.update(retry_after=timezone.now())
+                self.assertEqual(PendingExport.objects.process(), 0)
+        self.assertFalse(PendingExport.objects.exists())
+
+
+@override_settings(OVERALL_STATISTICS_LAG=0)
+class OverallStatisticsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("testuser", "test@example.org", "s3cr3t")
+        self.other = User.objects.create_user(
+            "testuser2", "test2@example.org", "s3cr3t"
+        )
+        now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for user, ctype, hours in (
+            (self.user, DRINK_TYPES.coffee, 0),
+            (self.user, DRINK_TYPES.coffee, 30),
+            (self.user, DRINK_TYPES.mate, 400),
+            (self.other, DRINK_TYPES.coffee, 0),
+            (self.other, DRINK_TYPES.mate, 24 * 400),
+        ):
+            Caffeine.objects.create(
+                user=user, ctype=ctype, date=now - timedelta(hours=hours)
+            )
+
+    def _assert_matches_live_statistics(self):
+        stats = OverallStatistics.objects.overall_stats()
+        self.assertEqual(stats["total"], Caffeine.objects.total_caffeine())
+        self.assertEqual(stats["todaydata"], Caffeine.objects.hourly_caffeine())
+        self.assertEqual(stats["monthdata"], Caffeine.objects.daily_caffeine())
+        self.assertEqual(stats["yeardata"], Caffeine.objects.monthly_caffeine_overall())
+        self.assertEqual(
+            stats["byhourdata"], Caffeine.objects.hourly_caffeine_overall()
+        )
+        self.assertEqual(
+            stats["byweekdaydata"], Caffeine.objects.weekdaily_caffeine_overall()
+        )
+
+    def test_overall_stats_without_snapshot(self):
+        stats = OverallStatistics.objects.overall_stats()
+        self.assertEqual(stats["total"], {DRINK_TYPES.coffee: 0, DRINK_TYPES.mate: 0})
+
+    def test_refresh(self):
+        snapshot = OverallStatistics.objects.refresh()
+        self.assertIsNotNone(snapshot.refreshed)
+        self._assert_matches_live_statistics()
+
+    def test_aoverall_stats(self):
+        OverallStatistics.objects.refresh()
+        self.assertEqual(
+            async_to_sync(OverallStatistics.objects.aoverall_stats)(),
+            OverallStatistics.objects.overall_stats(),
+        )
+
+    def test_refresh_counts_new_entries_once(self):
+        OverallStatistics.objects.refresh()
+        Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.mate, date=timezone.now()
+        )
+        OverallStatistics.objects.refresh()
+        OverallStatistics.objects.refresh()
+        self._assert_matches_live_statistics()
+
+    @override_settings(OVERALL_STATISTICS_LAG=3600)
+    def test_refresh_skips_recent_entries(self):
+        OverallStatistics.objects.refresh()
+        stats = OverallStatistics.objects.overall_stats()
+        self.assertEqual(stats["total"], {DRINK_TYPES.coffee: 0, DRINK_TYPES.mate: 0})
+
+    def test_refresh_rebuild(self):
+        OverallStatistics.objects.refresh()
+        OverallStatistics.objects.update(counters={})
+        OverallStatistics.objects.refresh(rebuild=True)
+        self._assert_matches_live_statistics()
+
+    def test_delete_and_update_adjust_snapshot(self):
+        OverallStatistics.objects.refresh()
+        caffeine = Caffeine.objects.filter(user=self.user).order_by("date").first()
+        caffeine.delete()
+        caffeine = Caffeine.objects.filter(user=self.other).order_by("date").last()
+        caffeine.ctype = DRINK_TYPES.mate
+        caffeine.date -= timedelta(days=2)
+        caffeine.save()
+        OverallStatistics.objects.refresh()
+        self._assert_matches_live_statistics()
+        self.assertFalse(OverallStatisticsDelta.objects.exists())
+
+    def test_delete_records_delta_without_changing_snapshot(self):
+        snapshot = OverallStatistics.objects.refresh()
+        Caffeine.objects.filter(user=self.user).order_by("date").first().delete()
+        self.assertEqual(
+            OverallStatistics.objects.get(pk=1).counters, snapshot.counters
+        )
+        self.assertEqual(
+            list(OverallStatisticsDelta.objects.values_list("count", flat=True)),
+            [-1],
+        )
+
+    def test_delta_of_uncounted_entry_is_dropped(self):
+        caffeine = Caffeine.objects.filter(user=self.user).order_by("date").first()
+        caffeine.delete()
+        OverallStatistics.objects.refresh()
+        self._assert_matches_live_statistics()
+        self.assertFalse(OverallStatisticsDelta.objects.exists())
+
+    def test_delete_user_removes_counted_entries(self):
+        OverallStatistics.objects.refresh()
+        self.user.delete()
+        OverallStatistics.objects.refresh()
+        self._assert_matches_live_statistics()
+
+    def test_delete_users_queryset_removes_counted_entries(self):
+        OverallStatistics.objects.refresh()
+        User.objects.filter(pk=self.user.pk).delete()
+        OverallStatistics.objects.refresh()
+        self._assert_matches_live_statistics()
+
 
 class ActionManagerTest(TestCase):
     def test_create_action(self):
@@ -1,5 +1,7 @@
 import json
-from datetime import timedelta
+import zipfile
+from datetime import datetime, timedelta
+from io import BytesIO
 from unittest.mock import patch
 
 from django.conf import settings
@@ -7,7 +9,10 @@ from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
 from django.core import mail
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
@@ -16,7 +21,13 @@ from caffeine.forms import (
     EMPTY_TIMEZONE_ERROR,
     SettingsForm,
 )
-from caffeine.models import ACTION_TYPES, Action, Caffeine, DRINK_TYPES
+from caffeine.models import (
+    ACTION_TYPES,
+    Action,
+    Caffeine,
+    DRINK_TYPES,
+    PendingExport,
+)
 from caffeine.views import (
     ACTIVATION_SUCCESS_MESSAGE,
     CaffeineRegistrationView,
@@ -24,6 +35,8 @@ from caffeine.views import (
     DELETE_CAFFEINE_SUCCESS_MESSAGE,
     EMAIL_CHANGE_SUCCESS_MESSAGE,
     EXPORT_SUCCESS_MESSAGE,
+    OverallView,
+    RANDOM_USERS_MAX_COUNT,
     REGISTRATION_MAILINFO_MESSAGE,
     REGISTRATION_SUCCESS_MESSAGE,
     SELECT_TIMEZONE_SUCCESS_MESSAGE,
@@ -97,6 +110,25 @@ class AboutViewTest(CaffeineViewTest):
 
 
 class ExploreViewTest(CaffeineViewTest):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_serves_cached_sections(self):
+        user = self._create_testuser()
+        self.assertTrue(self._do_login(user), "login failed")
+        self.client.get("/explore/")
+        Caffeine.objects.create(
+            user=user, ctype=DRINK_TYPES.coffee, date=timezone.now()
+        )
+        response = self.client.get("/explore/")
+        self.assertEqual(response.context["topcoffee"], [])
+        cache.clear()
+        response = self.client.get("/explore/")
+        self.assertEqual(response.context["topcoffee"][0]["caffeine_count"], 1)
+
     def test_redirects_to_login(self):
         response = self.client.get("/explore/")
         self.assertRedirects(response, "/auth/login/?next=/explore/")
@@ -129,15 +161,62 @@ class ExportActivityView(MessagesTestMixin, CaffeineViewTest):
         response = self.client.get("/activity/export/")
         self.assertRedirects(response, "/auth/login/?next=/activity/export/")
 
-    def test_sends_csv_mail(self):
+    def test_queues_export(self):
         self.assertTrue(self._do_login(), "login failed")
         response = self.client.get("/activity/export/", follow=True)
-        self.assertEqual(len(mail.outbox), 1)
-        self.assertEqual(mail.outbox[0].subject, "Your caffeine records")
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertTrue(
+            PendingExport.objects.filter(user__username="testuser").exists()
+        )
         self.assertMessageCount(response, 1)
         self.assertMessageContains(response, EXPORT_SUCCESS_MESSAGE, messages.INFO)
 
 
+class DownloadActivityViewTest(CaffeineViewTest):
+    def setUp(self):
+        self.user = self._create_testuser()
+        Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.coffee, date=datetime(2024, 5, 15, 17)
+        )
+
+    def test_redirects_to_login(self):
+        response = self.client.get("/activity/download/coffee/")
+        self.assertRedirects(response, "/auth/login/?next=/activity/download/coffee/")
+
+    def test_csv(self):
+        self.assertTrue(self._do_login(self.user), "login failed")
+        response = self.client.get("/activity/download/coffee/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertRegex(
+            response["Content-Disposition"], r'^attachment; filename="coffee-.+\.csv"$'
+        )
+        self.assertEqual(
+            b"".join(response.streaming_content),
+            b"Timestamp\r\n2024-05-15 17:00:00\r\n",
+        )
+
+    def test_zip(self):
+        self.assertTrue(self._do_login(self.user), "login failed")
+        response = self.client.get("/activity/download/all/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as zf:
+            names = zf.namelist()
+            self.assertEqual(len(names), 2)
+            self.assertRegex(names[0], r"^coffee-.+\.csv$")
+            self.assertRegex(names[1], r"^mate-.+\.csv$")
+            self.assertEqual(zf.read(names[0]), b"Timestamp\r\n2024-05-15 17:00:00\r\n")
+            self.assertEqual(zf.read(names[1]), b"Timestamp\r\n")
+
+    def test_unknown_drink(self):
+        self.assertTrue(self._do_login(self.user), "login failed")
+        response = self.client.get("/activity/download/tea/")
+        self.assertEqual(response.status_code, 404)
+
+
 class DeleteAccountViewTest(MessagesTestMixin, CaffeineViewTest):
     def test_redirects_to_login(self):
         response = self.client.get("/deletemyaccount/")
@@ -176,6 +255,14 @@ class OverallViewTest(CaffeineViewTest):
         response = self.client.get("/overall/")
         self.assertTemplateUsed(response, "overall.html")
 
+    def test_view_is_async(self):
+        self.assertTrue(OverallView.view_is_async)
+
+    async def test_async_client(self):
+        response = await self.async_client.get("/overall/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("coffees", response.context)
+
     def test_context_items(self):
         response = self.client.get("/overall/")
         for item in (
@@ -583,6 +670,45 @@ class SubmitCaffeineViewTest(MessagesTestMixin, CaffeineViewTest):
         self.assertMessageCount(response, 1)
         self.assertMessageContains(response, "", messages.ERROR)
 
+    def test_json_response(self):
+        user = self._create_testuser()
+        self.assertTrue(self._do_login(user), "login failed")
+        now = timezone.now()
+        response = self.client.post(
+            "/coffee/submit/",
+            data={"date": now.date(), "time": now.time()},
+            HTTP_ACCEPT="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        coffee = Caffeine.objects.get()
+        data = response.json()
+        self.assertEqual(
+            data["message"], SUBMIT_CAFFEINE_SUCCESS_MESSAGE % {"caffeine": coffee}
+        )
+        self.assertEqual(data["caffeine"]["id"], coffee.id)
+        self.assertEqual(
+            data["caffeine"]["delete_url"], "/delete/{}/".format(coffee.id)
+        )
+        self.assertEqual(data["counts"], {"coffee": 1, "mate": 0})
+        self.assertMessageCount(self.client.get("/profile/"), 0)
+
+    def test_json_error_response(self):
+        user = self._create_testuser()
+        self.assertTrue(self._do_login(user), "login failed")
+        Caffeine.objects.create(
+            ctype=DRINK_TYPES.coffee,
+            user=user,
+            date=timezone.now() - timedelta(minutes=3),
+        )
+        now = timezone.now()
+        response = self.client.post(
+            "/coffee/submit/",
+            data={"date": now.date(), "time": now.time()},
+            HTTP_ACCEPT="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()["errors"]), 1)
+
 
 class SubmitCaffeineOnTheRunView(MessagesTestMixin, CaffeineViewTest):
     def test_does_not_support_get(self):
@@ -638,6 +764,36 @@ class SubmitCaffeineOnTheRunView(MessagesTestMixin, CaffeineViewTest):
         self.assertMessageCount(response, 1)
         self.assertMessageContains(response, "", messages.ERROR)
 
+    def test_lean_json_response(self):
+        user = self._create_testuser()
+        self._do_login(user)
+        client = Client(enforce_csrf_checks=True)
+        client.cookies = self.client.cookies
+        now = timezone.now()
+        with CaptureQueriesContext(connection) as context:
+            response = client.post(
+                "/coffee/submit/{}/{}/".format(user.username, user.token),
+                data={"date": now.date(), "time": now.time()},
+                HTTP_ACCEPT="application/json",
+            )
+        self.assertEqual(response.status_code, 201)
+        coffee = Caffeine.objects.get()
+        self.assertEqual(
+            response.json(),
+            {
+                "message": SUBMIT_CAFFEINE_SUCCESS_MESSAGE % {"caffeine": coffee},
+                "id": coffee.id,
+            },
+        )
+        self.assertNotIn("Cookie", response.get("Vary", ""))
+        self.assertFalse(
+            [
+                query
+                for query in context.captured_queries
+                if "django_session" in query["sql"]
+            ]
+        )
+
 
 class DeleteCaffeineViewTest(MessagesTestMixin, CaffeineViewTest):
     def setUp(self):
@@ -693,6 +849,18 @@ class DeleteCaffeineViewTest(MessagesTestMixin, CaffeineViewTest):
             response, DELETE_CAFFEINE_SUCCESS_MESSAGE, messages.SUCCESS
         )
 
+    def test_json_response(self):
+        self.assertTrue(self._do_login(self.user), "login failed")
+        response = self.client.post(self.delete_url, HTTP_ACCEPT="application/json")
+        self.assertEqual(
+            response.json(),
+            {
+                "message": DELETE_CAFFEINE_SUCCESS_MESSAGE,
+                "counts": {"coffee": 0, "mate": 0},
+            },
+        )
+        self.assertFalse(Caffeine.objects.filter(user=self.user).exists())
+
 
 class SelectTimeZoneViewTest(MessagesTestMixin, CaffeineViewTest):
     def setUp(self):
@@ -820,3 +988,15 @@ class RandomUsersTest(TestCase):
             self.assertTrue(item["username"].startswith("test"))
             for key in ("username", "name", "location", "profile", "coffees", "mate"):
                 self.assertIn(key, item)
+
+    def test_count_is_limited(self):
+        for num in range(RANDOM_USERS_MAX_COUNT + 5):
+            User.objects.create_user(
+                "test{}".format(num + 1),
+                "test{}@example.org".format(num + 1),
+                token="testtoken{}".format(num + 1),
+            )
+        self._do_login()
+
+        response = self.client.get("{}?count=100".format(reverse("random_users")))
+        self.assertEqual(len(json.loads(response.content)), RANDOM_USERS_MAX_COUNT)
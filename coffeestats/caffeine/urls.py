@@ -9,6 +9,7 @@ from .views import (
     ConfirmActionView,
     DeleteAccountView,
     DeleteCaffeineView,
+    DownloadActivityView,
     ExploreView,
     ExportActivityView,
     ImprintView,
@@ -59,6 +60,11 @@ urlpatterns = [
     re_path(
         r"^activity/export/$", ExportActivityView.as_view(), name="export_activity"
     ),
+    re_path(
+        r"^activity/download/(?P<drink>(coffee|mate|all))/$",
+        DownloadActivityView.as_view(),
+        name="download_activity",
+    ),
     re_path(r"^deletemyaccount/$", DeleteAccountView.as_view(), name="delete_account"),
     re_path(
         r"^(?P<drink>(coffee|mate))/submit/$",
@@ -1,17 +1,24 @@
+import csv
+import zipfile
 import zoneinfo
+from io import TextIOWrapper
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.utils.translation import gettext as _
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET
 from django.views.generic import RedirectView, TemplateView, View
+from django.views.generic.base import ContextMixin, TemplateResponseMixin
 from django.views.generic.detail import SingleObjectMixin
 from django.views.generic.edit import BaseFormView, DeleteView, FormView, UpdateView
 from django_registration.backends.activation.views import (
@@ -19,7 +26,7 @@ from django_registration.backends.activation.views import (
     RegistrationView,
 )
 
-from core.utils import json_response
+from core.utils import Echo, StreamBuffer, json_response, session_exempt
 
 from .forms import (
     CoffeestatsRegistrationForm,
@@ -27,7 +34,16 @@ from .forms import (
     SettingsForm,
     SubmitCaffeineForm,
 )
-from .models import ACTION_TYPES, DRINK_TYPES, Action, Caffeine, User
+from .leaderboards import get_leaderboards
+from .models import (
+    ACTION_TYPES,
+    DRINK_TYPES,
+    Action,
+    Caffeine,
+    OverallStatistics,
+    PendingExport,
+    User,
+)
 
 ACTIVATION_SUCCESS_MESSAGE = _("Your account has been activated successfully.")
 DELETE_ACCOUNT_MESSAGE = _(
@@ -36,8 +52,9 @@ DELETE_ACCOUNT_MESSAGE = _(
 DELETE_CAFFEINE_SUCCESS_MESSAGE = _("Entry deleted successfully!")
 EMAIL_CHANGE_SUCCESS_MESSAGE = _("Your email address has been changed successfully.")
 EXPORT_SUCCESS_MESSAGE = _(
-    "Your data has been exported. You will receive an email with two CSV "
-    "files with your coffee and mate registrations attached."
+    "Your export has been queued. You will receive an email with two "
+    "compressed CSV files with your coffee and mate registrations attached "
+    "shortly."
 )
 REGISTRATION_SUCCESS_MESSAGE = _("You got it.")
 REGISTRATION_MAILINFO_MESSAGE = _(
@@ -52,9 +69,51 @@ SELECT_TIMEZONE_SUCCESS_MESSAGE = _(
 )
 SETTINGS_PASSWORD_CHANGE_SUCCESS = _("Successfully changed your password!")
 SETTINGS_SUCCESS_MESSAGE = _("Successfully updated your profile information!")
+RANDOM_USERS_MAX_COUNT = 20
 SUBMIT_CAFFEINE_SUCCESS_MESSAGE = _("Your %(caffeine)s has been registered")
 
 
+def wants_json(request):
+    """
+    Check whether a request asks for a JSON response instead of a redirect.
+
+    :param HttpRequest request: the current request
+    :return: True if the request accepts JSON explicitly
+    """
+    return "application/json" in request.headers.get("Accept", "")
+
+
+def caffeine_counts(user):
+    """
+    Return the total number of drinks of a user per drink type name.
+
+    :param User user: user instance
+    :return: dictionary mapping drink type names to counts
+    """
+    totals = Caffeine.objects.total_caffeine_for_user(user)
+    return {attr: totals[key] for key, attr, _ in DRINK_TYPES._triples}
+
+
+def caffeine_entry(caffeine):
+    """
+    Return the data of a caffeine entry as shown in the latest entries of the
+    profile page.
+
+    :param Caffeine caffeine: caffeine instance
+    :return: dictionary with the id, a label and the deletion URL
+    """
+    return {
+        "id": caffeine.id,
+        "label": _("%(entrytype)s at %(entrytime)s %(entrytimezone)s")
+        % {
+            "entrytype": caffeine.format_type(),
+            "entrytime": caffeine.date.strftime("%Y-%m-%d %H:%M:%S"),
+            "entrytimezone": caffeine.timezone,
+        },
+        "delete_url": reverse("delete_caffeine", args=[caffeine.id]),
+    }
+
+
 class AboutView(LoginRequiredMixin, TemplateView):
     template_name = "about.html"
 
@@ -64,30 +123,8 @@ class ExploreView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context_data = super(ExploreView, self).get_context_data(**kwargs)
-        context_data.update(
-            {
-                "activities": Caffeine.objects.latest_caffeine_activity(10),
-                "users": User.objects.random_users(4),
-                "topcoffee": Caffeine.objects.top_consumers_total(
-                    DRINK_TYPES.coffee, 10
-                ),
-                "topcoffeeavg": Caffeine.objects.top_consumers_average(
-                    DRINK_TYPES.coffee, 10
-                ),
-                "topmate": Caffeine.objects.top_consumers_total(DRINK_TYPES.mate, 10),
-                "topmateavg": Caffeine.objects.top_consumers_average(
-                    DRINK_TYPES.mate, 10
-                ),
-                "topcoffeerecent": Caffeine.objects.top_consumers_recent(
-                    DRINK_TYPES.coffee, 10, interval="30 days"
-                ),
-                "topmaterecent": Caffeine.objects.top_consumers_recent(
-                    DRINK_TYPES.mate, 10, interval="30 days"
-                ),
-                "recentlyjoined": User.objects.recently_joined(5),
-                "longestjoined": User.objects.longest_joined(count=5, days=365),
-            }
-        )
+        context_data.update(get_leaderboards())
+        context_data["users"] = User.objects.random_users(4)
         return context_data
 
 
@@ -96,11 +133,80 @@ class ExportActivityView(LoginRequiredMixin, RedirectView):
     url = reverse_lazy("settings")
 
     def get_redirect_url(self, *args, **kwargs):
-        self.request.user.export_csv()
+        PendingExport.objects.request_export(self.request.user)
         messages.add_message(self.request, messages.INFO, EXPORT_SUCCESS_MESSAGE)
         return super(ExportActivityView, self).get_redirect_url(*args, **kwargs)
 
 
+def stream_csv(drinktype, user):
+    """
+    Generate the lines of a CSV file with the records of a user for a
+    specific drink type.
+
+    :param str drinktype: drink type
+    :param User user: user instance
+    :return: generator of CSV lines
+    """
+    writer = csv.writer(Echo())
+    for row in Caffeine.objects.csv_rows(drinktype, user):
+        yield writer.writerow(row)
+
+
+def stream_zip(user, filenames):
+    """
+    Generate the chunks of a ZIP file with a CSV file of the records of a
+    user per drink type.
+
+    :param User user: user instance
+    :param dict filenames: CSV file names by drink type
+    :return: generator of bytes
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for drinktype, filename in filenames.items():
+            with zip_file.open(filename, "w") as entry:
+                textfile = TextIOWrapper(entry, encoding="utf8", newline="")
+                writer = csv.writer(textfile)
+                for row in Caffeine.objects.csv_rows(drinktype, user):
+                    writer.writerow(row)
+                    data = buffer.take()
+                    if data:
+                        yield data
+                textfile.detach()
+            yield buffer.take()
+    yield buffer.take()
+
+
+class DownloadActivityView(LoginRequiredMixin, View):
+    """
+    Stream the records of the user for one drink type as CSV file or the
+    records of all drink types as ZIP file. The memory use only stays
+    constant when served through WSGI, Django's ASGI handler collects
+    synchronous streaming content in memory.
+
+    """
+
+    def get(self, request, drink):
+        today = timezone.now().strftime("%Y-%m-%d")
+        filenames = dict(
+            (getattr(DRINK_TYPES, name), "%s-%s.csv" % (name, today))
+            for name in ("coffee", "mate")
+        )
+        if drink == "all":
+            filename = "coffeestats-%s.zip" % today
+            response = StreamingHttpResponse(
+                stream_zip(request.user, filenames), content_type="application/zip"
+            )
+        else:
+            drinktype = getattr(DRINK_TYPES, drink)
+            filename = filenames[drinktype]
+            response = StreamingHttpResponse(
+                stream_csv(drinktype, request.user), content_type="text/csv"
+            )
+        response["Content-Disposition"] = 'attachment; filename="%s"' % filename
+        return response
+
+
 class DeleteAccountView(LoginRequiredMixin, DeleteView):
     model = User
     success_url = reverse_lazy("home")
@@ -122,25 +228,27 @@ class IndexView(TemplateView):
     template_name = "index.html"
 
 
-class OverallView(TemplateView):
-    template_name = "overall.html"
+class OverallView(TemplateResponseMixin, ContextMixin, View):
+    """
+    Show the site-wide statistics. The view is asynchronous because the
+    statistics snapshot is read with the async ORM.
 
-    def get_context_data(self, **kwargs):
-        total = Caffeine.objects.total_caffeine()
+    """
 
-        context_data = super(OverallView, self).get_context_data(**kwargs)
-        context_data.update(
-            {
-                "coffees": total[DRINK_TYPES.coffee],
-                "mate": total[DRINK_TYPES.mate],
-                "todaydata": Caffeine.objects.hourly_caffeine(),
-                "monthdata": Caffeine.objects.daily_caffeine(),
-                "yeardata": Caffeine.objects.monthly_caffeine_overall(),
-                "byhourdata": Caffeine.objects.hourly_caffeine_overall(),
-                "byweekdaydata": Caffeine.objects.weekdaily_caffeine_overall(),
-            }
+    template_name = "overall.html"
+
+    async def get(self, request, *args, **kwargs):
+        stats = await OverallStatistics.objects.aoverall_stats()
+        context = self.get_context_data(
+            coffees=stats["total"][DRINK_TYPES.coffee],
+            mate=stats["total"][DRINK_TYPES.mate],
+            todaydata=stats["todaydata"],
+            monthdata=stats["monthdata"],
+            yeardata=stats["yeardata"],
+            byhourdata=stats["byhourdata"],
+            byweekdaydata=stats["byweekdaydata"],
         )
-        return context_data
+        return self.render_to_response(context)
 
 
 class PublicProfileView(TemplateView):
@@ -155,26 +263,19 @@ class PublicProfileView(TemplateView):
         else:
             self.profileuser = self.request.user
 
-        total = Caffeine.objects.total_caffeine_for_user(self.profileuser)
-        todaydata = Caffeine.objects.hourly_caffeine_for_user(self.profileuser)
-        monthdata = Caffeine.objects.daily_caffeine_for_user(self.profileuser)
-        yeardata = Caffeine.objects.monthly_caffeine_for_user(self.profileuser)
-        byhourdata = Caffeine.objects.hourly_caffeine_for_user_overall(self.profileuser)
-        byweekdaydata = Caffeine.objects.weekdaily_caffeine_for_user_overall(
-            self.profileuser
-        )
+        stats = Caffeine.objects.profile_stats(self.profileuser)
 
         context.update(
             {
-                "byhourdata": byhourdata,
-                "byweekdaydata": byweekdaydata,
-                "coffees": total[DRINK_TYPES.coffee],
-                "mate": total[DRINK_TYPES.mate],
-                "monthdata": monthdata,
+                "byhourdata": stats["byhourdata"],
+                "byweekdaydata": stats["byweekdaydata"],
+                "coffees": stats["total"][DRINK_TYPES.coffee],
+                "mate": stats["total"][DRINK_TYPES.mate],
+                "monthdata": stats["monthdata"],
                 "ownprofile": self.ownprofile,
                 "profileuser": self.profileuser,
-                "todaydata": todaydata,
-                "yeardata": yeardata,
+                "todaydata": stats["todaydata"],
+                "yeardata": stats["yeardata"],
             }
         )
         return context
@@ -328,15 +429,36 @@ class BaseSubmitCaffeineView(BaseFormView):
 
     def form_valid(self, form):
         caffeine = form.save()
+        if caffeine is None:
+            return self.form_invalid(form)
+        message = SUBMIT_CAFFEINE_SUCCESS_MESSAGE % {"caffeine": caffeine}
+        if wants_json(self.request):
+            return JsonResponse(self.get_json_data(caffeine, message), status=201)
         messages.add_message(
-            self.request,
-            messages.SUCCESS,
-            SUBMIT_CAFFEINE_SUCCESS_MESSAGE % {"caffeine": caffeine},
-            extra_tags="registerdrink",
+            self.request, messages.SUCCESS, message, extra_tags="registerdrink"
         )
         return super(BaseSubmitCaffeineView, self).form_valid(form)
 
+    def get_json_data(self, caffeine, message):
+        """
+        Return the data of the JSON response for a submitted caffeine entry.
+
+        :param Caffeine caffeine: the new caffeine entry
+        :param str message: success message
+        :return: dictionary
+        """
+        return {"message": message, "id": caffeine.id}
+
     def form_invalid(self, form):
+        if wants_json(self.request):
+            return JsonResponse(
+                {
+                    "errors": [
+                        error for field in form.errors for error in form.errors[field]
+                    ]
+                },
+                status=400,
+            )
         for field in form.errors:
             for error in form.errors[field]:
                 messages.add_message(
@@ -359,8 +481,23 @@ class SubmitCaffeineView(LoginRequiredMixin, BaseSubmitCaffeineView):
     def get_success_url(self):
         return reverse("profile")
 
+    def get_json_data(self, caffeine, message):
+        return {
+            "message": message,
+            "caffeine": caffeine_entry(caffeine),
+            "counts": caffeine_counts(caffeine.user),
+        }
+
 
+@method_decorator([csrf_exempt, session_exempt], name="dispatch")
 class SubmitCaffeineOnTheRunView(BaseSubmitCaffeineView):
+    """
+    Submission view authenticated by the username and on-the-run token in
+    the URL. Requests accepting JSON get a compact response without touching
+    the session.
+
+    """
+
     def get_form_kwargs(self):
         user = get_object_or_404(
             User, username=self.kwargs["username"], token=self.kwargs["token"]
@@ -410,6 +547,17 @@ class DeleteCaffeineView(LoginRequiredMixin, DeleteView):
         )
         return super(DeleteCaffeineView, self).get_success_url()
 
+    def form_valid(self, form):
+        if not wants_json(self.request):
+            return super(DeleteCaffeineView, self).form_valid(form)
+        self.object.delete()
+        return JsonResponse(
+            {
+                "message": DELETE_CAFFEINE_SUCCESS_MESSAGE,
+                "counts": caffeine_counts(self.request.user),
+            }
+        )
+
 
 class SelectTimeZoneView(LoginRequiredMixin, UpdateView):
     form_class = SelectTimeZoneForm
@@ -440,12 +588,16 @@ class SelectTimeZoneView(LoginRequiredMixin, UpdateView):
         return self.request.user
 
 
-@require_GET
-@login_required
-@json_response
-def random_users(request):
+def random_user_data(request, count):
+    """
+    Return the public data of random users.
+
+    :param HttpRequest request: the current request
+    :param int count: number of users, limited to RANDOM_USERS_MAX_COUNT
+    :return: list of dictionaries
+    """
     data = []
-    for user in User.objects.random_users(int(request.GET.get("count", 5))):
+    for user in User.objects.random_users(min(count, RANDOM_USERS_MAX_COUNT)):
         data.append(
             {
                 "username": user.username,
@@ -459,3 +611,10 @@ def random_users(request):
             }
         )
     return data
+
+
+@require_GET
+@login_required
+@json_response
+def random_users(request):
+    return random_user_data(request, int(request.GET.get("count", 5)))
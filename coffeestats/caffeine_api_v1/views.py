@@ -3,14 +3,14 @@ from datetime import datetime, timedelta
 from functools import wraps
 
 from django.http import HttpResponseBadRequest, HttpResponseForbidden
-from django.urls import reverse
 from django.utils.translation import gettext as _
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
 from caffeine.forms import SubmitCaffeineForm
 from caffeine.models import DRINK_TYPES, User
-from core.utils import json_response
+from caffeine.views import random_user_data
+from core.utils import json_response, session_exempt
 
 API_ERROR_AUTH_REQUIRED = _("API operation requires authentication")
 API_ERROR_FUTURE_DATETIME = _("You can not enter dates in the future!")
@@ -38,7 +38,8 @@ API_WARNING_TIMEZONE_NOT_SET = _(
 
 def api_token_required(func):
     """
-    Decorator to force authentication with an on-the-run token.
+    Decorator to force authentication with an on-the-run token. The
+    decorated views do not need the session.
 
     """
 
@@ -66,7 +67,7 @@ def api_token_required(func):
         kwargs["messages"] = messages
         return func(request, *args, **kwargs)
 
-    return inner
+    return session_exempt(inner)
 
 
 @csrf_exempt
@@ -81,21 +82,7 @@ def random_users(request, **_):
     :return: list of users
 
     """
-    data = []
-    for user in User.objects.random_users(int(request.POST.get("count", 5))):
-        data.append(
-            {
-                "username": user.username,
-                "name": user.get_full_name(),
-                "location": user.location,
-                "profile": request.build_absolute_uri(
-                    reverse("public", kwargs={"username": user.username})
-                ),
-                "coffees": user.coffees,
-                "mate": user.mate,
-            }
-        )
-    return data
+    return random_user_data(request, int(request.POST.get("count", 5)))
 
 
 def _parse_drinktime(drinktime, messages):
@@ -144,10 +131,10 @@ def add_drink(request, userinfo, messages, *args, **kwargs):
     form = SubmitCaffeineForm(userinfo, getattr(DRINK_TYPES, ctype), data)
     form.date = time.date()
     form.time = time.time()
-    if not form.is_valid():
+    drink = form.save() if form.is_valid() else None
+    if drink is None:
         for key in form.errors:
             messages.setdefault("error", []).extend(form.errors[key])
         return HttpResponseBadRequest(json.dumps(messages), "text/json")
-    drink = form.save()
     messages["success"] = _("Your %(drink)s has been registered!") % {"drink": drink}
     return messages
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class CaffeineApiV2Config(AppConfig):
+    name = "caffeine_api_v2"
+
+    def ready(self):
+        from . import signals  # noqa
@@ -0,0 +1,150 @@
+"""
+Token authentication for the API using the token of the user model.
+
+Clients authenticate by sending an ``Authorization: Token <token>`` header.
+The shared Django cache maps a token to the primary key of its user and a
+random nonce that is generated whenever the entry is filled. A small
+in-process LRU cache keeps the users themselves together with the nonce of
+the shared entry they were loaded for and every request gets its own copy.
+A local entry is only used while the shared cache holds the same nonce,
+otherwise the user is fetched from the database again. The signal handlers
+in :py:mod:`caffeine_api_v2.signals` remove the shared entry whenever a user
+is saved or deleted. The next lookup stores a new nonce, so changes like a
+deactivation take effect in all processes at once.
+
+Requests without credentials are answered with ``401 Unauthorized`` and a
+``WWW-Authenticate: Token`` header because this is the first authentication
+class of the API.
+
+"""
+
+import copy
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from caffeine.models import User
+
+CACHE_KEY_PREFIX = "api-token:"
+
+
+class LRUCache(object):
+    """
+    Thread-safe least recently used cache with expiring entries. The number
+    of entries is limited by ``settings.API_TOKEN_CACHE_SIZE``.
+
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.API_TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_cache = LRUCache()
+
+
+def _cache_key(token):
+    return CACHE_KEY_PREFIX + hashlib.sha256(token.encode("utf8")).hexdigest()
+
+
+def get_token_user(token):
+    """
+    Get the user owning an API token.
+
+    :param str token: API token
+    :return: User instance or None if no user has the token
+    """
+    key = _cache_key(token)
+    shared = cache.get(key)
+    if shared is not None:
+        pk, nonce = shared
+        local = local_cache.get(key)
+        if local is not None and local[0] == nonce:
+            return copy.copy(local[1])
+        user = User.objects.filter(pk=pk, token=token).first()
+    else:
+        user = User.objects.filter(token=token).first()
+    if user is None:
+        return None
+    if shared is None:
+        nonce = uuid.uuid4().hex
+        cache.set(key, (user.pk, nonce), settings.API_TOKEN_CACHE_TIMEOUT)
+    local_cache.set(key, (nonce, user), settings.API_TOKEN_LOCAL_CACHE_TIMEOUT)
+    return copy.copy(user)
+
+
+def invalidate_token(token):
+    """
+    Remove the cached user of an API token.
+
+    :param str token: API token
+    """
+    if token:
+        key = _cache_key(token)
+        local_cache.delete(key)
+        cache.delete(key)
+
+
+class UserTokenAuthentication(BaseAuthentication):
+    """
+    Authentication with the API token of the user model.
+
+    """
+
+    keyword = "Token"
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(
+                "Invalid token header, expected exactly one token."
+            )
+        try:
+            token = auth[1].decode("ascii")
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                "Invalid token header, token contains invalid characters."
+            )
+        user = get_token_user(token)
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed("Invalid token.")
+        return (user, token)
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,139 @@
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination on a unique combination of ordering fields. The cursor
+    position holds the values of all ordering fields of the last entry of a
+    page and the following page starts after this entry in the ordering.
+    Unlike the offset that :py:class:`CursorPagination` uses for entries
+    sharing the value of the first ordering field every page is selected by
+    a range condition.
+
+    """
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            field_name = order.lstrip("-")
+            if isinstance(instance, dict):
+                value = instance[field_name]
+            else:
+                value = getattr(instance, field_name)
+            values.append(str(value))
+        return json.dumps(values)
+
+    def _filter_position(self, queryset, position, reverse):
+        """
+        Filter entries that follow a cursor position in the ordering of the
+        page.
+
+        :param QuerySet queryset: ordered entries
+        :param str position: cursor position
+        :param bool reverse: whether the cursor points backwards
+        :return: filtered QuerySet
+        """
+        field_names = [order.lstrip("-") for order in self.ordering]
+        try:
+            raw_values = json.loads(position)
+            if not isinstance(raw_values, list) or len(raw_values) != len(field_names):
+                raise ValueError(position)
+            values = [
+                queryset.model._meta.get_field(field_name).to_python(value)
+                for field_name, value in zip(field_names, raw_values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        condition = Q()
+        for index, order in enumerate(self.ordering):
+            lookup = "lt" if order.startswith("-") != reverse else "gt"
+            condition |= Q(
+                *[
+                    Q(**{field_name: value})
+                    for field_name, value in zip(field_names[:index], values)
+                ],
+                **{"%s__%s" % (field_names[index], lookup): values[index]}
+            )
+        return queryset.filter(condition)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, current_position = False, None
+        else:
+            reverse, current_position = self.cursor.reverse, self.cursor.position
+
+        if reverse:
+            queryset = queryset.order_by(
+                *[
+                    order[1:] if order.startswith("-") else "-" + order
+                    for order in self.ordering
+                ]
+            )
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = self._filter_position(queryset, current_position, reverse)
+
+        # fetch one more entry to determine whether there is a following page
+        results = list(queryset[: self.page_size + 1])
+        self.page = results[: self.page_size]
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            following_position = None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class CaffeineCursorPagination(KeysetCursorPagination):
+    """
+    Cursor pagination for caffeine entries on (date, id), newest entries
+    first.
+
+    """
+
+    ordering = ("-date", "-id")
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Cursor pagination for users ordered by their unique username.
+
+    """
+
+    ordering = "username"
+    page_size_query_param = "page_size"
+    max_page_size = settings.API_MAX_PAGE_SIZE
@@ -1,8 +1,14 @@
+from urllib.parse import quote
+
 from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils.http import RFC3986_SUBDELIMS
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
 from rest_framework.validators import BaseUniqueForValidator, UniqueTogetherValidator
 
-from caffeine.models import User, Caffeine, DRINK_TYPES
+from caffeine.models import User, Caffeine, CaffeineTombstone, DRINK_TYPES
 
 READABLE_DRINK_TYPES = [
     (triple[1], triple[2]) for triple in DRINK_TYPES._triples]
@@ -23,8 +29,112 @@ class CaffeineField(serializers.Field):
         raise RuntimeError(
             "Could not map database internal id {0} to value".format(obj))
 
+    default_error_messages = {
+        'invalid': 'Invalid drink type, choose one of {choices}.',
+    }
+
     def to_internal_value(self, data):
-        return getattr(DRINK_TYPES, data)
+        try:
+            return getattr(DRINK_TYPES, data)
+        except (AttributeError, TypeError):
+            self.fail('invalid', choices=', '.join(
+                attr for _, attr, _ in DRINK_TYPES._triples))
+
+
+URL_PLACEHOLDER = '1234567890987654321'
+
+
+class CachedUrlMixin(object):
+    """
+    Mixin for hyperlinked fields that reverses each view only once per
+    request. The URL is built for a placeholder lookup value and later URLs
+    are produced by inserting the quoted lookup value at its position, the
+    same way Django's reverse() quotes it.
+
+    """
+
+    def get_url(self, obj, view_name, request, format):
+        if request is None or (hasattr(obj, 'pk') and obj.pk in (None, '')):
+            return super(CachedUrlMixin, self).get_url(
+                obj, view_name, request, format)
+        templates = getattr(request, '_url_templates', None)
+        if templates is None:
+            templates = request._url_templates = {}
+        key = (view_name, self.lookup_url_kwarg, format)
+        if key not in templates:
+            url = self.reverse(
+                view_name, kwargs={self.lookup_url_kwarg: URL_PLACEHOLDER},
+                request=request, format=format)
+            parts = url.split(URL_PLACEHOLDER)
+            templates[key] = parts if len(parts) == 2 else None
+        parts = templates[key]
+        if parts is None:
+            return super(CachedUrlMixin, self).get_url(
+                obj, view_name, request, format)
+        return quote(
+            str(getattr(obj, self.lookup_field)),
+            safe=RFC3986_SUBDELIMS + '/~:@'
+        ).join(parts)
+
+
+class CachedHyperlinkedRelatedField(
+        CachedUrlMixin, serializers.HyperlinkedRelatedField):
+    pass
+
+
+class CachedHyperlinkedIdentityField(
+        CachedUrlMixin, serializers.HyperlinkedIdentityField):
+    pass
+
+
+class CachedUrlHyperlinkedModelSerializer(
+        serializers.HyperlinkedModelSerializer):
+    """
+    Hyperlinked model serializer that uses the cached URL fields for the url
+    and related fields.
+
+    """
+    serializer_related_field = CachedHyperlinkedRelatedField
+    serializer_url_field = CachedHyperlinkedIdentityField
+
+
+def requested_fields(request):
+    """
+    Get the field names requested by the ``fields`` query parameter of a read
+    request.
+
+    :param request: REST framework request or None
+    :return: set of field names or None if all fields are requested
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    fields = request.GET.get('fields')
+    if not fields:
+        return None
+    return set(name.strip() for name in fields.split(',')) - {''}
+
+
+class SparseFieldsMixin(object):
+    """
+    Serializer mixin that removes the fields not requested by the ``fields``
+    query parameter of a read request, so that they are not computed.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        requested = requested_fields(self.context.get('request'))
+        if requested is not None:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
+def recent_caffeine_message(ctype):
+    return (
+        'Your last %(drink)s was less than %(minutes)d minutes ago.'
+    ) % dict(
+        drink=READABLE_DRINK_TYPES[ctype][0],
+        minutes=settings.MINIMUM_DRINK_DISTANCE)
 
 
 class NoRecentCaffeineValidator(BaseUniqueForValidator):
@@ -41,15 +151,12 @@ class NoRecentCaffeineValidator(BaseUniqueForValidator):
         user = attrs[self.user_field]
         date = attrs[self.date_field]
         ctype = attrs[self.field]
-        self.message = (
-            'Your last %(drink)s was less than %(minutes)d minutes ago.'
-        ) % dict(
-            drink=READABLE_DRINK_TYPES[ctype][0],
-            minutes=settings.MINIMUM_DRINK_DISTANCE)
+        self.message = recent_caffeine_message(ctype)
         return Caffeine.objects.recent_caffeine_queryset(user, date, ctype)
 
 
-class CaffeineSerializer(serializers.HyperlinkedModelSerializer):
+class CaffeineSerializer(
+        SparseFieldsMixin, CachedUrlHyperlinkedModelSerializer):
     ctype = CaffeineField()
 
     class Meta:
@@ -66,9 +173,10 @@ class CaffeineSerializer(serializers.HyperlinkedModelSerializer):
     ]
 
 
-class UserCaffeineSerializer(serializers.HyperlinkedModelSerializer):
+class UserCaffeineSerializer(
+        SparseFieldsMixin, CachedUrlHyperlinkedModelSerializer):
     ctype = CaffeineField()
-    user = serializers.HyperlinkedRelatedField(
+    user = CachedHyperlinkedRelatedField(
         read_only=True, view_name='user-detail', lookup_field='username', default=serializers.CurrentUserDefault())
 
     class Meta:
@@ -88,13 +196,40 @@ class UserCaffeineSerializer(serializers.HyperlinkedModelSerializer):
             self.validated_data['timezone'] = user.timezone
         return super(UserCaffeineSerializer, self).save()
 
+    def create(self, validated_data):
+        """
+        Create the caffeine entry with the minimum drink distance checked
+        again by the database under the per-user lock, the validator alone
+        cannot prevent concurrent submissions from passing.
+
+        """
+        try:
+            return Caffeine.objects.create_unless_recent(
+                Caffeine(**validated_data))
+        except DjangoValidationError:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    recent_caffeine_message(validated_data['ctype'])]})
+
+
+class BulkUserCaffeineSerializer(UserCaffeineSerializer):
+    """
+    Serializer for the entries of a bulk submission. The minimum distance
+    between drinks is checked for the whole batch by
+    :py:meth:`caffeine.models.CaffeineManager.create_for_user`.
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
-    caffeines = serializers.HyperlinkedIdentityField(
+    """
+
+    class Meta(UserCaffeineSerializer.Meta):
+        validators = []
+
+
+class UserSerializer(SparseFieldsMixin, CachedUrlHyperlinkedModelSerializer):
+    caffeines = CachedHyperlinkedIdentityField(
         view_name='user-caffeine-list', lookup_field='username',
         lookup_url_kwarg='caffeine_username')
     name = serializers.SerializerMethodField()
-    profile = serializers.HyperlinkedIdentityField(
+    profile = CachedHyperlinkedIdentityField(
         view_name='public', lookup_field='username')
     counts = serializers.SerializerMethodField()
 
@@ -112,5 +247,26 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         return obj.get_full_name()
 
     def get_counts(self, obj):
+        # use the counts annotated by User.objects.with_caffeine_counts() if
+        # available to avoid one query per user
+        if hasattr(obj, 'coffee_count'):
+            return dict(
+                (ctype, getattr(obj, '{0}_count'.format(attr)))
+                for ctype, attr, _ in DRINK_TYPES._triples)
         count_items = Caffeine.objects.total_caffeine_for_user(obj)
         return count_items
+
+
+class CaffeineTombstoneSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the deletion of a caffeine entry, referencing the entry by
+    the URL it had.
+
+    """
+    url = CachedHyperlinkedRelatedField(
+        read_only=True, source='*', view_name='caffeine-detail',
+        lookup_field='caffeine_id', lookup_url_kwarg='pk')
+
+    class Meta:
+        model = CaffeineTombstone
+        fields = ('url', 'deleted')
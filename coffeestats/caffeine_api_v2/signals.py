@@ -0,0 +1,43 @@
+"""
+Signal handlers that keep the cached users of API tokens up to date.
+
+"""
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from caffeine.models import User
+
+from .authentication import invalidate_token
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_token(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Remember the stored token of a user whose token might change to allow
+    removing its cached user after saving.
+
+    """
+    instance._previous_token = None
+    if (
+        instance.pk is not None
+        and not raw
+        and (update_fields is None or "token" in update_fields)
+    ):
+        instance._previous_token = (
+            User.objects.filter(pk=instance.pk).values_list("token", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_token(sender, instance, **kwargs):
+    """
+    Remove the cached user of the current and the previous token of a
+    changed or deleted user.
+
+    """
+    invalidate_token(instance.token)
+    previous = getattr(instance, "_previous_token", None)
+    if previous != instance.token:
+        invalidate_token(previous)
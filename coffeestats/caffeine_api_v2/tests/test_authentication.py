@@ -0,0 +1,118 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from caffeine_api_v2.authentication import (
+    LRUCache,
+    _cache_key,
+    get_token_user,
+    local_cache,
+)
+
+User = get_user_model()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class UserTokenAuthenticationTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.user = User.objects.create_user(
+            "test", "test@example.org", token="s3cr3tt0k3n", is_active=True
+        )
+        self.url = reverse("user-caffeine-list", kwargs={"caffeine_username": "test"})
+
+    def tearDown(self):
+        cache.clear()
+        local_cache.clear()
+
+    def _post(self, token, hour=17):
+        return self.client.post(
+            self.url,
+            {"ctype": "coffee", "date": "2024-05-15T%02d:00:00" % hour},
+            format="json",
+            HTTP_AUTHORIZATION="Token %s" % token,
+        )
+
+    def test_authenticates_with_token(self):
+        response = self._post("s3cr3tt0k3n")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.user.caffeines.count(), 1)
+
+    def test_rejects_invalid_token(self):
+        response = self._post("wrong")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_rejects_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self._post("s3cr3tt0k3n")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cached_lookup(self):
+        self._post("s3cr3tt0k3n")
+        # only the caffeine entries are queried
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse("caffeine-list"),
+                {"fields": "date"},
+                HTTP_AUTHORIZATION="Token s3cr3tt0k3n",
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_shared_cache_holds_primary_key(self):
+        self._post("s3cr3tt0k3n")
+        pk, nonce = cache.get(_cache_key("s3cr3tt0k3n"))
+        self.assertEqual(pk, self.user.pk)
+        local_cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_token_user("s3cr3tt0k3n"), self.user)
+
+    def test_returns_copies(self):
+        first = get_token_user("s3cr3tt0k3n")
+        first.first_name = "Changed"
+        self.assertEqual(get_token_user("s3cr3tt0k3n").first_name, "")
+
+    def test_deactivation_overrides_local_caches(self):
+        self._post("s3cr3tt0k3n")
+        stale = local_cache.get(_cache_key("s3cr3tt0k3n"))
+        self.user.is_active = False
+        self.user.save()
+        # the local cache of another process still has the active user
+        local_cache.set(_cache_key("s3cr3tt0k3n"), stale, 30)
+        response = self._post("s3cr3tt0k3n", hour=18)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivation_in_other_process(self):
+        other_process_cache = LRUCache()
+        with patch("caffeine_api_v2.authentication.local_cache", other_process_cache):
+            self.assertEqual(get_token_user("s3cr3tt0k3n"), self.user)
+        self.user.is_active = False
+        self.user.save()
+        # this process fills the shared cache again
+        response = self._post("s3cr3tt0k3n")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with patch("caffeine_api_v2.authentication.local_cache", other_process_cache):
+            response = self._post("s3cr3tt0k3n", hour=18)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_unauthenticated_request(self):
+        response = self.client.get(reverse("caffeine-list"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response["WWW-Authenticate"], "Token")
+
+    def test_token_change_invalidates_cache(self):
+        self._post("s3cr3tt0k3n")
+        self.user.token = "n3wt0k3n"
+        self.user.save()
+        response = self._post("s3cr3tt0k3n")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self._post("n3wt0k3n", hour=18)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
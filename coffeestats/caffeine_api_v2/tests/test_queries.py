@@ -0,0 +1,113 @@
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from caffeine.models import Caffeine, DRINK_TYPES
+
+User = get_user_model()
+
+
+class QueryCountTestCase(APITestCase):
+    """
+    Base class for tests that ensure that the number of queries needed to
+    render a page of an API collection does not depend on the page size.
+
+    """
+    page_sizes = (1, 5, 10)
+
+    def assertNumQueriesPerPage(self, num, url):
+        for page_size in self.page_sizes:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(
+                    url, {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), page_size)
+            self.assertEqual(
+                len(context.captured_queries), num,
+                '{0} queries executed for page size {1}, {2} expected:\n'
+                '{3}'.format(
+                    len(context.captured_queries), page_size, num,
+                    '\n'.join(
+                        query['sql'] for query in context.captured_queries)))
+
+
+class CollectionQueryCountTest(QueryCountTestCase):
+    def setUp(self):
+        date = datetime(2024, 5, 15, 17)
+        for num in range(10):
+            user = User.objects.create_user(
+                'test{}'.format(num), 'test{}@example.org'.format(num),
+                token='token{}'.format(num))
+            for ctype in (DRINK_TYPES.coffee, DRINK_TYPES.mate):
+                Caffeine.objects.create(
+                    user=user, ctype=ctype,
+                    date=date - timedelta(hours=num))
+        self.user = User.objects.get(username='test0')
+        for hours in range(1, 10):
+            Caffeine.objects.create(
+                user=self.user, ctype=DRINK_TYPES.coffee,
+                date=date + timedelta(hours=hours))
+        self.client.force_authenticate(user=self.user)
+
+    def test_caffeine_list(self):
+        self.assertNumQueriesPerPage(1, reverse('caffeine-list'))
+
+    def test_user_list(self):
+        self.assertNumQueriesPerPage(1, reverse('user-list'))
+
+    def test_user_caffeine_list(self):
+        self.assertNumQueriesPerPage(2, reverse(
+            'user-caffeine-list', kwargs={'caffeine_username': 'test0'}))
+
+    def test_user_list_without_counts(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                reverse('user-list'), {'fields': 'username'})
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertNotIn('caffeinesummary', context.captured_queries[0]['sql'])
+        self.assertEqual(
+            response.data['results'][0], {'username': 'test0'})
+
+    def test_user_batch(self):
+        url = reverse('user-list')
+        for count in (1, 5, 10):
+            usernames = ['test{}'.format(num) for num in range(count)]
+            with self.assertNumQueries(1):
+                response = self.client.get(
+                    url, {'usernames': ','.join(usernames + ['unknown'])})
+            self.assertEqual(
+                [item['username'] for item in response.data['results']],
+                usernames)
+            self.assertEqual(response.data['missing'], ['unknown'])
+        self.assertEqual(
+            response.data['results'][0]['counts'],
+            {DRINK_TYPES.coffee: 10, DRINK_TYPES.mate: 1})
+
+    def test_user_batch_is_limited(self):
+        with self.settings(API_MAX_BATCH_SIZE=2):
+            response = self.client.get(
+                reverse('user-list'), {'usernames': 'test0,test1,test2'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_user_named_batch(self):
+        User.objects.create_user('batch', 'batch@example.org', token='batch')
+        response = self.client.get(
+            reverse('user-detail', kwargs={'username': 'batch'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], 'batch')
+
+    def test_user_list_counts(self):
+        response = self.client.get(reverse('user-list'))
+        counts = dict(
+            (item['username'], item['counts'])
+            for item in response.data['results'])
+        self.assertEqual(
+            counts['test0'], {DRINK_TYPES.coffee: 10, DRINK_TYPES.mate: 1})
+        self.assertEqual(
+            counts['test1'], {DRINK_TYPES.coffee: 1, DRINK_TYPES.mate: 1})
@@ -7,6 +7,7 @@ from django.http import HttpRequest
 from django.test import TestCase
 from django.utils import timezone
 from unittest.mock import MagicMock
+from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.reverse import reverse
 from rest_framework.test import APIRequestFactory
@@ -153,3 +154,67 @@ class UserSerializerTest(TestCase):
                     'caffeine_username': self.user.username
                 }, request=self.request)
         )
+
+
+class PlainCaffeineSerializer(CaffeineSerializer):
+    serializer_related_field = serializers.HyperlinkedRelatedField
+    serializer_url_field = serializers.HyperlinkedIdentityField
+
+
+class PlainUserCaffeineSerializer(UserCaffeineSerializer):
+    serializer_url_field = serializers.HyperlinkedIdentityField
+    user = serializers.HyperlinkedRelatedField(
+        read_only=True, view_name='user-detail', lookup_field='username')
+
+
+class PlainUserSerializer(UserSerializer):
+    serializer_url_field = serializers.HyperlinkedIdentityField
+    caffeines = serializers.HyperlinkedIdentityField(
+        view_name='user-caffeine-list', lookup_field='username',
+        lookup_url_kwarg='caffeine_username')
+    profile = serializers.HyperlinkedIdentityField(
+        view_name='public', lookup_field='username')
+
+
+class CachedUrlFieldTest(TestCase):
+    def setUp(self):
+        super(CachedUrlFieldTest, self).setUp()
+        now = datetime.now()
+        for num, username in enumerate(
+                ('test', 'j\xf6rg', 'a.b+c@example.org', 'under_score-1')):
+            user = User.objects.create_user(
+                username, 'test{}@example.org'.format(num),
+                token='token{}'.format(num))
+            Caffeine.objects.create(
+                ctype=DRINK_TYPES.coffee, user=user, date=now)
+        self.request = APIRequestFactory().get(
+            '/api/v2/users/', secure=True)
+
+    def _assert_same_output(self, serializer_class, plain_class, queryset):
+        context = {'request': self.request}
+        expected = plain_class(queryset, many=True, context=context).data
+        self.assertEqual(
+            serializer_class(queryset, many=True, context=context).data,
+            expected)
+
+    def test_caffeine_serializer(self):
+        self._assert_same_output(
+            CaffeineSerializer, PlainCaffeineSerializer,
+            Caffeine.objects.select_related('user'))
+
+    def test_user_caffeine_serializer(self):
+        self._assert_same_output(
+            UserCaffeineSerializer, PlainUserCaffeineSerializer,
+            Caffeine.objects.select_related('user'))
+
+    def test_user_serializer(self):
+        self._assert_same_output(
+            UserSerializer, PlainUserSerializer, User.objects.all())
+
+    def test_templates_cached_on_request(self):
+        UserSerializer(
+            User.objects.all(), many=True,
+            context={'request': self.request}).data
+        self.assertEqual(
+            sorted(key[0] for key in self.request._url_templates),
+            ['public', 'user-caffeine-list', 'user-detail'])
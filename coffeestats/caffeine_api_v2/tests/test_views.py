@@ -1,15 +1,24 @@
 from __future__ import unicode_literals, print_function
 
-from datetime import datetime
+import base64
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from unittest.mock import ANY, patch
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
-from caffeine.models import Caffeine, DRINK_TYPES
+from caffeine.models import Caffeine, CaffeineSummary, DRINK_TYPES
+from caffeine_api_v2.pagination import CaffeineCursorPagination
+from caffeine_api_v2.serializers import NoRecentCaffeineValidator
 
 User = get_user_model()
 
@@ -37,6 +46,26 @@ class CaffeineViewTest(APITestCase):
         self.assertIn('entrytime', response.data)
         self.assertIn('timezone', response.data)
 
+    def test_create_checks_distance_in_database(self):
+        """
+        Ensure a submission that passes the validator concurrently with
+        another one is rejected by the database check.
+        """
+        user = User.objects.create_user(
+            username='test', email='test@example.org')
+        date = datetime(2024, 5, 15, 17)
+        Caffeine.objects.create(user=user, ctype=DRINK_TYPES.coffee, date=date)
+        url = reverse(
+            'user-caffeine-list', kwargs={'caffeine_username': 'test'})
+        self.client.force_authenticate(user=user)
+        with patch.object(NoRecentCaffeineValidator, '__call__'):
+            response = self.client.post(url, {
+                'ctype': 'coffee', 'date': date + timedelta(minutes=1)},
+                format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('non_field_errors', response.data)
+        self.assertEqual(user.caffeines.count(), 1)
+
 
 class UserCaffeineViewSetTest(APITestCase):
     def test_get_queryset(self):
@@ -48,7 +77,8 @@ class UserCaffeineViewSetTest(APITestCase):
         self.client.force_authenticate(user=user)
         response = self.client.get(url)
         self.assertIsNotNone(response)
-        self.assertEqual(len(response.data), 0)
+        self.assertEqual(len(response.data['results']), 0)
+        self.assertIsNone(response.data['next'])
 
     def test_has_user_caffeine(self):
         user = User.objects.create_user(
@@ -63,7 +93,7 @@ class UserCaffeineViewSetTest(APITestCase):
         self.client.force_authenticate(user=user)
         response = self.client.get(url)
         self.assertIsNotNone(response)
-        data = response.data
+        data = response.data['results']
         self.assertEqual(len(data), 2)
         self.assertTrue(data[0]['url'].is_hyperlink)
         self.assertTrue(data[1]['url'].is_hyperlink)
@@ -75,6 +105,352 @@ class UserCaffeineViewSetTest(APITestCase):
                 'user-detail', kwargs={'username': user.username})))
 
 
+class BulkCaffeineTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='test', email='test@example.org',
+            timezone='Europe/Berlin')
+        self.url = reverse(
+            'user-caffeine-bulk', kwargs={'caffeine_username': 'test'})
+        self.date = datetime(2024, 5, 15, 17)
+        Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.coffee, date=self.date)
+        self.client.force_authenticate(user=self.user)
+
+    def test_bulk_create(self):
+        entries = [
+            {'ctype': 'coffee', 'date': self.date + timedelta(hours=1)},
+            {'ctype': 'coffee', 'date': self.date + timedelta(minutes=3)},
+            {'ctype': 'mate', 'date': self.date + timedelta(minutes=3),
+             'timezone': 'UTC'},
+            {'ctype': 'coffee',
+             'date': self.date + timedelta(hours=1, minutes=2)},
+            {'ctype': 'tea', 'date': self.date},
+            {'ctype': 'coffee', 'date': self.date - timedelta(minutes=5)},
+        ]
+        response = self.client.post(self.url, entries, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(
+            [result['status'] for result in results],
+            [201, 400, 201, 400, 400, 201])
+        self.assertEqual(results[0]['caffeine']['ctype'], 'coffee')
+        self.assertEqual(results[0]['caffeine']['timezone'], 'Europe/Berlin')
+        self.assertEqual(results[2]['caffeine']['timezone'], 'UTC')
+        self.assertIn('non_field_errors', results[1]['errors'])
+        self.assertIn('ctype', results[4]['errors'])
+        self.assertEqual(self.user.caffeines.count(), 4)
+        self.assertEqual(
+            CaffeineSummary.objects.get(
+                user=self.user, ctype=DRINK_TYPES.coffee).count, 3)
+
+    def test_bulk_create_requires_list(self):
+        response = self.client.post(
+            self.url, {'ctype': 'coffee', 'date': self.date}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_size_is_limited(self):
+        with self.settings(API_MAX_BULK_SIZE=1):
+            response = self.client.post(self.url, [
+                {'ctype': 'mate', 'date': self.date},
+                {'ctype': 'mate', 'date': self.date + timedelta(hours=1)},
+            ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.user.caffeines.count(), 1)
+
+    def test_bulk_create_for_other_user(self):
+        User.objects.create_user(
+            username='other', email='other@example.org', token='other')
+        response = self.client.post(
+            reverse('user-caffeine-bulk',
+                    kwargs={'caffeine_username': 'other'}),
+            [{'ctype': 'mate', 'date': self.date}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class PaginationTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='test', email='test@example.org')
+        self.client.force_authenticate(user=self.user)
+        date = datetime(2024, 5, 15, 17)
+        for hours in (0, 0, 0, 1, 2, 3, 4):
+            Caffeine.objects.create(
+                user=self.user, ctype=DRINK_TYPES.coffee,
+                date=date - timedelta(hours=hours))
+
+    def _collect(self, url):
+        items = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            items.extend(response.data['results'])
+            url = response.data['next']
+        return items
+
+    def test_caffeine_pages(self):
+        url = '{}?page_size=2'.format(reverse('caffeine-list'))
+        items = self._collect(url)
+        expected = Caffeine.objects.order_by('-date', '-id')
+        self.assertEqual(
+            [item['url'] for item in items],
+            ['http://testserver{}'.format(
+                reverse('caffeine-detail', kwargs={'pk': caffeine.pk}))
+             for caffeine in expected])
+
+    def test_caffeine_pages_with_equal_dates_use_keyset(self):
+        url = '{}?page_size=1'.format(reverse('caffeine-list'))
+        response = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('OFFSET', queries[-1]['sql'])
+        self.assertEqual(len(self._collect(url)), 7)
+
+    def test_caffeine_previous_pages(self):
+        url = '{}?page_size=2'.format(reverse('caffeine-list'))
+        pages = []
+        while url:
+            response = self.client.get(url)
+            pages.append(response.data['results'])
+            url = response.data['next']
+        url = response.data['previous']
+        for page in reversed(pages[:-1]):
+            response = self.client.get(url)
+            self.assertEqual(response.data['results'], page)
+            url = response.data['previous']
+        self.assertIsNone(url)
+
+    def test_invalid_cursor_position(self):
+        response = self.client.get(reverse('caffeine-list'), {
+            'cursor': base64.b64encode(b'p=garbage').decode('ascii')})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_user_caffeine_pages(self):
+        url = '{}?page_size=3'.format(reverse(
+            'user-caffeine-list', kwargs={'caffeine_username': 'test'}))
+        self.assertEqual(len(self._collect(url)), 7)
+
+    def test_user_pages(self):
+        for num in range(4):
+            User.objects.create_user(
+                'user{}'.format(num), 'user{}@example.org'.format(num),
+                token='token{}'.format(num))
+        url = '{}?page_size=2'.format(reverse('user-list'))
+        self.assertEqual(
+            [item['username'] for item in self._collect(url)],
+            ['test', 'user0', 'user1', 'user2', 'user3'])
+
+    def test_default_page_size(self):
+        response = self.client.get(reverse('caffeine-list'))
+        self.assertEqual(len(response.data['results']), 7)
+
+    def test_page_size_is_limited(self):
+        with patch.object(CaffeineCursorPagination, 'max_page_size', 3):
+            response = self.client.get(
+                '{}?page_size=1000'.format(reverse('caffeine-list')))
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNotNone(response.data['next'])
+
+
+class SparseFieldsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            'test', 'test@example.org', token='token')
+        date = datetime(2024, 5, 15, 17)
+        for hours, ctype in ((2, DRINK_TYPES.mate), (1, DRINK_TYPES.coffee)):
+            Caffeine.objects.create(
+                user=self.user, ctype=ctype, date=date + timedelta(hours=hours))
+        self.client.force_authenticate(user=self.user)
+
+    def test_caffeine_fields(self):
+        response = self.client.get(
+            reverse('caffeine-list'), {'fields': 'date,ctype'})
+        self.assertEqual(
+            response.data['results'],
+            [{'date': '2024-05-15T19:00:00', 'ctype': 'mate'},
+             {'date': '2024-05-15T18:00:00', 'ctype': 'coffee'}])
+
+    def test_user_fields(self):
+        response = self.client.get(
+            reverse('user-list'), {'fields': 'username, counts'})
+        self.assertEqual(
+            response.data['results'],
+            [{'username': 'test',
+              'counts': {DRINK_TYPES.coffee: 1, DRINK_TYPES.mate: 1}}])
+
+    def test_fields_ignored_for_writes(self):
+        response = self.client.post(
+            '{}?fields=date'.format(reverse(
+                'user-caffeine-list', kwargs={'caffeine_username': 'test'})),
+            {'ctype': 'coffee', 'date': datetime(2024, 5, 16, 17)},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['ctype'], 'coffee')
+
+    def test_columnar_layout(self):
+        for url in (reverse('caffeine-list'), reverse(
+                'user-caffeine-list', kwargs={'caffeine_username': 'test'})):
+            response = self.client.get(
+                url, {'layout': 'columns', 'page_size': 1})
+            self.assertEqual(
+                response.data['results'],
+                {'date': ['2024-05-15T19:00:00'], 'ctype': ['mate']})
+            response = self.client.get(response.data['next'])
+            self.assertEqual(
+                response.data['results'],
+                {'date': ['2024-05-15T18:00:00'], 'ctype': ['coffee']})
+
+    def test_unknown_layout(self):
+        response = self.client.get(
+            reverse('caffeine-list'), {'layout': 'rows'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExportTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            'test', 'test@example.org', token='token')
+        date = datetime(2024, 5, 15, 17)
+        for hours, ctype in ((2, DRINK_TYPES.mate), (1, DRINK_TYPES.coffee)):
+            Caffeine.objects.create(
+                user=self.user, ctype=ctype, date=date + timedelta(hours=hours),
+                timezone='Europe/Berlin')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse(
+            'user-caffeine-export', kwargs={'caffeine_username': 'test'})
+
+    def _content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf8')
+
+    def test_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [
+            json.loads(line)
+            for line in self._content(response).splitlines()]
+        self.assertEqual(
+            [(line['ctype'], line['date']) for line in lines],
+            [('coffee', '2024-05-15T18:00:00'),
+             ('mate', '2024-05-15T19:00:00')])
+        self.assertEqual(lines[0]['timezone'], 'Europe/Berlin')
+        self.assertIn('entrytime', lines[0])
+
+    def test_csv(self):
+        response = self.client.get(self.url, {'type': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('test.csv', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(self._content(response))))
+        self.assertEqual(rows[0], ['ctype', 'date', 'entrytime', 'timezone'])
+        self.assertEqual(
+            [row[:2] for row in rows[1:]],
+            [['coffee', '2024-05-15T18:00:00'],
+             ['mate', '2024-05-15T19:00:00']])
+
+    def test_unknown_type(self):
+        response = self.client.get(self.url, {'type': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ChangesTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            'test', 'test@example.org', token='token')
+        self.caffeine = Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.coffee,
+            date=datetime(2024, 5, 15, 17))
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse(
+            'user-caffeine-changes', kwargs={'caffeine_username': 'test'})
+
+    def _age_entries(self):
+        Caffeine.objects.filter(user=self.user).update(
+            modified=timezone.now() - timedelta(hours=1))
+
+    def test_full_sync(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['changed']), 1)
+        self.assertEqual(response.data['deleted'], [])
+        self.assertFalse(response.data['more'])
+        self.assertIn('cursor', response.data)
+
+    def test_full_sync_pages(self):
+        for hour in (18, 19, 20):
+            Caffeine.objects.create(
+                user=self.user, ctype=DRINK_TYPES.coffee,
+                date=datetime(2024, 5, 15, hour))
+        self._age_entries()
+        dates = []
+        params = {'page_size': 2}
+        while True:
+            response = self.client.get(self.url, params)
+            dates.extend(item['date'] for item in response.data['changed'])
+            params['since'] = response.data['cursor']
+            if not response.data['more']:
+                break
+        self.assertEqual(dates, [
+            '2024-05-15T17:00:00', '2024-05-15T18:00:00',
+            '2024-05-15T19:00:00', '2024-05-15T20:00:00'])
+
+    def test_changes_since_cursor(self):
+        old = Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.mate,
+            date=datetime(2024, 5, 14, 17))
+        self._age_entries()
+        old_url = self.client.get(self.url).data['changed'][1]['url']
+        since = self.client.get(self.url).data['cursor']
+        self.assertEqual(
+            self.client.get(self.url, {'since': since}).data,
+            {'cursor': ANY, 'more': False, 'changed': [], 'deleted': []})
+        Caffeine.objects.create(
+            user=self.user, ctype=DRINK_TYPES.mate,
+            date=datetime(2024, 5, 15, 18))
+        self.client.delete(reverse(
+            'user-caffeine-detail',
+            kwargs={'caffeine_username': 'test', 'pk': old.pk}))
+        response = self.client.get(self.url, {'since': since})
+        self.assertEqual(
+            [item['date'] for item in response.data['changed']],
+            ['2024-05-15T18:00:00'])
+        self.assertEqual(
+            [item['url'] for item in response.data['deleted']], [old_url])
+
+    def test_changes_include_updates(self):
+        self._age_entries()
+        since = self.client.get(self.url).data['cursor']
+        response = self.client.put(
+            reverse('user-caffeine-detail', kwargs={
+                'caffeine_username': 'test', 'pk': self.caffeine.pk}),
+            {'ctype': 'mate', 'date': '2024-05-15T17:00:00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url, {'since': since})
+        self.assertEqual(
+            [item['ctype'] for item in response.data['changed']], ['mate'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_with_offset(self):
+        since = base64.urlsafe_b64encode(json.dumps([
+            ['2024-05-15T17:00:00+02:00', 0],
+            [timezone.now().isoformat() + '+00:00', 0],
+        ]).encode('ascii')).decode('ascii')
+        response = self.client.get(self.url, {'since': since})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_expired_cursor(self):
+        since = base64.urlsafe_b64encode(json.dumps([
+            ['2024-05-15T17:00:00', 0], ['2024-05-15T17:00:00', 0],
+        ]).encode('ascii')).decode('ascii')
+        response = self.client.get(self.url, {'since': since})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Expired', response.data[0])
+
+
 class UsageAgreementTest(TransactionTestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -1,20 +1,175 @@
+import base64
+import csv
+import json
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.views.generic import TemplateView
-from rest_framework import permissions, viewsets
+from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 
-from caffeine.models import Caffeine, User
+from caffeine.models import DRINK_TYPES, Caffeine, CaffeineTombstone, User
+from core.utils import Echo
 
+from .pagination import CaffeineCursorPagination, UserCursorPagination
 from .permissions import IsOwnCaffeineOrReadOnly, IsOwnerOrReadOnly
-from .serializers import CaffeineSerializer, UserCaffeineSerializer, UserSerializer
+from .serializers import (
+    BulkUserCaffeineSerializer,
+    CaffeineSerializer,
+    CaffeineTombstoneSerializer,
+    UserCaffeineSerializer,
+    UserSerializer,
+    recent_caffeine_message,
+    requested_fields,
+)
+
+
+EXPORT_FIELDS = ("ctype", "date", "entrytime", "timezone")
+EXPORT_DRINK_TYPES = dict((key, attr) for key, attr, _ in DRINK_TYPES._triples)
+
+
+def export_rows(queryset):
+    """
+    Iterate over the export rows of caffeine entries using a server-side
+    cursor.
+
+    :param QuerySet queryset: caffeine entries
+    :return: generator of tuples with the values of EXPORT_FIELDS
+    """
+    for ctype, date, entrytime, entry_timezone in queryset.values_list(
+        *EXPORT_FIELDS
+    ).iterator(chunk_size=settings.API_EXPORT_CHUNK_SIZE):
+        yield (
+            EXPORT_DRINK_TYPES[ctype],
+            date.isoformat(),
+            entrytime.isoformat(),
+            entry_timezone,
+        )
+
+
+def export_csv(queryset):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in export_rows(queryset):
+        yield writer.writerow(row)
+
+
+def export_ndjson(queryset):
+    for row in export_rows(queryset):
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n"
+
+
+EXPORT_FORMATS = {
+    "csv": (export_csv, "text/csv"),
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+}
+
+
+def encode_sync_cursor(changed_after, deleted_after):
+    """
+    Encode the positions of the changed and the deleted entries into an
+    opaque sync cursor.
+
+    :param tuple changed_after: (modification time, id) tuple
+    :param tuple deleted_after: (deletion time, id) tuple
+    :return: cursor string
+    """
+    positions = [[time.isoformat(), pk] for time, pk in (changed_after, deleted_after)]
+    return base64.urlsafe_b64encode(json.dumps(positions).encode("ascii")).decode(
+        "ascii"
+    )
+
+
+def decode_sync_cursor(cursor):
+    """
+    Decode the positions of the changed and the deleted entries from a sync
+    cursor.
+
+    :param str cursor: cursor string
+    :return: tuple of the (time, id) tuples of the changed and the deleted
+        entries
+    :raises ValidationError: if the cursor is invalid
+    """
+    try:
+        positions = []
+        for time, pk in json.loads(base64.urlsafe_b64decode(cursor.encode("ascii"))):
+            time = parse_datetime(time)
+            if time is None or not isinstance(pk, int):
+                raise ValueError(cursor)
+            if timezone.is_aware(time):
+                time = timezone.make_naive(time)
+            positions.append((time, pk))
+        changed_after, deleted_after = positions
+    except (TypeError, ValueError, UnicodeError):
+        raise ValidationError("Invalid since cursor.")
+    return changed_after, deleted_after
 
 
-class CaffeineViewSet(viewsets.ReadOnlyModelViewSet):
+def sync_page(queryset, field_name, page_size, start):
+    """
+    Fetch a page of entries for the sync API.
+
+    :param QuerySet queryset: entries ordered by a time field and their id
+    :param str field_name: name of the time field
+    :param int page_size: maximum number of entries
+    :param tuple start: position to continue from if there are no further
+        entries
+    :return: tuple of the list of entries, the position to continue from and
+        whether there are further entries
+    """
+    entries = list(queryset[: page_size + 1])
+    if len(entries) > page_size:
+        entries = entries[:page_size]
+        last = entries[-1]
+        return entries, (getattr(last, field_name), last.id), True
+    return entries, start, False
+
+
+class ColumnarListMixin(object):
+    """
+    Mixin for caffeine entry collections that lists the dates and drink types
+    of a page as parallel arrays instead of a list of objects if requested by
+    ``?layout=columns``.
+    """
+
+    def list(self, request, *args, **kwargs):
+        layout = request.query_params.get("layout")
+        if layout is None:
+            return super(ColumnarListMixin, self).list(request, *args, **kwargs)
+        if layout != "columns":
+            raise ValidationError("Unsupported layout, use columns.")
+        page = self.paginate_queryset(
+            self.filter_queryset(self.get_queryset()).values("id", "date", "ctype")
+        )
+        return self.get_paginated_response(
+            {
+                "date": [item["date"].isoformat() for item in page],
+                "ctype": [EXPORT_DRINK_TYPES[item["ctype"]] for item in page],
+            }
+        )
+
+
+class CaffeineViewSet(ColumnarListMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows caffeine entries to be viewed.
     """
 
-    queryset = Caffeine.objects.all().order_by("-date")
+    queryset = Caffeine.objects.order_by("-date", "-id")
     serializer_class = CaffeineSerializer
+    pagination_class = CaffeineCursorPagination
+
+    def get_queryset(self):
+        queryset = super(CaffeineViewSet, self).get_queryset()
+        fields = requested_fields(self.request)
+        if fields is None or "user" in fields:
+            queryset = queryset.select_related("user")
+        return queryset
 
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
@@ -22,18 +177,57 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     API endpoint that allows users to be viewed.
     """
 
-    queryset = User.objects.all().order_by("username")
+    queryset = User.objects.order_by("username")
     serializer_class = UserSerializer
+    pagination_class = UserCursorPagination
     lookup_field = "username"
     lookup_value_regex = r"[\w@.+_-]+"
 
+    def get_queryset(self):
+        fields = requested_fields(self.request)
+        if fields is None or "counts" in fields:
+            return User.objects.with_caffeine_counts().order_by("username")
+        return super(UserViewSet, self).get_queryset()
+
+    def list(self, request, *args, **kwargs):
+        """
+        List the users or, if the ``usernames`` parameter is given, get the
+        users with the comma separated usernames in one query. Unknown
+        usernames of such a batch lookup are listed in ``missing``.
+        """
+        if "usernames" not in request.query_params:
+            return super(UserViewSet, self).list(request, *args, **kwargs)
+        usernames = list(
+            dict.fromkeys(
+                name.strip()
+                for name in request.query_params["usernames"].split(",")
+                if name.strip()
+            )
+        )
+        if len(usernames) > settings.API_MAX_BATCH_SIZE:
+            raise ValidationError(
+                "At most %d users can be requested at once."
+                % settings.API_MAX_BATCH_SIZE
+            )
+        users = self.get_queryset().in_bulk(usernames, field_name="username")
+        serializer = self.get_serializer(
+            [users[name] for name in usernames if name in users], many=True
+        )
+        return Response(
+            {
+                "results": serializer.data,
+                "missing": [name for name in usernames if name not in users],
+            }
+        )
+
 
-class UserCaffeineViewSet(viewsets.ModelViewSet):
+class UserCaffeineViewSet(ColumnarListMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows working with a users caffeine entries.
     """
 
     serializer_class = UserCaffeineSerializer
+    pagination_class = CaffeineCursorPagination
     permission_classes = (
         permissions.IsAuthenticatedOrReadOnly,
         IsOwnCaffeineOrReadOnly,
@@ -51,7 +245,144 @@ class UserCaffeineViewSet(viewsets.ModelViewSet):
     view_owner = property(_get_view_owner)
 
     def get_queryset(self):
-        return self.view_owner.caffeines.all().order_by("-date")
+        return self.view_owner.caffeines.all().order_by("-date", "-id")
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request, *args, **kwargs):
+        """
+        Create a list of caffeine entries at once. The response contains a
+        result with a status code and either the created entry or the
+        validation errors for each submitted entry.
+        """
+        if not isinstance(request.data, list):
+            raise ValidationError("Expected a list of caffeine entries.")
+        if len(request.data) > settings.API_MAX_BULK_SIZE:
+            raise ValidationError(
+                "At most %d caffeine entries can be submitted at once."
+                % settings.API_MAX_BULK_SIZE
+            )
+        context = self.get_serializer_context()
+        serializers = [
+            BulkUserCaffeineSerializer(data=item, context=context)
+            for item in request.data
+        ]
+        valid = [serializer for serializer in serializers if serializer.is_valid()]
+        created = dict(
+            zip(
+                valid,
+                Caffeine.objects.create_for_user(
+                    self.view_owner,
+                    [serializer.validated_data for serializer in valid],
+                ),
+            )
+        )
+        results = []
+        for serializer in serializers:
+            if serializer.errors:
+                results.append(
+                    {"status": status.HTTP_400_BAD_REQUEST, "errors": serializer.errors}
+                )
+            elif created[serializer] is None:
+                results.append(
+                    {
+                        "status": status.HTTP_400_BAD_REQUEST,
+                        "errors": {
+                            "non_field_errors": [
+                                recent_caffeine_message(
+                                    serializer.validated_data["ctype"]
+                                )
+                            ]
+                        },
+                    }
+                )
+            else:
+                results.append(
+                    {
+                        "status": status.HTTP_201_CREATED,
+                        "caffeine": UserCaffeineSerializer(
+                            created[serializer], context=context
+                        ).data,
+                    }
+                )
+        return Response({"results": results})
+
+    @action(detail=False, methods=["get"])
+    def export(self, request, *args, **kwargs):
+        """
+        Stream all caffeine entries of the user ordered by date as
+        newline-delimited JSON or, with ``?type=csv``, as CSV.
+        """
+        export_type = request.query_params.get("type", "ndjson")
+        if export_type not in EXPORT_FORMATS:
+            raise ValidationError(
+                "Unsupported export type, choose one of %s."
+                % ", ".join(sorted(EXPORT_FORMATS))
+            )
+        generator, content_type = EXPORT_FORMATS[export_type]
+        response = StreamingHttpResponse(
+            generator(self.view_owner.caffeines.order_by("date", "id")),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = 'attachment; filename="%s.%s"' % (
+            self.view_owner.username,
+            export_type,
+        )
+        return response
+
+    @action(detail=False, methods=["get"])
+    def changes(self, request, *args, **kwargs):
+        """
+        Return the caffeine entries of the user that have been created or
+        changed and the ones that have been deleted after the position given
+        by the ``since`` cursor, or all entries if it is missing. Every list
+        holds at most one page of entries and ``more`` tells whether there are
+        further entries to fetch with the returned cursor.
+
+        Once all changes have been returned the cursor lies
+        ``API_SYNC_CURSOR_MARGIN`` seconds in the past to include entries
+        committed late, so clients have to expect changes they already know.
+        Cursors older than ``API_SYNC_TOMBSTONE_DAYS`` days are rejected and
+        clients have to synchronize all entries again.
+        """
+        now = timezone.now()
+        start = (now - timedelta(seconds=settings.API_SYNC_CURSOR_MARGIN), 0)
+        since = request.query_params.get("since")
+        if since is None:
+            changed_after, deleted_after = None, start
+        else:
+            changed_after, deleted_after = decode_sync_cursor(since)
+            if deleted_after[0] < now - timedelta(
+                days=settings.API_SYNC_TOMBSTONE_DAYS
+            ):
+                raise ValidationError(
+                    "Expired since cursor, synchronize all entries again."
+                )
+        page_size = self.paginator.get_page_size(request)
+        changed, changed_after, more_changed = sync_page(
+            Caffeine.objects.changed_after(self.view_owner, changed_after),
+            "modified",
+            page_size,
+            start,
+        )
+        deleted, deleted_after, more_deleted = sync_page(
+            CaffeineTombstone.objects.deleted_after(self.view_owner, deleted_after),
+            "deleted",
+            page_size,
+            start,
+        )
+        context = self.get_serializer_context()
+        return Response(
+            {
+                "cursor": encode_sync_cursor(changed_after, deleted_after),
+                "more": more_changed or more_deleted,
+                "changed": UserCaffeineSerializer(
+                    changed, many=True, context=context
+                ).data,
+                "deleted": CaffeineTombstoneSerializer(
+                    deleted, many=True, context=context
+                ).data,
+            }
+        )
 
 
 class UsageAgreement(LoginRequiredMixin, TemplateView):
@@ -0,0 +1,28 @@
+"""
+ASGI config for the coffeestats project.
+
+This module contains the ASGI application used by ASGI servers like uvicorn
+or daphne. It exposes a module-level variable named ``application`` that is
+referenced by the ``ASGI_APPLICATION`` setting.
+
+The overall statistics page is an asynchronous view. The other views are
+synchronous and run in a thread pool. Streaming responses like the activity
+downloads are collected in memory by the ASGI handler, see
+``docs/deploy.rst``.
+
+"""
+
+import os
+from os.path import abspath, dirname
+from sys import path
+
+SITE_ROOT = dirname(dirname(abspath(__file__)))
+path.append(SITE_ROOT)
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "coffeestats.settings.production")
+
+# This application object is used by any ASGI server configured to use this
+# file.
+from django.core.asgi import get_asgi_application  # noqa
+
+application = get_asgi_application()
@@ -221,6 +221,25 @@ ACCOUNT_ACTIVATION_DAYS = 2
 EMAIL_CHANGE_ACTION_VALIDITY = 2
 MINIMUM_DRINK_DISTANCE = 5
 CAFFEINE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# number of rows fetched at once when exporting caffeine entries to CSV
+CAFFEINE_EXPORT_CHUNK_SIZE = 2000
+# attempts to send a queued export by email and seconds until the first retry,
+# the delay doubles with every failed attempt
+CAFFEINE_EXPORT_MAX_ATTEMPTS = 5
+CAFFEINE_EXPORT_RETRY_DELAY = 300
+# seconds that caffeine entries must be old before they are counted into the
+# overall statistics snapshot, covers transactions that commit late
+OVERALL_STATISTICS_LAG = 60
+# seconds that explore page sections are cached at most and seconds after
+# which they are computed again when caffeine entries or users have changed
+EXPLORE_CACHE_TIMEOUTS = {
+    "activities": (300, 10),
+    "toptotal": (3600, 300),
+    "topaverage": (3600, 300),
+    "toprecent": (1800, 120),
+    "recentlyjoined": (3600, 30),
+    "longestjoined": (86400, 3600),
+}
 
 MESSAGE_TAGS = {
     message_constants.DEBUG: "flash-debug",
@@ -238,13 +257,33 @@ INSTALLED_APPS = DJANGO_APPS + LOCAL_APPS
 # ######### REST FRAMEWORK CONFIGURATION
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
+        "caffeine_api_v2.authentication.UserTokenAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
-    "PAGINATE_BY": 10,
+    "PAGE_SIZE": 10,
 }
+# upper limit for the page_size query parameter of paginated API collections
+API_MAX_PAGE_SIZE = 100
+# upper limit for the number of entries in bulk API submissions
+API_MAX_BULK_SIZE = 100
+# upper limit for the number of users requested by a batch API lookup
+API_MAX_BATCH_SIZE = 100
+# number of rows fetched at once by streaming API exports
+API_EXPORT_CHUNK_SIZE = 2000
+# cached users of API tokens: number of entries kept in each process, seconds
+# until they expire in each process and in the shared cache
+API_TOKEN_CACHE_SIZE = 1000
+API_TOKEN_LOCAL_CACHE_TIMEOUT = 30
+API_TOKEN_CACHE_TIMEOUT = 300
+# seconds the API sync cursor lags behind to include late committed entries
+API_SYNC_CURSOR_MARGIN = 60
+# days that deletions are kept for the API sync, older cursors expire
+API_SYNC_TOMBSTONE_DAYS = 90
+# PAGE_SIZE is used by the pagination classes that are set per view
+SILENCED_SYSTEM_CHECKS = ["rest_framework.W001"]
 
 # ######### END REST FRAMEWORK CONFIGURATION
 
@@ -298,5 +337,11 @@ LOGGING = {
 WSGI_APPLICATION = "%s.wsgi.application" % SITE_NAME
 # ######### END WSGI CONFIGURATION
 
+
+# ######### ASGI CONFIGURATION
+# See: https://docs.djangoproject.com/en/dev/ref/settings/#asgi-application
+ASGI_APPLICATION = "%s.asgi.application" % SITE_NAME
+# ######### END ASGI CONFIGURATION
+
 TEST_RUNNER = "django.test.runner.DiscoverRunner"
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
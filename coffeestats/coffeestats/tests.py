@@ -29,3 +29,10 @@ class WSGITest(TestCase):
     def test_wsgi_application(self):
         from coffeestats import wsgi
         self.assertIsNotNone(wsgi.application)
+
+
+class ASGITest(TestCase):
+
+    def test_asgi_application(self):
+        from coffeestats import asgi
+        self.assertIsNotNone(asgi.application)
@@ -18,3 +18,54 @@ def json_response(func):
         return HttpResponse(json.dumps(result), content_type="text/json")
 
     return inner
+
+
+def session_exempt(view):
+    """
+    Mark a view that authenticates its requests without the session, like
+    the token authenticated submission views, to let middleware skip loading
+    the session and the user for it.
+
+    """
+    view.session_exempt = True
+    return view
+
+
+class Echo(object):
+    """
+    File-like object that returns the written value instead of buffering it
+    to let :py:class:`csv.writer` produce the lines of a streaming response.
+
+    """
+
+    def write(self, value):
+        return value
+
+
+class StreamBuffer(object):
+    """
+    Write-only file-like object that keeps the written bytes until they are
+    taken to let writers that need a file, like :py:class:`zipfile.ZipFile`,
+    produce the chunks of a streaming response.
+
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """
+        Take the bytes written since the last call.
+
+        :return: bytes
+        """
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
@@ -1,4 +1,4 @@
-/* global $, sanitize_datetime */
+/* global $, gettext, sanitize_datetime */
 $(document).ready(function(){
   "use strict";
 
@@ -52,10 +52,20 @@ $(document).ready(function(){
           $('#' + $(this).attr('data-toggle')).toggle();
         });
         $('#coffeeform').submit(function(event) {
-          return sanitize_datetime('input#id_coffeedate', 'input#id_coffeetime');
+          if (sanitize_datetime('input#id_coffeedate', 'input#id_coffeetime')) {
+            coffeestats.submitDrink(this);
+          }
+          return false;
         });
         $('#mateform').submit(function(event) {
-          return sanitize_datetime('input#id_matedate', 'input#id_matetime');
+          if (sanitize_datetime('input#id_matedate', 'input#id_matetime')) {
+            coffeestats.submitDrink(this);
+          }
+          return false;
+        });
+        $('#latestentries').on('click', 'a.deletecaffeine', function(event) {
+          event.preventDefault();
+          coffeestats.deleteDrink($(this));
         });
         $('.clockpicker').focusout(function(){
           $(this).clockpicker('hide');
@@ -64,6 +74,83 @@ $(document).ready(function(){
           $(this).datepicker('hide');
         });
       }
+    },
+
+    showDrinkMessage : function(message, level) {
+      var flash = $('#registerdrink-flash');
+      if (!flash.length) {
+        flash = $('<ul class="flash-messages" id="registerdrink-flash"></ul>');
+        flash.insertAfter('.white-box.update h2');
+      }
+      flash.append($('<li></li>').addClass('registerdrink ' + level).text(message));
+    },
+
+    updateCounts : function(counts) {
+      $.each(counts, function(drink, count) {
+        $('[data-count="' + drink + '"]').text(function(index, text) {
+          return text.replace(/\d+/, count);
+        });
+      });
+    },
+
+    addEntry : function(caffeine) {
+      var table = $('#latestentries');
+      if (!table.length) {
+        window.location.reload();
+        return;
+      }
+      var link = $('<a class="deletecaffeine"></a>')
+        .attr('href', caffeine.delete_url)
+        .attr('data-cid', caffeine.id)
+        .append($('<img />')
+          .attr('src', table.attr('data-deleteimg'))
+          .attr('alt', table.attr('data-deletealt')));
+      table.prepend($('<tr></tr>')
+        .append($('<td></td>').text(caffeine.label))
+        .append($('<td></td>').append(link)));
+    },
+
+    submitDrink : function(form) {
+      $('#registerdrink-flash').empty();
+      $.ajax({
+        url: $(form).attr('action'),
+        type: 'POST',
+        data: $(form).serialize(),
+        dataType: 'json'
+      }).done(function(data) {
+        coffeestats.showDrinkMessage(data.message, 'success');
+        coffeestats.updateCounts(data.counts);
+        coffeestats.addEntry(data.caffeine);
+      }).fail(function(xhr) {
+        if (xhr.responseJSON && xhr.responseJSON.errors) {
+          $.each(xhr.responseJSON.errors, function(index, error) {
+            coffeestats.showDrinkMessage(error, 'error');
+          });
+        } else {
+          form.submit();
+        }
+      });
+    },
+
+    deleteDrink : function(link) {
+      if (!window.confirm(gettext('Do you really want to delete this entry?'))) {
+        return;
+      }
+      $('#registerdrink-flash').empty();
+      $.ajax({
+        url: link.attr('href'),
+        type: 'POST',
+        data: {
+          csrfmiddlewaretoken: $('#coffeeform input[name="csrfmiddlewaretoken"]').val()
+        },
+        dataType: 'json'
+      }).done(function(data) {
+        link.closest('tr').remove();
+        coffeestats.showDrinkMessage(data.message, 'success');
+        coffeestats.updateCounts(data.counts);
+      }).fail(function() {
+        window.location = link.attr('href');
+      });
     }
   };
 